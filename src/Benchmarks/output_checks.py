@@ -0,0 +1,199 @@
+"""
+Regression checks of the program's output on synthetic mobility data.
+
+Unlike the benchmarks, which measure how fast the stages are, these checks verify that the output of the stages is right:
+
+    - disjoint_bands: the contour bands of every level of detail do not overlap each other, like the bands of contourf,
+      both before and after clipping them with the country's border.
+    - incremental_merge: the merged map of the incremental merge, after a full merge and after changing, adding and removing
+      a country pair, is the same as the merged map merged from scratch, with 10 and 20 levels.
+
+Every check returns the descriptions of its failures. Run them from the src folder:
+
+    python -m Benchmarks.output_checks --rows 2000
+
+The exit code is 1 if any check failed.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from Benchmarks.synthetic_data import SyntheticMobilityData
+
+# The largest area in square meters where two bands can overlap, for the rounding of the coordinates of their shared edges.
+max_overlap_area = 1.0
+
+# The largest area in square meters where the incremental and the from scratch merged maps can differ by more than the slivers
+# of the precision grid, which the incremental merge snaps the unions of its tiles to.
+max_merge_difference = 1.0
+
+
+def check_disjoint_bands(rows = 2000, cntr_od = 'ES_PT', analysis_bandwidth = 20000, program_epsg = 3035):
+
+    """
+    Checks that the contour bands of every level of detail do not overlap and are valid, before and after clipping.
+
+    The bands are compared after a round trip through WKB, like when they are read back from a GeoPackage, because the fixed
+    precision that GEOS keeps after snapping would hide the overlaps of the bands' edges.
+
+    Args:
+        rows (int): The amount of rows of the synthetic data.
+        cntr_od (str): The country pair of the synthetic data, the KDE is computed for its first country.
+        analysis_bandwidth (int): The bandwidth of the KDE in meters.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+
+    Returns:
+        list: The descriptions of the failures, empty if the check passed.
+    """
+
+    from Borders.border_service import get_border_service
+    from KDE.kde_country_organizer import CountryOrganizer
+    from KDE.kde_engine import KdeEngine
+
+    border_service = get_border_service(program_epsg)
+    df = SyntheticMobilityData(rows, [cntr_od], border_service, program_epsg).df
+    country_id = sorted(cntr_od.split('_'))[0]
+
+    engine = KdeEngine(analysis_bandwidth, 'gaussian', 'euclidean', program_epsg, border_service)
+    country_points = CountryOrganizer(df, cntr_od, country_id, 'yes', program_epsg, '300').country_points
+    kde_polygons = engine.contour_to_polygons(*engine.contour(*engine.density_grid(country_points)[:3]))
+    clipped = engine.clip_to_region(kde_polygons, border_service.country(country_id))
+
+    failures = []
+    for name, polygons in [('bands', kde_polygons), ('clipped bands', clipped)]:
+        for lod, level in engine.geometry_output.levels_of_detail(polygons).items():
+            read_back = level.set_geometry(shapely.from_wkb(shapely.to_wkb(level.geometry.to_numpy())), crs = level.crs)
+            overlap = engine.geometry_output.overlap_area(read_back)
+            invalid = int((~shapely.is_valid(read_back.geometry.to_numpy())).sum())
+
+            print(f'{name:>14} {lod}: {len(level)} bands, overlap {overlap:.1f} m², {invalid} invalid', flush = True)
+
+            if overlap > max_overlap_area:
+                failures.append(f'The {name} of {lod} overlap by {overlap:.1f} m², at most {max_overlap_area} m² is allowed.')
+            if invalid:
+                failures.append(f'{invalid} of the {name} of {lod} are invalid.')
+
+    return failures
+
+
+def synthetic_pair_polygons(rows, center, seed, precision = 20, program_epsg = 3035):
+
+    """
+    Creates synthetic KDE polygons of a country pair, a polygon for each of the 20 levels around random points near the center.
+
+    The polygons grow with the level like the cumulative levels of the merged map and are snapped to the precision grid like the
+    KDE polygons.
+
+    Args:
+        rows (int): The amount of random points the polygons are drawn around.
+        center (tuple): The x and y coordinates of the pair's center in meters.
+        seed (int): The seed of the random points.
+        precision (float): The size of the precision grid in meters.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+
+    Returns:
+        gpd.GeoDataFrame: The polygons of the levels with a level column.
+    """
+
+    rng = np.random.default_rng(seed)
+    points = shapely.points(rng.normal(center, 100000, (rows, 2)))
+    levels = np.round(np.arange(0.05, 1.0001, 0.05), 2)
+    geometries = [shapely.set_precision(shapely.union_all(shapely.buffer(points, 2000 + 20000 * level, quad_segs = 4)), precision) for level in levels]
+
+    return gpd.GeoDataFrame({'level': levels}, geometry = geometries, crs = program_epsg)
+
+
+def check_incremental_merge(rows = 2000, program_epsg = 3035, precision = 20):
+
+    """
+    Checks that the incremental merge gives the same merged map as merging all country pairs from scratch, with 10 and 20 levels.
+
+    After a full merge one pair is changed, one added and one removed, and the incremental merge of the changed pairs is compared
+    with merge_and_dissolve_levels level by level by their symmetric difference. The incremental merge snaps the unions of its tiles
+    to the precision grid, which opens or closes the gaps narrower than the grid between the polygons of different pairs, so the
+    symmetric difference is shrunk by the precision first and only what is left of it counts as a difference.
+
+    Args:
+        rows (int): The amount of rows, every pair's synthetic polygons are drawn around a twentieth of them.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        precision (float): The size of the precision grid of the polygons and the incremental merge in meters.
+
+    Returns:
+        list: The descriptions of the failures, empty if the check passed.
+    """
+
+    from StandaloneKDE.incremental_merge import IncrementalMerge
+    from StandaloneKDE.merged_map_of_all_kdes import merge_and_dissolve_levels
+
+    points = max(rows // 20, 10)
+    centers = {'ES_PT': (2900000, 2000000), 'ES_FR': (3450000, 2250000), 'BE_FR': (3850000, 2900000), 'DE_FR': (4150000, 2800000)}
+    all_kde = {cntr_od: synthetic_pair_polygons(points, center, seed, precision) for seed, (cntr_od, center) in enumerate(centers.items())}
+
+    # The steps change one pair, add one pair and remove one pair after the full merge.
+    changed_kde = dict(all_kde)
+    changed_kde['ES_PT'] = synthetic_pair_polygons(points, centers['ES_PT'], 100, precision)
+    changed_kde['DE_PL'] = synthetic_pair_polygons(points, (4600000, 3250000), 101, precision)
+    del changed_kde['BE_FR']
+    steps = [('full merge', all_kde), ('changed, added and removed pairs', changed_kde)]
+
+    failures = []
+    with tempfile.TemporaryDirectory() as state_folder:
+        for amount_of_levels in (10, 20):
+            merge_state = IncrementalMerge(os.path.join(state_folder, f'merge_state_{amount_of_levels}'), amount_of_levels, program_epsg, precision = precision)
+
+            for step, step_kde in steps:
+                pairs_kde_gdf = pd.concat([cntr_od_kde.assign(pair = cntr_od) for cntr_od, cntr_od_kde in step_kde.items()], ignore_index = True)
+                incremental = merge_state.merge(gpd.GeoDataFrame(pairs_kde_gdf, crs = program_epsg)).set_index('level').geometry
+                from_scratch = merge_and_dissolve_levels(step_kde, amount_of_levels, program_epsg).set_index('level').geometry
+
+                if sorted(incremental.index) != sorted(from_scratch.index):
+                    failures.append(f'The {step} with {amount_of_levels} levels has the levels {sorted(incremental.index)}, '
+                                    f'merged from scratch {sorted(from_scratch.index)}.')
+                    continue
+
+                differences = {level: shapely.buffer(shapely.symmetric_difference(incremental[level], from_scratch[level]), -precision).area
+                               for level in from_scratch.index}
+                print(f'{step:>34}, {amount_of_levels} levels: {merge_state.merged_tiles} tiles merged, '
+                      f'largest difference {max(differences.values()):.1f} m²', flush = True)
+
+                for level, difference in differences.items():
+                    if difference > max_merge_difference:
+                        failures.append(f'Level {level:g} of the {step} with {amount_of_levels} levels differs from the merge from scratch '
+                                        f'by {difference:.1f} m², at most {max_merge_difference} m² is allowed.')
+
+    return failures
+
+
+# The checks by name, in the order that they are run.
+checks = {'disjoint_bands': check_disjoint_bands, 'incremental_merge': check_incremental_merge}
+
+
+def main():
+
+    """Runs the output checks and exits with 1 if any of them failed."""
+
+    parser = argparse.ArgumentParser(description = 'Regression checks of the program output on synthetic mobility data.')
+    parser.add_argument('--rows', type = int, default = 2000, help = 'The amount of rows of the synthetic data.')
+    parser.add_argument('--checks', nargs = '+', choices = list(checks), default = list(checks), help = 'The checks to run, defaults to all checks.')
+    args = parser.parse_args()
+
+    failures = []
+    for name in args.checks:
+        print(f'Checking {name}...', flush = True)
+        failures += checks[name](rows = args.rows)
+
+    for failure in failures:
+        print(f'FAILED: {failure}')
+    print('All checks passed.' if not failures else f'{len(failures)} checks failed.')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+"""
+Benchmark suite of the program's stages on synthetic mobility data.
+
+For every data size the synthetic data is generated first (not timed) and then every stage is run on it in the order of the
+program: reading the CSV file, the distance calculation, organizing a country's points, the KDE density grid, the contours to polygons, writing the
+polygons to a GeoPackage, clipping them with the country's border and merging and dissolving the merged KDE polygons.
+Each stage is timed and its peak memory use is measured as the growth of the resident memory of the process, which also sees
+the memory of NumPy, pyarrow and GDAL. On Linux the peak resident memory is reset before every stage, on other systems the
+memory is measured with tracemalloc instead, which only sees the Python and NumPy allocations. The report records which.
+
+The results are written to a JSON report. The run fails (exit code 1) when a stage is over its threshold, or slower or bigger
+than in a baseline report by more than the tolerance. The thresholds are derived from the checked-in reference report
+stage_reference_report.json, a measured run, as its times and memory use times the headroom factor.
+
+Run it from the src folder:
+
+    python -m Benchmarks.stage_benchmark --sizes 10000 100000 --report stage_report.json --baseline previous_report.json
+
+The KDE density grid dominates the run time, at 100 000 rows it takes minutes, so the default size is 10 000 rows.
+The reference report has 10 000 and 100 000 rows. At 1 000 000 and 10 000 000 rows the KDE density grid alone takes hours
+to days and its time depends much on the machine, so these sizes have no thresholds and are checked against a baseline
+report of an earlier run on the same machine instead. To measure a new reference report, e.g. after a deliberate change:
+
+    python -m Benchmarks.stage_benchmark --sizes 10000 100000 --report Benchmarks/stage_reference_report.json
+"""
+
+import gc
+import os
+import sys
+import json
+import ctypes
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from Benchmarks.synthetic_data import SyntheticMobilityData
+
+# The stages in the order that they are run.
+stages = ['read_csv', 'distance', 'country_organizer', 'kde_grid', 'kde_contour', 'write_gpkg', 'clip', 'merge_and_dissolve']
+
+# The measured report which the thresholds of the stages are derived from, checked in to catch regressions.
+default_reference_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stage_reference_report.json')
+
+# How many times slower or bigger than in the reference report a stage can be.
+default_headroom = 3.0
+
+# The smallest thresholds, so that the stages which take milliseconds or a few megabytes do not fail on the noise of the measurement.
+min_threshold_seconds = 0.05
+min_threshold_mb = 10
+
+# The files of the resident memory of the process on Linux, where the peak can be reset.
+proc_status_path = '/proc/self/status'
+proc_clear_refs_path = '/proc/self/clear_refs'
+
+
+class StageBenchmark():
+
+    """
+    Runs and measures the program's stages on synthetic mobility data.
+
+    Attributes:
+        sizes (list): The amounts of rows of the synthetic data.
+        pairs (list): The country pairs of the synthetic data, the first one is used in the KDE stages.
+        selected_stages (list): The stages to run.
+        memory (bool): Whether the peak memory use of the stages is measured.
+        memory_method (str): How the memory is measured, rss for the resident memory of the process or tracemalloc, None without memory.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        results (list): The measurements, a dictionary for each stage and data size.
+
+    Methods:
+        run(self): Runs the selected stages for every data size.
+        report(self): Returns the machine-readable report of the measurements.
+        __run_size(self, rows): Runs the selected stages on one data size.
+        __measure(self, stage, rows, function): Runs and measures one stage.
+        __start_memory(self): Starts measuring the peak memory use of a stage.
+        __peak_memory_mb(self, start): Returns the peak memory use of a stage.
+    """
+
+
+    def __init__(self, sizes, pairs = ('ES_PT',), selected_stages = None, memory = True, program_epsg = 3035):
+
+        """
+        Initialize the StageBenchmark class.
+
+        Args:
+            sizes (list): The amounts of rows of the synthetic data.
+            pairs (list): The country pairs of the synthetic data, the first one is used in the KDE stages.
+            selected_stages (list, optional): The stages to run, defaults to all stages.
+            memory (bool): Whether the peak memory use of the stages is measured.
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+        """
+
+        self.sizes = sizes
+        self.pairs = list(pairs)
+        self.selected_stages = stages if selected_stages is None else selected_stages
+        self.memory = memory
+        self.memory_method = None
+        if memory:
+            self.memory_method = 'rss' if os.access(proc_clear_refs_path, os.W_OK) else 'tracemalloc'
+        self.program_epsg = program_epsg
+        self.results = []
+
+
+    def run(self):
+
+        """
+        Runs the selected stages for every data size.
+
+        Returns:
+            list: The measurements, a dictionary for each stage and data size.
+        """
+
+        for rows in self.sizes:
+            print(f'Generating {rows} rows of synthetic mobility data...', flush = True)
+            self.__run_size(rows)
+
+        return self.results
+
+
+    def report(self):
+
+        """
+        Returns the machine-readable report of the measurements.
+
+        Returns:
+            dict: The environment and the measurements.
+        """
+
+        return {
+            'benchmark': 'stages',
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+            'memory_profiled': self.memory,
+            'memory_method': self.memory_method,
+            'pairs': self.pairs,
+            'results': self.results,
+        }
+
+
+    def __run_size(self, rows):
+
+        """
+        Runs the selected stages on one data size.
+
+        The stages get the output of the previous stage, so a stage that is not selected is still run, without measuring it,
+        when a later selected stage needs its output.
+
+        Args:
+            rows (int): The amount of rows of the synthetic data.
+        """
+
+        from Borders.border_service import get_border_service
+        from data_ingestion import read_mobility_csv
+        from data_ingestion import kde_columns
+        from KDE.kde_country_organizer import CountryOrganizer
+        from KDE.kde_engine import KdeEngine
+        from Preprocess.distance_calculator import DistanceMeasure
+        from Preprocess.preprocess_parameters import PreprocessParameters
+        from StandaloneKDE.merged_map_of_all_kdes import merge_and_dissolve_levels
+
+        border_service = get_border_service(self.program_epsg)
+        df = SyntheticMobilityData(rows, self.pairs, border_service, self.program_epsg).df
+        cntr_od = self.pairs[0]
+        country_id = sorted(cntr_od.split('_'))[0]
+        engine = KdeEngine(20000, 'gaussian', 'euclidean', self.program_epsg, border_service)
+
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, 'mobility.csv')
+            df.drop(columns = 'CNTR_OD').to_csv(csv_path, index = False)
+            self.__measure('read_csv', rows, lambda: read_mobility_csv(csv_path, kde_columns))
+
+        self.__measure('distance', rows, lambda: DistanceMeasure(PreprocessParameters(type_of_distance = 'Haversine'), df.drop(columns = 'distance_km'), save_to_csv = False))
+
+        country_coordinates = self.__measure('country_organizer', rows, lambda: CountryOrganizer(df, cntr_od, country_id, 'yes', self.program_epsg, '300').country_points)
+        pred_grid, x_mesh, y_mesh, kde = self.__measure('kde_grid', rows, lambda: engine.density_grid(country_coordinates))
+        kde_polygons = self.__measure('kde_contour', rows, lambda: engine.contour_to_polygons(*engine.contour(pred_grid, x_mesh, y_mesh)))
+
+        with tempfile.TemporaryDirectory() as folder:
+            self.__measure('write_gpkg', rows, lambda: engine.geometry_output.write(kde_polygons, os.path.join(folder, 'kde.gpkg')))
+
+        clipped = self.__measure('clip', rows, lambda: engine.clip_to_region(kde_polygons, border_service.country(country_id)))
+
+        # The merged polygons are merged without loading the results from the result backend, from the clipped polygons of every pair.
+        all_kde = {pair: clipped for pair in self.pairs}
+        self.__measure('merge_and_dissolve', rows, lambda: merge_and_dissolve_levels(all_kde, 10, self.program_epsg))
+
+
+    def __measure(self, stage, rows, function):
+
+        """
+        Runs one stage and measures its wall time and peak memory use, if the stage is selected.
+
+        Args:
+            stage (str): The name of the stage.
+            rows (int): The amount of rows of the synthetic data.
+            function (callable): Runs the stage and returns its output.
+
+        Returns:
+            The output of the stage.
+        """
+
+        if stage not in self.selected_stages:
+            return function()
+
+        memory_start = self.__start_memory()
+
+        start = time.perf_counter()
+        output = function()
+        seconds = time.perf_counter() - start
+
+        peak_mb = self.__peak_memory_mb(memory_start)
+
+        self.results.append({'stage': stage, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds, 'peak_mb': peak_mb})
+        print(f"{stage:>20}: {seconds:8.3f} s" + (f", peak {peak_mb:8.1f} MB" if peak_mb is not None else ''), flush = True)
+
+        return output
+
+
+    def __start_memory(self):
+
+        """
+        Starts measuring the peak memory use of a stage.
+
+        With the resident memory the memory freed by the earlier stages is given back to the system first, so that the stage
+        cannot reuse it unseen, and the peak of the process is reset to the current resident memory, which is returned.
+
+        Returns:
+            float: The resident memory in megabytes at the start of the stage, None with tracemalloc or without memory.
+        """
+
+        if self.memory_method == 'rss':
+            release_free_memory()
+            with open(proc_clear_refs_path, 'w') as file:
+                file.write('5')
+            return read_proc_memory_mb()['VmRSS']
+
+        if self.memory_method == 'tracemalloc':
+            tracemalloc.start()
+
+        return None
+
+
+    def __peak_memory_mb(self, start):
+
+        """
+        Returns the peak memory use of a stage.
+
+        Args:
+            start (float): The resident memory in megabytes at the start of the stage, see __start_memory.
+
+        Returns:
+            float: How much the peak resident memory grew over the start of the stage, or the peak of tracemalloc, in megabytes.
+        """
+
+        if self.memory_method == 'rss':
+            return max(read_proc_memory_mb()['VmHWM'] - start, 0.0)
+
+        if self.memory_method == 'tracemalloc':
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+            return peak_mb
+
+        return None
+
+
+def release_free_memory():
+
+    """
+    Frees the unreachable Python objects and gives the free memory of the C heap back to the system with glibc's malloc_trim.
+
+    Without it the freed memory of an earlier stage stays resident, and a later stage which reuses it shows no growth of the
+    resident memory. Without glibc only the Python objects are freed.
+    """
+
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def read_proc_memory_mb():
+
+    """
+    Reads the current (VmRSS) and peak (VmHWM) resident memory of the process on Linux.
+
+    Returns:
+        dict: The VmRSS and VmHWM in megabytes.
+    """
+
+    memory = {}
+    with open(proc_status_path) as file:
+        for line in file:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                memory[key] = int(value.split()[0]) / 1024
+
+    return memory
+
+
+def thresholds_from_report(reference, headroom = default_headroom, memory_method = 'rss'):
+
+    """
+    Derives the thresholds of the stages from a measured reference report.
+
+    Every threshold is the measurement of the reference report times the headroom, but at least min_threshold_seconds and
+    min_threshold_mb. The memory thresholds are only derived if the memory of the reference report was measured the same way.
+
+    Args:
+        reference (dict): The reference report of the StageBenchmark.
+        headroom (float): How many times slower or bigger than in the reference report a stage can be.
+        memory_method (str): How the memory of the checked report is measured, rss or tracemalloc.
+
+    Returns:
+        dict: The maximum seconds and peak memory of the stages by data size, e.g. {'kde_grid': {'10000': {'max_seconds': 110}}}.
+    """
+
+    thresholds = {}
+    for result in reference['results']:
+        limits = {'max_seconds': round(max(result['seconds'] * headroom, min_threshold_seconds), 3)}
+        if result['peak_mb'] is not None and reference.get('memory_method') == memory_method:
+            limits['max_peak_mb'] = round(max(result['peak_mb'] * headroom, min_threshold_mb), 1)
+        thresholds.setdefault(result['stage'], {})[str(result['rows'])] = limits
+
+    return thresholds
+
+
+def check_report(report, thresholds = None, baseline = None, tolerance = 1.5):
+
+    """
+    Checks the measurements of a report against the thresholds and a baseline report.
+
+    Args:
+        report (dict): The report of the StageBenchmark.
+        thresholds (dict, optional): The maximum seconds and peak memory of the stages by data size,
+            e.g. {'kde_grid': {'10000': {'max_seconds': 30, 'max_peak_mb': 500}}}.
+        baseline (dict, optional): An earlier report to compare the measurements to.
+        tolerance (float): How many times slower or bigger than in the baseline a stage can be.
+
+    Returns:
+        list: The descriptions of the exceeded thresholds, empty if every stage passed.
+    """
+
+    failures = []
+    baseline_results = {}
+    if baseline is not None:
+        baseline_results = {(result['stage'], result['rows']): result for result in baseline['results']}
+
+    for result in report['results']:
+        name = f"{result['stage']} at {result['rows']} rows"
+        limits = (thresholds or {}).get(result['stage'], {}).get(str(result['rows']), {})
+
+        if 'max_seconds' in limits and result['seconds'] > limits['max_seconds']:
+            failures.append(f"{name} took {result['seconds']:.3f} s, the threshold is {limits['max_seconds']} s.")
+
+        if 'max_peak_mb' in limits and result['peak_mb'] is not None and result['peak_mb'] > limits['max_peak_mb']:
+            failures.append(f"{name} used {result['peak_mb']:.1f} MB, the threshold is {limits['max_peak_mb']} MB.")
+
+        previous = baseline_results.get((result['stage'], result['rows']))
+        if previous is None:
+            continue
+
+        if result['seconds'] > previous['seconds'] * tolerance:
+            failures.append(f"{name} took {result['seconds']:.3f} s, {result['seconds'] / previous['seconds']:.2f} times the baseline.")
+
+        if result['peak_mb'] is not None and previous['peak_mb'] and result['peak_mb'] > previous['peak_mb'] * tolerance:
+            failures.append(f"{name} used {result['peak_mb']:.1f} MB, {result['peak_mb'] / previous['peak_mb']:.2f} times the baseline.")
+
+    return failures
+
+
+def main():
+
+    """Runs the stage benchmarks, writes the report and exits with 1 if a threshold is exceeded."""
+
+    parser = argparse.ArgumentParser(description = 'Benchmark suite of the program stages on synthetic mobility data.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10_000], help = 'The amounts of rows, e.g. 10000 100000 1000000.')
+    parser.add_argument('--pairs', nargs = '+', default = ['ES_PT'], help = 'The country pairs of the synthetic data.')
+    parser.add_argument('--stages', nargs = '+', choices = stages, help = 'The stages to measure, defaults to all stages.')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'Only measures the time, without tracemalloc, which slows down Python-heavy stages, where the resident memory cannot be measured.')
+    parser.add_argument('--report', default = 'stage_report.json', help = 'The JSON file of the report.')
+    parser.add_argument('--reference', default = default_reference_path, help = 'The measured report which the thresholds are derived from.')
+    parser.add_argument('--headroom', type = float, default = default_headroom, help = 'How many times slower or bigger than the reference report a stage can be.')
+    parser.add_argument('--baseline', help = 'An earlier report to compare to.')
+    parser.add_argument('--tolerance', type = float, default = 1.5, help = 'How many times slower or bigger than the baseline a stage can be.')
+    args = parser.parse_args()
+
+    benchmark = StageBenchmark(args.sizes, args.pairs, args.stages, not args.no_memory)
+    benchmark.run()
+    report = benchmark.report()
+
+    thresholds = None
+    if args.reference and os.path.exists(args.reference) and os.path.abspath(args.reference) != os.path.abspath(args.report):
+        with open(args.reference) as file:
+            thresholds = thresholds_from_report(json.load(file), args.headroom, benchmark.memory_method)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    failures = check_report(report, thresholds, baseline, args.tolerance)
+    report['failures'] = failures
+    report['passed'] = not failures
+
+    with open(args.report, 'w') as file:
+        json.dump(report, file, indent = 2)
+
+    for failure in failures:
+        print(f'FAILED: {failure}')
+    print(f'Report written to {args.report}')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Startup benchmark of the command line program.
+
+Measures how long it takes to start the program up to the first menu question, i.e. to start the interpreter and import index.py,
+and how many modules are imported by then. The benchmark fails when the startup time or the amount of imported modules is over
+its threshold, or when one of the heavy libraries that only the stages need is imported at startup.
+
+Run it from the src folder:
+
+    python -m Benchmarks.startup_benchmark --report startup_report.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# The libraries which only the stages need, none of them may be imported before the first menu question.
+heavy_modules = ['pandas', 'numpy', 'geopandas', 'shapely', 'sklearn', 'matplotlib', 'contextily', 'h3', 'geopy', 'fiona', 'pyarrow', 'scipy']
+
+# The defaults of the thresholds, the startup takes under 0.1 s and imports about 120 modules.
+default_max_seconds = 0.5
+default_max_modules = 200
+
+# Imports index.py like python index.py does before it asks the first question, and prints the imported modules.
+startup_script = """
+import sys, json
+import index
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def measure_startup(runs = 5, src_path = None):
+
+    """
+    Measures the startup of the program in fresh interpreters.
+
+    Args:
+        runs (int): How many times the startup is measured.
+        src_path (str, optional): The src folder of the program, defaults to the parent folder of this file.
+
+    Returns:
+        dict: The median and minimum startup time in seconds, the amount of imported modules and the heavy modules that were imported.
+    """
+
+    if src_path is None:
+        src_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', startup_script], cwd = src_path, stdin = subprocess.DEVNULL,
+                                   capture_output = True, text = True, check = True)
+        times.append(time.perf_counter() - start)
+
+    modules = json.loads(completed.stdout.strip().splitlines()[-1])
+    imported_heavy_modules = sorted({module.split('.')[0] for module in modules if module.split('.')[0] in heavy_modules})
+
+    return {
+        'median_seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'runs': runs,
+        'module_count': len(modules),
+        'heavy_modules': imported_heavy_modules,
+    }
+
+
+def check_thresholds(results, max_seconds = default_max_seconds, max_modules = default_max_modules):
+
+    """
+    Checks the startup results against the thresholds.
+
+    Args:
+        results (dict): The results of measure_startup.
+        max_seconds (float): The maximum median startup time in seconds.
+        max_modules (int): The maximum amount of imported modules.
+
+    Returns:
+        list: The descriptions of the exceeded thresholds, empty if the startup passed.
+    """
+
+    failures = []
+
+    if results['median_seconds'] > max_seconds:
+        failures.append(f"Startup took {results['median_seconds']:.3f} s, the threshold is {max_seconds} s.")
+
+    if results['module_count'] > max_modules:
+        failures.append(f"{results['module_count']} modules were imported at startup, the threshold is {max_modules}.")
+
+    if results['heavy_modules']:
+        failures.append(f"Heavy modules were imported at startup: {', '.join(results['heavy_modules'])}.")
+
+    return failures
+
+
+def main():
+
+    """Runs the startup benchmark, prints the results, optionally writes a JSON report and exits with 1 if a threshold is exceeded."""
+
+    parser = argparse.ArgumentParser(description = 'Startup benchmark of the command line program.')
+    parser.add_argument('--runs', type = int, default = 5, help = 'How many times the startup is measured.')
+    parser.add_argument('--max-seconds', type = float, default = default_max_seconds, help = 'The maximum median startup time in seconds.')
+    parser.add_argument('--max-modules', type = int, default = default_max_modules, help = 'The maximum amount of imported modules.')
+    parser.add_argument('--report', help = 'Writes the results to this JSON file.')
+    args = parser.parse_args()
+
+    results = measure_startup(args.runs)
+    failures = check_thresholds(results, args.max_seconds, args.max_modules)
+
+    print(f"Startup: median {results['median_seconds']:.3f} s, min {results['min_seconds']:.3f} s, {results['module_count']} modules imported.")
+    for failure in failures:
+        print(f'FAILED: {failure}')
+
+    if args.report:
+        report = {'benchmark': 'startup', 'results': results, 'thresholds': {'max_seconds': args.max_seconds, 'max_modules': args.max_modules},
+                  'passed': not failures}
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent = 2)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
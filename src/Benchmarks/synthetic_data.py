@@ -0,0 +1,266 @@
+"""
+Generator of synthetic cross-border mobility data for the benchmarks.
+
+The generated data has the same columns as the mobility data of the program. Every row is a movement between the two countries of
+a country pair, with the starting point in one country and the ending point in the other. The points are clustered around hubs
+inside the countries' borders, the hubs near the shared border and the large hubs get more of the movements, and the distance
+between the starting and ending point follows a log-normal distribution. With an H3 resolution the points are snapped to the
+centers of their H3 cells like the H3 data of the program, so that many points share the same coordinates.
+
+Run it from the src folder to save the data to a CSV file:
+
+    python -m Benchmarks.synthetic_data --rows 1000000 --pairs ES_PT --output synthetic.csv
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+from Borders.border_service import get_border_service
+
+# The radius of the earth in kilometers, the same as in the haversine distance of the DistanceMeasure class.
+earth_radius_km = 6371
+
+
+def haversine_km(start_lat, start_lon, end_lat, end_lon):
+
+    """
+    Calculates the haversine distances in kilometers between arrays of starting and ending points.
+
+    Returns:
+        np.ndarray: The distances in kilometers.
+    """
+
+    start_lat, start_lon, end_lat, end_lon = map(np.radians, (start_lat, start_lon, end_lat, end_lon))
+    p = np.sin((end_lat - start_lat) / 2) ** 2 + np.cos(start_lat) * np.cos(end_lat) * np.sin((end_lon - start_lon) / 2) ** 2
+
+    return 2 * np.arcsin(np.sqrt(p)) * earth_radius_km
+
+
+class SyntheticMobilityData():
+
+    """
+    Synthetic cross-border mobility data with the same columns as the mobility data of the program.
+
+    Attributes:
+        rows (int): The amount of rows, divided evenly between the country pairs.
+        pairs (list): The country pairs, e.g. ['ES_PT', 'FI_SE'], both countries have to be in the border data.
+        border_service (BorderService): The country border data.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        clusters_per_country (int): The amount of hubs in each country.
+        cluster_spread_km (float): The standard deviation in kilometers of the points around their hub.
+        hub_exponent (float): The exponent of the Zipf distribution of the hubs' sizes, a bigger exponent gives a few larger hubs.
+        border_decay_km (float): How fast the hubs' share of the movements decreases with the distance to the other country.
+        median_distance_km (float): The median distance of the movements in kilometers.
+        distance_sigma (float): The standard deviation of the logarithm of the movements' distances.
+        h3_resolution (int): The H3 resolution the points are snapped to, or None.
+        df (pd.DataFrame): The generated mobility data.
+
+    Methods:
+        __init__(self, rows, pairs=('ES_PT',), ...): Generates the synthetic mobility data.
+        __generate_pair(self, country1_id, country2_id, rows): Generates the movements of one country pair.
+        __hubs(self, country_id, other_id): Draws the hubs of a country and their shares of the movements.
+        __points_in_country(self, geometry, amount): Draws uniformly distributed points inside a country's border.
+        __spread_around_hubs(self, geometry, centers): Spreads the points around their hubs inside the country's border.
+        __snap_to_h3(self, df): Snaps the points to the centers of their H3 cells.
+    """
+
+
+    def __init__(self, rows, pairs = ('ES_PT',), border_service = None, program_epsg = 3035, clusters_per_country = 30,
+                 cluster_spread_km = 15, hub_exponent = 1.2, border_decay_km = 100, median_distance_km = 80,
+                 distance_sigma = 0.8, h3_resolution = None, seed = 0):
+
+        """
+        Initialize the SyntheticMobilityData class and generate the data.
+
+        Args:
+            rows (int): The amount of rows, divided evenly between the country pairs.
+            pairs (list): The country pairs, e.g. ['ES_PT', 'FI_SE'], both countries have to be in the border data.
+            border_service (BorderService, optional): The country border data, defaults to the border data of the .env file.
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            clusters_per_country (int): The amount of hubs in each country.
+            cluster_spread_km (float): The standard deviation in kilometers of the points around their hub.
+            hub_exponent (float): The exponent of the Zipf distribution of the hubs' sizes.
+            border_decay_km (float): How fast the hubs' share of the movements decreases with the distance to the other country.
+            median_distance_km (float): The median distance of the movements in kilometers.
+            distance_sigma (float): The standard deviation of the logarithm of the movements' distances.
+            h3_resolution (int, optional): Snaps the points to the centers of the H3 cells of this resolution and adds the H3 columns.
+            seed (int): The seed of the random number generator.
+        """
+
+        self.rows = rows
+        self.pairs = list(pairs)
+        self.program_epsg = program_epsg
+        self.border_service = get_border_service(program_epsg) if border_service is None else border_service
+        self.clusters_per_country = clusters_per_country
+        self.cluster_spread_km = cluster_spread_km
+        self.hub_exponent = hub_exponent
+        self.border_decay_km = border_decay_km
+        self.median_distance_km = median_distance_km
+        self.distance_sigma = distance_sigma
+        self.h3_resolution = h3_resolution
+
+        self.rng = np.random.default_rng(seed)
+        self.transformer = Transformer.from_crs(program_epsg, 4326, always_xy = True)
+
+        rows_per_pair = np.diff(np.linspace(0, rows, len(self.pairs) + 1).astype(int))
+        pair_dfs = [self.__generate_pair(*sorted(cntr_od.split('_')), pair_rows) for cntr_od, pair_rows in zip(self.pairs, rows_per_pair)]
+
+        self.df = pd.concat(pair_dfs, ignore_index = True)
+        self.df.insert(0, 'id', np.arange(len(self.df)))
+
+        if self.h3_resolution is not None:
+            self.__snap_to_h3(self.df)
+
+        self.df['distance_km'] = haversine_km(self.df['start_lat'].to_numpy(), self.df['start_lon'].to_numpy(),
+                                              self.df['end_lat'].to_numpy(), self.df['end_lon'].to_numpy()).round()
+
+
+    def __generate_pair(self, country1_id, country2_id, rows):
+
+        """
+        Generates the movements of one country pair, about half of them in each direction.
+
+        Every movement starts from a hub of the starting country and ends at the hub of the other country
+        whose distance is the closest to the drawn distance of the movement.
+
+        Returns:
+            pd.DataFrame: The movements of the country pair.
+        """
+
+        countries = (country1_id, country2_id)
+        hubs = {country1_id: self.__hubs(country1_id, country2_id), country2_id: self.__hubs(country2_id, country1_id)}
+
+        starts_in_first = self.rng.random(rows) < 0.5
+        start_country = np.where(starts_in_first, country1_id, country2_id)
+        end_country = np.where(starts_in_first, country2_id, country1_id)
+        target_distance_m = self.rng.lognormal(np.log(self.median_distance_km), self.distance_sigma, rows) * 1000
+
+        start_xy = np.empty((rows, 2))
+        end_xy = np.empty((rows, 2))
+        for country_id, other_id in (countries, countries[::-1]):
+            rows_of_country = np.flatnonzero(start_country == country_id)
+            geometry, centers, weights = hubs[country_id]
+            other_geometry, other_centers, other_weights = hubs[other_id]
+
+            start_hubs = self.rng.choice(len(centers), size = len(rows_of_country), p = weights)
+            start_xy[rows_of_country] = self.__spread_around_hubs(geometry, centers[start_hubs])
+
+            # The distances from the starting points to the other country's hubs are calculated in chunks to limit the memory use.
+            end_hubs = np.empty(len(rows_of_country), dtype = int)
+            for chunk in range(0, len(rows_of_country), 1_000_000):
+                chunk_rows = rows_of_country[chunk:chunk + 1_000_000]
+                hub_distance = np.hypot(start_xy[chunk_rows, 0, None] - other_centers[:, 0], start_xy[chunk_rows, 1, None] - other_centers[:, 1])
+                end_hubs[chunk:chunk + len(chunk_rows)] = np.abs(hub_distance - target_distance_m[chunk_rows, None]).argmin(axis = 1)
+
+            end_xy[rows_of_country] = self.__spread_around_hubs(other_geometry, other_centers[end_hubs])
+
+        start_lon, start_lat = self.transformer.transform(start_xy[:, 0], start_xy[:, 1])
+        end_lon, end_lat = self.transformer.transform(end_xy[:, 0], end_xy[:, 1])
+
+        return pd.DataFrame({
+            'CNTR_ID_start': start_country,
+            'CNTR_ID_end': end_country,
+            'start_lat': start_lat,
+            'start_lon': start_lon,
+            'end_lat': end_lat,
+            'end_lon': end_lon,
+            'CNTR_OD': f'{country1_id}_{country2_id}',
+        })
+
+
+    def __hubs(self, country_id, other_id):
+
+        """
+        Draws the hubs of a country and their shares of the movements, which follow a Zipf distribution and decrease with the distance to the other country.
+
+        Returns:
+            tuple: The border geometry of the country, the x and y coordinates of the hubs and their shares of the movements.
+        """
+
+        geometry = self.border_service.country_geometry(country_id)
+        if shapely.is_empty(geometry):
+            raise ValueError(f'{country_id} is not in the border data.')
+
+        centers = self.__points_in_country(geometry, self.clusters_per_country)
+        sizes = 1 / np.arange(1, self.clusters_per_country + 1) ** self.hub_exponent
+        border_distance_km = shapely.distance(shapely.points(centers), self.border_service.country_geometry(other_id)) / 1000
+        weights = sizes * np.exp(-border_distance_km / self.border_decay_km)
+
+        return geometry, centers, weights / weights.sum()
+
+
+    def __points_in_country(self, geometry, amount):
+
+        """Draws uniformly distributed points inside the country's border."""
+
+        xmin, ymin, xmax, ymax = shapely.bounds(geometry)
+        points = np.empty((0, 2))
+
+        while len(points) < amount:
+            candidates = np.column_stack([self.rng.uniform(xmin, xmax, amount * 10), self.rng.uniform(ymin, ymax, amount * 10)])
+            points = np.vstack([points, candidates[shapely.contains_xy(geometry, candidates[:, 0], candidates[:, 1])]])
+
+        return points[:amount]
+
+
+    def __spread_around_hubs(self, geometry, centers, attempts = 5):
+
+        """Spreads the points normally around their hubs, drawing again the points which fall outside the country's border."""
+
+        spread = self.cluster_spread_km * 1000
+        points = centers + self.rng.normal(0, spread, centers.shape)
+
+        for attempt in range(attempts):
+            outside = np.flatnonzero(~shapely.contains_xy(geometry, points[:, 0], points[:, 1]))
+            if len(outside) == 0:
+                return points
+            points[outside] = centers[outside] + self.rng.normal(0, spread, (len(outside), 2))
+
+        # The points that are still outside, e.g. around hubs on the coast, are put on their hub.
+        outside = ~shapely.contains_xy(geometry, points[:, 0], points[:, 1])
+        points[outside] = centers[outside]
+
+        return points
+
+
+    def __snap_to_h3(self, df):
+
+        """Snaps the points to the centers of their H3 cells and adds the H3 columns."""
+
+        import h3
+
+        for point in ('start', 'end'):
+            df[f'h3_grid_res10_{point}'] = [h3.geo_to_h3(lat, lon, self.h3_resolution) for lat, lon in zip(df[f'{point}_lat'].to_numpy(), df[f'{point}_lon'].to_numpy())]
+
+            codes, unique_cells = pd.factorize(df[f'h3_grid_res10_{point}'])
+            lat, lon = np.array([h3.h3_to_geo(cell) for cell in unique_cells]).T
+            df[f'{point}_lat'] = lat[codes]
+            df[f'{point}_lon'] = lon[codes]
+
+
+def main():
+
+    """Generates synthetic mobility data and saves it to a CSV file."""
+
+    parser = argparse.ArgumentParser(description = 'Generates synthetic cross-border mobility data.')
+    parser.add_argument('--rows', type = int, default = 100_000, help = 'The amount of rows.')
+    parser.add_argument('--pairs', nargs = '+', default = ['ES_PT'], help = 'The country pairs, e.g. ES_PT FI_SE.')
+    parser.add_argument('--clusters', type = int, default = 30, help = 'The amount of hubs in each country.')
+    parser.add_argument('--spread-km', type = float, default = 15, help = 'The spread of the points around their hub in kilometers.')
+    parser.add_argument('--median-distance-km', type = float, default = 80, help = 'The median distance of the movements in kilometers.')
+    parser.add_argument('--h3-resolution', type = int, help = 'Snaps the points to the H3 cells of this resolution.')
+    parser.add_argument('--seed', type = int, default = 0, help = 'The seed of the random number generator.')
+    parser.add_argument('--output', required = True, help = 'The CSV file to save the data to.')
+    args = parser.parse_args()
+
+    df = SyntheticMobilityData(args.rows, args.pairs, clusters_per_country = args.clusters, cluster_spread_km = args.spread_km,
+                               median_distance_km = args.median_distance_km, h3_resolution = args.h3_resolution, seed = args.seed).df
+    df.to_csv(args.output, index = False)
+    print(f'{len(df)} rows of synthetic mobility data saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+import os
+import shapely
+import numpy as np
+import geopandas as gpd
+
+from get_dotenv import data_folder_path
+from get_dotenv import file_name_for_gpkg
+
+# The border services which are already loaded, by EPSG code and simplification tolerance.
+border_services = {}
+
+
+def get_border_service(program_epsg, simplify_tolerance = None):
+
+    """
+    Returns the border service of the EPSG code, loading it only the first time it is asked for.
+
+    Args:
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        simplify_tolerance (float, optional): The tolerance in meters of the simplified borders.
+
+    Returns:
+        BorderService: The border service.
+    """
+
+    key = (program_epsg, simplify_tolerance)
+
+    if key not in border_services:
+        border_services[key] = BorderService(program_epsg, simplify_tolerance)
+
+    return border_services[key]
+
+
+class BorderService():
+
+    """
+    Cached and indexed access to the countries' borders.
+
+    The border GeoPackage is read and reprojected only once per EPSG code: the reprojected borders are cached on disk as GeoParquet
+    next to the GeoPackage and are used as long as the GeoPackage has not changed. The borders are indexed by the country abbreviation
+    in the CNTR_OD column, each country's border is held as a prepared geometry for fast point-in-polygon tests and the borders can
+    optionally be simplified. An STRtree of the borders is available for spatial lookups by any stage.
+
+    Attributes:
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        simplify_tolerance (float): The tolerance in meters of the simplified borders, or None.
+        border_data (gpd.GeoDataFrame): The countries' borders in the program's EPSG.
+
+    Methods:
+        country(self, country_id): Returns the border polygons of a country.
+        country_geometry(self, country_id): Returns the prepared border geometry of a country.
+        country_buffer(self, country_id, distance): Returns the prepared border geometry of a country buffered by a distance.
+        country_ids(self): Returns the abbreviations of all countries.
+        strtree(self): Returns the STRtree of the border polygons.
+        countries_of_points(self, points, max_distance=None): Returns the country abbreviation of each point.
+    """
+
+
+    def __init__(self, program_epsg, simplify_tolerance = None):
+
+        """
+        Initialize the BorderService class and load the borders.
+
+        Args:
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            simplify_tolerance (float, optional): The tolerance in meters of the simplified borders.
+        """
+
+        self.program_epsg = program_epsg
+        self.simplify_tolerance = simplify_tolerance
+        self.source_path = f'{data_folder_path}{file_name_for_gpkg}'
+
+        self.border_data = self.__load_border_data()
+
+        if self.simplify_tolerance is not None:
+            self.border_data['geometry'] = self.border_data.geometry.simplify(self.simplify_tolerance, preserve_topology = True)
+
+        self.__countries = {country_id: rows.reset_index(drop = True) for country_id, rows in self.border_data.groupby('CNTR_OD', sort = False)}
+        self.__country_geometries = {}
+        self.__strtree = None
+        self.__prepared = None
+        self.__buffered = {}
+        self.__country_buffers = {}
+
+
+    def country(self, country_id):
+
+        """
+        Returns the border polygons of a country.
+
+        Args:
+            country_id (str): The abbreviation of the country.
+
+        Returns:
+            gpd.GeoDataFrame: The border polygons of the country, empty if the country is not in the borders.
+        """
+
+        if country_id not in self.__countries:
+            return self.border_data.iloc[0:0]
+
+        return self.__countries[country_id]
+
+
+    def country_geometry(self, country_id):
+
+        """
+        Returns the border of a country as one prepared geometry.
+
+        Args:
+            country_id (str): The abbreviation of the country.
+
+        Returns:
+            shapely.Geometry: The prepared border geometry of the country.
+        """
+
+        if country_id not in self.__country_geometries:
+            geometry = shapely.union_all(self.country(country_id).geometry.to_numpy())
+            shapely.prepare(geometry)
+            self.__country_geometries[country_id] = geometry
+
+        return self.__country_geometries[country_id]
+
+
+    def country_buffer(self, country_id, distance):
+
+        """
+        Returns the border of a country buffered by a distance as one prepared geometry, buffering it the first time.
+
+        Args:
+            country_id (str): The abbreviation of the country.
+            distance (float): The buffer distance in meters.
+
+        Returns:
+            shapely.Geometry: The prepared buffered border geometry of the country, empty if the country is not in the borders.
+        """
+
+        if (country_id, distance) not in self.__country_buffers:
+            buffered = shapely.buffer(self.country_geometry(country_id), distance)
+            shapely.prepare(buffered)
+            self.__country_buffers[(country_id, distance)] = buffered
+
+        return self.__country_buffers[(country_id, distance)]
+
+
+    def country_ids(self):
+
+        """
+        Returns the abbreviations of all countries in the borders.
+
+        Returns:
+            list: The country abbreviations.
+        """
+
+        return list(self.__countries)
+
+
+    def strtree(self):
+
+        """
+        Returns the STRtree of the border polygons, building it the first time it is asked for.
+
+        The indices that the STRtree returns are the row positions in border_data.
+
+        Returns:
+            shapely.STRtree: The STRtree of the border polygons.
+        """
+
+        if self.__strtree is None:
+            self.__strtree = shapely.STRtree(self.border_data.geometry.to_numpy())
+
+        return self.__strtree
+
+
+    def countries_of_points(self, points, max_distance = None):
+
+        """
+        Returns the abbreviation of the country where each point is, with one bulk query of the STRtree.
+
+        The STRtree gives the candidate borders by bounding box, after which the points are tested against each candidate border
+        as a prepared geometry. Points that are in no country, e.g. on the coast or snapped just outside the border, can be given
+        the nearest country within a maximum distance, which is found in the same way with the borders buffered by that distance.
+
+        Args:
+            points (np.ndarray): Shapely points in the program's EPSG.
+            max_distance (float, optional): The maximum distance in meters to the nearest country for points outside every country.
+
+        Returns:
+            np.ndarray: The country abbreviation of each point, or None if the point is not in any country.
+        """
+
+        point_index, border_index = self.__points_in_borders(points, self.strtree(), self.__prepared_borders())
+
+        country_ids = self.border_data['CNTR_OD'].to_numpy()
+        countries = np.full(len(points), None, dtype = object)
+        # A point on a shared border is in both countries, the first country found is kept.
+        point_index, first = np.unique(point_index, return_index = True)
+        countries[point_index] = country_ids[border_index[first]]
+
+        if max_distance is not None:
+            outside = np.flatnonzero(np.equal(countries, None))
+            buffered_tree, buffered_borders = self.__buffered_borders(max_distance)
+            near_point, near_border = self.__points_in_borders(points[outside], buffered_tree, buffered_borders)
+
+            # The exact distance is only calculated for the points near a border, the nearest border of each point is kept.
+            distance = shapely.distance(self.border_data.geometry.to_numpy()[near_border], points[outside[near_point]])
+            order = np.lexsort((distance, near_point))
+            near_point, first = np.unique(near_point[order], return_index = True)
+            countries[outside[near_point]] = country_ids[near_border[order][first]]
+
+        return countries
+
+
+    def __points_in_borders(self, points, tree, prepared_borders):
+
+        """
+        Finds which points are in which borders.
+
+        Args:
+            points (np.ndarray): Shapely points.
+            tree (shapely.STRtree): The STRtree of the borders.
+            prepared_borders (np.ndarray): The prepared borders in the same order as in the STRtree.
+
+        Returns:
+            tuple: The indices of the points and the indices of the borders that they are in.
+        """
+
+        point_index, border_index = tree.query(points)
+
+        inside = np.zeros(len(point_index), dtype = bool)
+        for border in np.unique(border_index):
+            candidates = border_index == border
+            inside[candidates] = shapely.intersects(prepared_borders[border], points[point_index[candidates]])
+
+        return point_index[inside], border_index[inside]
+
+
+    def __prepared_borders(self):
+
+        """Returns the border polygons prepared for fast spatial predicates, preparing them the first time."""
+
+        if self.__prepared is None:
+            self.__prepared = self.border_data.geometry.to_numpy()
+            shapely.prepare(self.__prepared)
+
+        return self.__prepared
+
+
+    def __buffered_borders(self, max_distance):
+
+        """Returns the STRtree and the prepared border polygons buffered by the maximum distance, buffering them the first time."""
+
+        if max_distance not in self.__buffered:
+            buffered = shapely.buffer(self.border_data.geometry.to_numpy(), max_distance)
+            shapely.prepare(buffered)
+            self.__buffered[max_distance] = (shapely.STRtree(buffered), buffered)
+
+        return self.__buffered[max_distance]
+
+
+    def __load_border_data(self):
+
+        """
+        Loads the reprojected borders from the cache, or reads and reprojects them from the GeoPackage and caches them.
+
+        Returns:
+            gpd.GeoDataFrame: The countries' borders in the program's EPSG.
+        """
+
+        source_name = os.path.splitext(os.path.basename(self.source_path))[0]
+        cache_folder = f'{data_folder_path}border_cache/'
+        cache_path = f'{cache_folder}{source_name}_epsg{self.program_epsg}.parquet'
+
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(self.source_path):
+            return gpd.read_parquet(cache_path)
+
+        border_data = gpd.read_file(self.source_path)
+        border_data = border_data.to_crs(epsg = self.program_epsg)
+
+        os.makedirs(cache_folder, exist_ok = True)
+        border_data.to_parquet(f'{cache_path}.tmp', index = False)
+        os.replace(f'{cache_path}.tmp', cache_path)
+
+        return border_data
@@ -0,0 +1,159 @@
+import atexit
+import time
+import threading
+import traceback
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+class BackgroundWriter():
+
+    """
+    Writes the results and figures of the country pairs on a background thread, so that the KDE of the next country pair
+    is computed while the results of the previous one are written.
+
+    The writes are queued as jobs, functions which write one result or figure and return the paths they wrote. At most queue_size
+    jobs wait or run at a time: when the queue is full, submitting a job blocks until a write finishes, so the results of the
+    country pairs do not pile up in memory when writing is slower than the KDE. The jobs are run in the order they are submitted
+    on one thread, so the writes into the same GeoPackage or dataset never run at the same time.
+
+    A write that fails does not stop the run. Its error is kept with the job, so that the country pair can be marked failed in
+    the run manifest and the error is listed in the run report. All queued writes are finished with flush, or at the latest when
+    the program exits. With a queue size of 0 the jobs are run right away when they are submitted, like without the writer.
+
+    Attributes:
+        queue_size (int): The amount of jobs that can wait or run at a time, 0 for writing right away.
+        jobs (list): The pair, description, wait and write time and error of every finished job.
+
+    Methods:
+        submit(self, pair, description, function, *args, **kwargs): Queues a write.
+        flush(self): Waits until all queued writes are finished.
+        close(self): Finishes the queued writes and stops the writer thread.
+        errors(self): Returns the finished jobs that failed.
+        __run(self, job, function, args, kwargs): Runs a job and records its time and error.
+    """
+
+
+    def __init__(self, queue_size = 4):
+
+        """
+        Initialize the BackgroundWriter class.
+
+        Args:
+            queue_size (int or str): The amount of jobs that can wait or run at a time, 0 for writing right away.
+        """
+
+        self.queue_size = int(queue_size)
+        self.jobs = []
+        self.__pending = []
+        self.__slots = threading.BoundedSemaphore(max(self.queue_size, 1))
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+        if self.queue_size > 0:
+            self.__executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'kde_writer')
+
+            # The queued writes are finished also if the program exits without closing the writer.
+            atexit.register(self.close)
+
+
+    def submit(self, pair, description, function, *args, **kwargs):
+
+        """
+        Queues a write, or runs it right away if the queue size is 0.
+
+        Blocks while the queue is full.
+
+        Args:
+            pair (str): The canonical country pair identifier of the result.
+            description (str): What is written, e.g. the merged map, for the run report.
+            function (callable): Writes the result and returns the list of the written paths.
+            *args: The arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            Future: The paths of the written files, or the error of the write.
+        """
+
+        job = {'pair': pair, 'description': description, 'wait_seconds': 0.0, 'write_seconds': None, 'error': None, 'traceback': None}
+
+        if self.__executor is None:
+            future = Future()
+            try:
+                future.set_result(self.__run(job, function, args, kwargs))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+
+        wait_start = time.perf_counter()
+        self.__slots.acquire()
+        job['wait_seconds'] = time.perf_counter() - wait_start
+
+        future = self.__executor.submit(self.__run, job, function, args, kwargs)
+        future.add_done_callback(lambda _: self.__slots.release())
+
+        with self.__lock:
+            self.__pending = [pending for pending in self.__pending if not pending.done()] + [future]
+
+        return future
+
+
+    def flush(self):
+
+        """Waits until all queued writes are finished."""
+
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+
+        for future in pending:
+            future.exception()
+
+
+    def close(self):
+
+        """Finishes the queued writes and stops the writer thread."""
+
+        self.flush()
+
+        if self.__executor is not None:
+            self.__executor.shutdown(wait = True)
+            self.__executor = None
+            self.queue_size = 0
+            atexit.unregister(self.close)
+
+
+    def errors(self):
+
+        """
+        Returns the finished jobs that failed.
+
+        Returns:
+            list: The pair, description, error and traceback of every failed write.
+        """
+
+        with self.__lock:
+            return [job for job in self.jobs if job['error'] is not None]
+
+
+    def __run(self, job, function, args, kwargs):
+
+        """
+        Runs a job, records its time and error and returns the written paths.
+
+        The error is raised again, so that it is also the error of the job's future.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            return function(*args, **kwargs)
+
+        except Exception as error:
+            job['error'] = repr(error)
+            job['traceback'] = traceback.format_exc()
+            print(f"Writing the {job['description']} of {job['pair']} failed: {error!r}")
+            raise
+
+        finally:
+            job['write_seconds'] = time.perf_counter() - start
+            with self.__lock:
+                self.jobs.append(job)
@@ -0,0 +1,95 @@
+"""Helpers for the binned Gaussian KDE, which bins the points to the mesh grid and smooths the counts instead of fitting the points."""
+
+import numpy as np
+
+# The smallest density of the binned KDE, so that the empty mesh cells get a finite log-density instead of minus infinity.
+smallest_density = np.finfo(np.float32).tiny
+
+
+def mesh_grid(bounds, mesh_step, mesh_margin):
+
+    """
+    Creates the x and y mesh grids around the bounds, the same mesh grid as the KdeEngine evaluates the KDE on.
+
+    Args:
+        bounds (np.ndarray): The bounds of the points (minx, miny, maxx, maxy).
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+        mesh_margin (int): How far in meters the mesh grid extends outside the bounds.
+
+    Returns:
+        tuple: The x and y mesh grids.
+    """
+
+    return np.meshgrid(
+        np.arange(bounds[0] - mesh_margin, bounds[2] + mesh_margin, mesh_step),
+        np.arange(bounds[1] - mesh_margin, bounds[3] + mesh_margin, mesh_step),
+    )
+
+
+def mesh_cells(coordinates, x_mesh, y_mesh, mesh_step):
+
+    """
+    Returns the flat index of the nearest mesh cell of every point, the points outside the mesh grid go to its edge cells.
+
+    Args:
+        coordinates (np.ndarray): The x and y coordinates of the points.
+        x_mesh (np.ndarray): The x mesh grid.
+        y_mesh (np.ndarray): The y mesh grid.
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+
+    Returns:
+        np.ndarray: The flat index of every point's cell in the mesh grid.
+    """
+
+    rows, columns = x_mesh.shape
+    column = np.clip(np.rint((coordinates[:, 0] - x_mesh[0, 0]) / mesh_step), 0, columns - 1).astype(np.int64)
+    row = np.clip(np.rint((coordinates[:, 1] - y_mesh[0, 0]) / mesh_step), 0, rows - 1).astype(np.int64)
+
+    return row * columns + column
+
+
+def inside_mesh(coordinates, x_mesh, y_mesh, mesh_step):
+
+    """
+    Returns which points are inside the mesh grid, within half a mesh step of its outermost cells.
+
+    The points outside the mesh grid, e.g. the outliers outside the extent of a country, are left out of the binning, so that
+    they do not pile up in the edge cells.
+
+    Args:
+        coordinates (np.ndarray): The x and y coordinates of the points.
+        x_mesh (np.ndarray): The x mesh grid.
+        y_mesh (np.ndarray): The y mesh grid.
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+
+    Returns:
+        np.ndarray: True for the points inside the mesh grid.
+    """
+
+    half_step = mesh_step / 2
+
+    return ((coordinates[:, 0] >= x_mesh[0, 0] - half_step) & (coordinates[:, 0] <= x_mesh[0, -1] + half_step) &
+            (coordinates[:, 1] >= y_mesh[0, 0] - half_step) & (coordinates[:, 1] <= y_mesh[-1, 0] + half_step))
+
+
+def log_density(smoothed_counts, points, mesh_step):
+
+    """
+    Converts smoothed counts of the mesh cells to log-densities per square meter, like the log-densities of the KdeEngine.
+
+    Args:
+        smoothed_counts (np.ndarray): The counts smoothed with a Gaussian filter whose weights sum to one.
+        points (float or np.ndarray): The amount of points the counts add up to, an array broadcasts over the grids.
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+
+    Returns:
+        np.ndarray: The log-densities as float32.
+    """
+
+    normalization = np.maximum(points, smallest_density) * mesh_step ** 2
+
+    # The log-densities are computed in place in one float32 array, the size of the counts, without float64 copies of them.
+    densities = np.divide(smoothed_counts, normalization, dtype = np.float32)
+    np.maximum(densities, smallest_density, out = densities)
+
+    return np.log(densities, out = densities)
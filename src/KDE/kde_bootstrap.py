@@ -0,0 +1,173 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import ndimage
+
+from KDE.kde_binning import mesh_grid
+from KDE.kde_binning import mesh_cells
+from KDE.kde_binning import inside_mesh
+from KDE.kde_binning import log_density
+
+# The most memory in bytes that the replicates' log-density grids of one band of mesh rows take, the quantiles are computed band by band.
+band_bytes = 256 * 1024 ** 2
+
+# How many standard deviations the Gaussian filter of SciPy reaches, its default truncate.
+filter_truncate = 4.0
+
+class BootstrapKde():
+
+    """
+    Bootstrap confidence bands of a country's KDE, from resampled binned counts instead of refitting the KDE to resampled points.
+
+    The points are binned to the mesh grid once. A bootstrap sample of the points, drawn with replacement, has the same binned
+    counts as a multinomial draw over the mesh cells with the cells' shares of the points as probabilities, so every replicate
+    is a multinomial draw of the counts smoothed with the Gaussian filter of the bandwidth. The replicates are computed in
+    parallel threads, because the Gaussian filter of SciPy runs without the GIL, and every thread has its own random generator.
+
+    Of the replicates' log-densities the quantiles of every mesh cell are taken. The grids of all replicates do not fit in memory
+    for big mesh grids, so the quantiles are computed in bands of mesh rows: every replicate is drawn again from its own seed for
+    every band, and only the band and the rows within the filter's reach of it are smoothed, which gives the same log-densities
+    in the band as smoothing the whole grid. Contoured with the levels of the KDE itself,
+    the lower quantile gives the lower bound of every contour level, the area which is inside the level in nearly every replicate,
+    and the upper quantile the upper bound, the area which is inside the level in at least some of the replicates.
+
+    Attributes:
+        engine (KdeEngine): The KDE engine whose bandwidth, mesh grid and contours are used.
+        replicates (int): The amount of bootstrap replicates.
+        quantiles (tuple): The quantiles of the log-density which are computed for every mesh cell, from the lowest to the highest.
+        workers (int): The amount of threads computing the replicates.
+        seed (int): The seed of the random generators.
+
+    Methods:
+        quantile_grids(self, country_coordinates, bounds=None): Computes the quantiles of the log-density of every mesh cell.
+        band_polygons(self, quantile_grids, x_mesh, y_mesh, pred_max): Creates the lower and upper bound polygons of every contour level.
+        __replicates(self, counts, seeds, rows): Computes the log-density grids of a share of the replicates in a band of mesh rows.
+    """
+
+
+    def __init__(self, engine, replicates = 200, quantiles = (0.05, 0.5, 0.95), workers = None, seed = 0):
+
+        """
+        Initialize the BootstrapKde class.
+
+        Args:
+            engine (KdeEngine): The KDE engine whose bandwidth, mesh grid and contours are used.
+            replicates (int): The amount of bootstrap replicates.
+            quantiles (tuple): The quantiles of the log-density which are computed for every mesh cell, from the lowest to the highest.
+            workers (int, optional): The amount of threads computing the replicates, defaults to the amount of CPU cores.
+            seed (int): The seed of the random generators.
+        """
+
+        if engine.kernel_type != 'gaussian' or engine.metric_type != 'euclidean':
+            raise ValueError(f'The bootstrap supports only the gaussian kernel with the euclidean metric, not {engine.kernel_type} with {engine.metric_type}.')
+
+        self.engine = engine
+        self.replicates = int(replicates)
+        self.quantiles = tuple(sorted(quantiles))
+        self.workers = os.cpu_count() if workers is None else workers
+        self.seed = seed
+
+
+    def quantile_grids(self, country_coordinates, bounds = None):
+
+        """
+        Computes the quantiles of the bootstrap replicates' log-density for every mesh cell of a country.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+            bounds (np.ndarray, optional): The bounds the mesh grid covers, defaults to the grid bounds of the country's points.
+
+        Returns:
+            tuple: The quantile grids with the quantiles along the first axis and the rows along the y-axis, and the x and y mesh grids.
+        """
+
+        if len(country_coordinates) == 0:
+            raise ValueError('The country has no points for the KDE.')
+
+        bds = country_coordinates.grid_bounds if bounds is None else bounds
+        x_mesh, y_mesh = mesh_grid(bds, self.engine.mesh_step, self.engine.mesh_margin)
+        coordinates = country_coordinates.xy[inside_mesh(country_coordinates.xy, x_mesh, y_mesh, self.engine.mesh_step)]
+        cells = mesh_cells(coordinates, x_mesh, y_mesh, self.engine.mesh_step)
+        counts = np.bincount(cells, minlength = x_mesh.size).reshape(x_mesh.shape)
+
+        # Every thread gets its own share of the replicates and independent random generators.
+        seeds = np.random.SeedSequence(self.seed).spawn(self.replicates)
+        shares = [share for share in np.array_split(np.arange(self.replicates), self.workers) if len(share)]
+
+        band_rows = max(1, band_bytes // (self.replicates * x_mesh.shape[1] * np.dtype(np.float32).itemsize))
+        quantile_grids = np.empty((len(self.quantiles), *x_mesh.shape), dtype = np.float32)
+
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for start in range(0, x_mesh.shape[0], band_rows):
+                rows = (start, min(start + band_rows, x_mesh.shape[0]))
+                replicate_grids = np.concatenate(list(executor.map(lambda share: self.__replicates(counts, [seeds[number] for number in share], rows), shares)))
+                quantile_grids[:, rows[0]:rows[1]] = np.quantile(replicate_grids, self.quantiles, axis = 0)
+
+        return quantile_grids, x_mesh, y_mesh
+
+
+    def band_polygons(self, quantile_grids, x_mesh, y_mesh, pred_max):
+
+        """
+        Creates the lower and upper bound polygons of every contour level of the KDE.
+
+        The lowest and the highest quantile grids are contoured with the contour levels of the KDE itself, so that the bounds
+        have the same levels as the KDE polygons. The log-densities above the highest level belong to the densest level.
+
+        Args:
+            quantile_grids (np.ndarray): The quantile grids of the log-density.
+            x_mesh (np.ndarray): The x mesh grid.
+            y_mesh (np.ndarray): The y mesh grid.
+            pred_max (float): The highest log-density of the KDE.
+
+        Returns:
+            tuple: The lower and upper bound polygons (gpd.GeoDataFrame) with their levels and areas.
+        """
+
+        bounds = []
+        for quantile_grid in (quantile_grids[0], quantile_grids[-1]):
+            contour, labels = self.engine.contour(np.minimum(quantile_grid, pred_max), x_mesh, y_mesh, pred_max = pred_max)
+            bounds.append(self.engine.contour_to_polygons(contour, labels))
+
+        return tuple(bounds)
+
+
+    def __replicates(self, counts, seeds, rows):
+
+        """
+        Computes the log-density grids of a share of the bootstrap replicates in a band of mesh rows.
+
+        Only the mesh cells with points can get points in a replicate, so the multinomial draws are over those cells only.
+        The whole grid is drawn from the replicate's seed, so the draw is the same in every band, but only the band and the rows
+        within the reach of the Gaussian filter are smoothed.
+
+        Args:
+            counts (np.ndarray): The amount of points in every mesh cell.
+            seeds (list): The seed sequence of every replicate.
+            rows (tuple): The first and the last (exclusive) mesh row of the band.
+
+        Returns:
+            np.ndarray: The log-density grids of the replicates in the band.
+        """
+
+        points = int(counts.sum())
+        occupied = np.flatnonzero(counts)
+        probabilities = counts.reshape(-1)[occupied] / points
+        sigma = self.engine.analysis_bandwidth / self.engine.mesh_step
+
+        # The rows within the reach of the filter around the band, the same reach as the radius of SciPy's filter.
+        reach = int(filter_truncate * sigma + 0.5) + 1
+        first, last = max(rows[0] - reach, 0), min(rows[1] + reach, counts.shape[0])
+        columns = counts.shape[1]
+        in_rows = (occupied >= first * columns) & (occupied < last * columns)
+        row_cells = occupied[in_rows] - first * columns
+        band = slice(rows[0] - first, rows[1] - first)
+
+        grids = np.empty((len(seeds), rows[1] - rows[0], columns), dtype = np.float32)
+        resampled = np.zeros((last - first) * columns, dtype = np.float32)
+        for number, seed in enumerate(seeds):
+            resampled[row_cells] = np.random.default_rng(seed).multinomial(points, probabilities)[in_rows]
+            smoothed = ndimage.gaussian_filter(resampled.reshape(last - first, columns), sigma, mode = 'constant', truncate = filter_truncate)
+            grids[number] = log_density(smoothed[band], points, self.engine.mesh_step)
+
+        return grids
@@ -0,0 +1,83 @@
+"""Helpers for turning KDE log-density grids into contour levels and level polygons."""
+
+import numpy as np
+from shapely.geometry import Polygon
+from shapely.geometry import MultiPolygon
+
+# The contour floor of the log-density, everything below this is left out of the contours.
+contour_floor = -30
+
+# The level labels of the 20 contour bands, from the densest (1) to the sparsest (0.05).
+level_labels = [0.05, 0.10, 0.15, 0.20, 0.25, 0.30, 0.35, 0.40, 0.45, 0.50, 0.55, 0.60, 0.65, 0.70, 0.75, 0.80, 0.85, 0.90, 0.95, 1][::-1]
+
+
+def contour_levels(pred_max, amount_of_levels = 20, floor = contour_floor):
+
+    """
+    Creates the contour levels and the level labels for a log-density grid.
+
+    The levels are spread evenly from the contour floor to the highest log-density value, as done in the KDE plot.
+    With the default 20 levels the labels are the program's 5% steps, otherwise they are spread evenly between 1 and 1/amount_of_levels.
+
+    Args:
+        pred_max (float): The highest log-density value of the grid.
+        amount_of_levels (int): The amount of contour levels.
+        floor (float): The lowest log-density value that is contoured.
+
+    Returns:
+        tuple: The contour levels (np.ndarray) and the level labels (list).
+    """
+
+    levels = np.linspace(floor, pred_max, amount_of_levels)
+
+    if amount_of_levels == 20:
+        labels = level_labels
+    else:
+        labels = [round(label, 4) for label in np.linspace(1, 1 / amount_of_levels, amount_of_levels)]
+
+    return levels, labels
+
+
+def contour_to_level_polygons(contour, labels):
+
+    """
+    Converts the filled contours of a contour plot to a MultiPolygon per level.
+
+    The first polygon of every contour path is the main contour and the rest are holes which are removed from it.
+    This function is made by Håvard Aagesen which I have more or less copied.
+
+    Args:
+        contour (matplotlib.contour.QuadContourSet): The filled contour plot.
+        labels (list): The level labels, one for each filled contour band.
+
+    Returns:
+        list: A list of (level label, MultiPolygon) tuples.
+    """
+
+    level_polygons = []
+    i = 0
+    for col in contour.collections:
+        paths = []
+        # Loop through all polygons that have the same intensity level
+        for path in col.get_paths():
+            # Create a polygon for the countour
+            # First polygon is the main countour, the rest are holes
+            for ncp,cp in enumerate(path.to_polygons()):
+                x = cp[:,0]
+                y = cp[:,1]
+                new_shape = Polygon([(i[0], i[1]) for i in zip(x,y)])
+                if ncp == 0:
+                    poly = new_shape
+                else:
+                    # Remove holes, if any
+                    poly = poly.difference(new_shape)
+
+            # Append polygon to list
+            paths.append(poly)
+        # Create a MultiPolygon for the contour
+        multi = MultiPolygon(paths)
+        # Append MultiPolygon and level as tuple to list
+        level_polygons.append((labels[i], multi))
+        i+=1
+
+    return level_polygons
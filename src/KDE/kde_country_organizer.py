@@ -1,13 +1,37 @@
+import functools
+import numpy as np
 import pandas as pd 
-import geopandas as gpd
+from pyproj import Transformer
+
+from KDE.kde_country_points import CountryPoints
+from data_ingestion import coordinate_columns
+from data_ingestion import h3_columns
+
+
+@functools.lru_cache(maxsize = None)
+def lonlat_transformer(program_epsg):
+
+    """
+    Returns the transformer from longitudes and latitudes to the program's EPSG, created only once for every EPSG code.
+
+    Args:
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+
+    Returns:
+        Transformer: The transformer, which takes the longitude before the latitude.
+    """
+
+    return Transformer.from_crs(4326, program_epsg, always_xy = True)
+
 
 class CountryOrganizer:
 
     """
     Organize data for a specific country pair for Kernel Density Estimation (KDE) visualization.
 
-    This class creates a GeoDataFrame with all points in one country, whether starting or ending, in the same dataframe.    
-    It also adds a geometry column of the coordinates and limits the data if required by the user in the movement limit questions.
+    This class collects all points in one country, whether starting or ending, into the same compact arrays of projected x and y
+    coordinates. It also limits the data if required by the user in the movement limit questions. A GeoDataFrame of the points,
+    with a geometry column of the coordinates, is built only when the country_coordinates attribute is asked for.
 
     Args:
         df (pd.DataFrame): The DataFrame containing the original data.
@@ -17,6 +41,10 @@ class CountryOrganizer:
         program_epsg (int): The EPSG code for the program's coordinate reference system.
         movement_limit (str): The movement limit in kilometers.
 
+    Attributes:
+        country_points (CountryPoints): The projected coordinates and the other columns of the country's points.
+        country_coordinates (gpd.GeoDataFrame): The country's points as a GeoDataFrame, built when it is first asked for.
+
     Methods:
         country_organizer(self): Organizes the data for the specific country pair.
     """
@@ -42,9 +70,27 @@ class CountryOrganizer:
         self.extent_of_analysis = extent_of_analysis
         self.program_epsg = program_epsg
         self.movement_limit = movement_limit
+        self.__country_coordinates = None
 
         self.__country_organizer()
 
+
+    @property
+    def country_coordinates(self):
+
+        """
+        The country's points as a GeoDataFrame with a geometry and a country_name column, built from the compact arrays
+        the first time it is asked for.
+
+        Returns:
+            gpd.GeoDataFrame: The GeoDataFrame with organized data for the specific country.
+        """
+
+        if self.__country_coordinates is None:
+            self.__country_coordinates = self.country_points.to_geodataframe()
+
+        return self.__country_coordinates
+
             
     def __country_organizer(self):
 
@@ -52,14 +98,13 @@ class CountryOrganizer:
         Organize the data for the specific country pair by calling various methods which are explained below in detail.
 
         Returns:
-            gpd.GeoDataFrame: The GeoDataFrame with organized data for the specific country.
+            CountryPoints: The projected coordinates and the other columns of the country's points.
         """
         
         self.country_pair_df = self.__create_df_of_cntr_od()
-        self.country_pair_gdf = self.__create_country_pair_gdf()
-        self.country_coordinates = self.__country_coords_gdf(self.country_id)
+        self.country_points = self.__country_points(self.country_id)
 
-        return self.country_coordinates
+        return self.country_points
     
 
     def __create_df_of_cntr_od(self):
@@ -74,110 +119,41 @@ class CountryOrganizer:
         return self.df.loc[self.df['CNTR_OD'].isin([self.cntr_od])]
     
     
-    def __create_country_pair_gdf(self):
-
-        """
-        Creates two separate GeoDataFrames for the specific country.
-
-        Creates two separate GeoDataFrames for the specific country, one with the starting points and one with the ending points
-        in that country, by calling the __df_to_gdf method where the lat and lon columns are used to create a geometry column.
-        It then calls the __combine_gdf method with the two above created GeoDataFrames, and combines these two so that both       
-        starting and ending point of that country is in the same GeoDataFrame but in different geometry columns. 
-
-        Returns:
-            gpd.GeoDataFrame: The GeoDataFrame containing data for the specific country pair.
-        """
-
-        gdf_start = self.__df_to_gdf(self.country_pair_df.start_lon, self.country_pair_df.start_lat)
-        gdf_end = self.__df_to_gdf(self.country_pair_df.end_lon, self.country_pair_df.end_lat)
-        country_pair_gdf = self.__combine_gdfs(gdf_start, gdf_end)
-
-        return country_pair_gdf
-    
-
-    def __df_to_gdf(self, lon, lat):
-
-        """
-        Converts a DataFrame to a GeoDataFrame with coordinates.
-
-        Args:
-            lon (pd.Series): A Series of longitude values.
-            lat (pd.Series): A Series of latitude values.
-
-        Returns:
-            gpd.GeoDataFrame: The GeoDataFrame with geometry based on lon and lat.
-        """
-
-        gdf = gpd.GeoDataFrame(
-        self.country_pair_df, geometry = gpd.points_from_xy(lon, lat))
-        gdf = gdf.set_crs(4326)
-        gdf = gdf.to_crs(epsg = self.program_epsg)
-
-        return gdf
-    
-        
-    def __combine_gdfs(self, gdf_start, gdf_end):
+    def __country_points(self, country):
 
         """
-        Combines two GeoDataFrames.
+        Selects the points of a specific country and projects them to the program's EPSG.
 
-        Combines two GeoDataFrames into one and renames the geometry column to geometry_of_start and creates a new geometry column called 
-        geometry_of_end which holds the geometry point which is in that country, whether starting or ending point.
+        The points of the country are the starting points of the movements which start in the country and the ending points of
+        the movements which end in it. The rows with missing values are dropped and the movement distances are limited in case
+        the user has specified that in the input. The longitudes and latitudes of all the points are projected with one
+        vectorized transform, without creating a geometry for every row. If the data has the H3 cells of the starting and ending
+        points, the cell of every point is kept in the h3_cell column of the other columns for the hexagonal KDE.
 
         Args:
-            gdf_start (gpd.GeoDataFrame): The GeoDataFrame containing start coordinates.
-            gdf_end (gpd.GeoDataFrame): The GeoDataFrame containing end coordinates.
+            country (str): The identifier of the specific country.
 
         Returns:
-            gpd.GeoDataFrame: The combined GeoDataFrame.
-        """
-
-        country_pair_gdf = gdf_start.set_geometry('geometry').rename(columns={'geometry':'geometry_of_start'})
-        country_pair_gdf['geometry_of_end'] = gdf_end['geometry']
-        
-        return country_pair_gdf
-    
-
-    def __country_coords_gdf(self, country):
-
+            CountryPoints: The projected coordinates and the other columns of the country's points.
         """
-        Filters and organizes the GeoDataFrame for a specific country.
 
-        Filters and organizes the GeoDataFrame for a specific country so that it only saves the geometry which    
-        is in the country in the geometry column and drops the other geometry columns that have the other country's 
-        geometry. It then combines those together, drops NaN values creates a new column with the country id and 
-        limits the movement regarded in the kde visualization in case the user has specified that in the input. 
+        kept = self.country_pair_df.notna().all(axis = 1)
 
-        Args:
-            country (str): The identifier of the specific country.
-
-        Returns:
-            gpd.GeoDataFrame: The filtered and organized GeoDataFrame for the specific country.           
-        """
+        if self.extent_of_analysis == 'yes':
+            self.movement_limit = int(self.movement_limit)
+            kept &= self.country_pair_df['distance_km'] <= self.movement_limit
 
-        filtered_start_gdf = self.country_pair_gdf.loc[self.country_pair_gdf['CNTR_ID_start'].isin([country])]
-        filtered_end_gdf = self.country_pair_gdf.loc[self.country_pair_gdf['CNTR_ID_end'].isin([country])]
+        starts = self.country_pair_df.loc[kept & self.country_pair_df['CNTR_ID_start'].isin([country])]
+        ends = self.country_pair_df.loc[kept & self.country_pair_df['CNTR_ID_end'].isin([country])]
 
+        lon = np.concatenate([starts['start_lon'].to_numpy(dtype = np.float64), ends['end_lon'].to_numpy(dtype = np.float64)])
+        lat = np.concatenate([starts['start_lat'].to_numpy(dtype = np.float64), ends['end_lat'].to_numpy(dtype = np.float64)])
+        x, y = lonlat_transformer(self.program_epsg).transform(lon, lat)
 
-        if not filtered_start_gdf.empty:
-            filtered_start_gdf = filtered_start_gdf.drop(columns=['geometry_of_end'])
-            filtered_start_gdf = filtered_start_gdf.rename(columns={'geometry_of_start': 'geometry'})
+        attributes = pd.concat([starts, ends], ignore_index = True).drop(columns = coordinate_columns)
 
-        if not filtered_end_gdf.empty:
-            filtered_end_gdf = filtered_end_gdf.drop(columns=['geometry_of_start'])
-            filtered_end_gdf = filtered_end_gdf.rename(columns={'geometry_of_end': 'geometry'})
-        
-        country_gdf = pd.concat([filtered_start_gdf, filtered_end_gdf])
-        country_gdf = country_gdf.dropna()
-    
-        country_id = str(country)
-        country_gdf['country_name'] = country_id
+        if all(column in attributes for column in h3_columns):
+            attributes['h3_cell'] = np.concatenate([starts[h3_columns[0]].to_numpy(), ends[h3_columns[1]].to_numpy()])
+            attributes = attributes.drop(columns = h3_columns)
 
-        if self.extent_of_analysis == 'yes':
-            self.movement_limit = int(self.movement_limit)
-            country_gdf = country_gdf[country_gdf['distance_km'] <= self.movement_limit]
-            country_gdf = country_gdf.reset_index(drop=True)
-            return country_gdf
-        
-        country_gdf = country_gdf.reset_index(drop=True)
-        return country_gdf
\ No newline at end of file
+        return CountryPoints(country, np.column_stack([x, y]), attributes, self.program_epsg)
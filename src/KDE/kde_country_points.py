@@ -0,0 +1,111 @@
+import numpy as np
+import geopandas as gpd
+
+class CountryPoints():
+
+    """
+    The points of one country of a country pair as compact arrays, the input of the KDE.
+
+    The x and y coordinates in the program's EPSG are kept in one contiguous float64 array with a row for every point, which the
+    KDE, the binning and the sampling use directly without Shapely geometries. The other columns of the points, e.g. the starting
+    times for the spatio-temporal KDE, are kept in a DataFrame without the coordinate columns. A GeoDataFrame of the points is
+    built only when it is asked for. The extent is the part of the map that the mesh grids of the country's KDE cover, which can be
+    smaller than the bounds of the points when outlying points are left outside of it.
+
+    Attributes:
+        country_id (str): The identifier of the country.
+        xy (np.ndarray): The x and y coordinates of the points, one row for every point.
+        attributes (pd.DataFrame): The other columns of the points, in the same order as the coordinates.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        extent (np.ndarray): The bounds (minx, miny, maxx, maxy) the mesh grids cover, None for the bounds of the points.
+
+    Methods:
+        total_bounds(self): The bounds (minx, miny, maxx, maxy) of the points.
+        grid_bounds(self): The bounds the mesh grids of the country cover.
+        take(self, indices): Returns a subset of the points.
+        to_geodataframe(self): Returns the points as a GeoDataFrame with a country_name column.
+    """
+
+
+    def __init__(self, country_id, xy, attributes, program_epsg, extent = None):
+
+        """
+        Initialize the CountryPoints class.
+
+        Args:
+            country_id (str): The identifier of the country.
+            xy (np.ndarray): The x and y coordinates of the points, one row for every point.
+            attributes (pd.DataFrame): The other columns of the points, in the same order as the coordinates.
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            extent (np.ndarray, optional): The bounds the mesh grids cover, defaults to the bounds of the points.
+        """
+
+        self.country_id = str(country_id)
+        self.xy = np.ascontiguousarray(xy, dtype = np.float64).reshape(-1, 2)
+        self.attributes = attributes.reset_index(drop = True)
+        self.program_epsg = program_epsg
+        self.extent = None if extent is None else np.asarray(extent, dtype = np.float64)
+
+
+    def __len__(self):
+
+        return len(self.xy)
+
+
+    @property
+    def total_bounds(self):
+
+        """
+        The bounds of the points, like the total_bounds of a GeoDataFrame.
+
+        Returns:
+            np.ndarray: The bounds (minx, miny, maxx, maxy), NaN if there are no points.
+        """
+
+        if len(self.xy) == 0:
+            return np.full(4, np.nan)
+
+        return np.concatenate([self.xy.min(axis = 0), self.xy.max(axis = 0)])
+
+
+    @property
+    def grid_bounds(self):
+
+        """
+        The bounds the mesh grids of the country's KDE cover, the extent if it is set and otherwise the bounds of the points.
+
+        Returns:
+            np.ndarray: The bounds (minx, miny, maxx, maxy).
+        """
+
+        return self.total_bounds if self.extent is None else self.extent
+
+
+    def take(self, indices):
+
+        """
+        Returns a subset of the points, with the same extent.
+
+        Args:
+            indices (np.ndarray): The positions of the points in the subset.
+
+        Returns:
+            CountryPoints: The points at the positions.
+        """
+
+        return CountryPoints(self.country_id, self.xy[indices], self.attributes.iloc[indices], self.program_epsg, self.extent)
+
+
+    def to_geodataframe(self):
+
+        """
+        Returns the points as a GeoDataFrame in the program's EPSG, with the other columns and a country_name column.
+
+        Returns:
+            gpd.GeoDataFrame: The points of the country.
+        """
+
+        country_gdf = gpd.GeoDataFrame(self.attributes.copy(), geometry = gpd.points_from_xy(self.xy[:, 0], self.xy[:, 1]), crs = self.program_epsg)
+        country_gdf['country_name'] = self.country_id
+
+        return country_gdf
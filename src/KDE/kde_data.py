@@ -1,9 +1,10 @@
-import pandas as pd
-import geopandas as gpd
-
+from Borders.border_service import get_border_service
+from data_ingestion import read_mobility_csv
+from data_ingestion import cntr_od_column
+from data_ingestion import kde_columns
+from data_ingestion import h3_columns
 from get_dotenv import data_folder_path
 from get_dotenv import file_name_for_kde_analysis
-from get_dotenv import file_name_for_gpkg
 
 class KDEdata():
 
@@ -14,28 +15,35 @@ class KDEdata():
 
     Attributes:
         program_epsg: The EPSG code for the program's coordinate reference system.
+        temporal (bool): Whether the created_at_start column is read for the spatio-temporal KDE.
+        h3_cells (bool): Whether the H3 cell columns are read for the hexagonal KDE, if the data has them.
 
     Methods:
-        __init__(self, program_epsg): Initializes the KDEdata class with the given EPSG code.
+        __init__(self, program_epsg, temporal=False, h3_cells=False): Initializes the KDEdata class with the given EPSG code.
         read_in_data_ready_for_kde(self): Reads and prepares the data for KDE handling and visualization.
         create_od(self, df_without_cntr_od): Creates a 'CNTR_OD' column in the DataFrame.
-        read_gpkg_file(self): Reads geospatial data from a GeoPackage file.
+        read_gpkg_file(self): Gets the countries' borders from the border service.
     """
 
 
-    def __init__(self, program_epsg):
+    def __init__(self, program_epsg, temporal = False, h3_cells = False):
 
         """
         Initialize the KDEdata class with the given EPSG code.
 
         Args:
             program_epsg: The EPSG code for the program's coordinate reference system.
+            temporal (bool): Whether the created_at_start column is read for the spatio-temporal KDE.
+            h3_cells (bool): Whether the H3 cell columns are read for the hexagonal KDE, if the data has them.
         """
 
         self.program_epsg = program_epsg
+        self.temporal = temporal
+        self.h3_cells = h3_cells
         
         self.__read_in_data_ready_for_kde()
         self.border_data = self.__read_gpkg_file()
+        self.border_service = get_border_service(self.program_epsg)
     
 
     def __read_in_data_ready_for_kde(self):
@@ -44,13 +52,19 @@ class KDEdata():
         Reads and prepares data for KDE handling and visualization.
 
         This method reads data from a CSV file, creates a 'CNTR_OD' column if it doesn't exist, and stores the DataFrame.
+        Only the columns that the KDE needs are read, with categorical country codes and float64 coordinates, because float32
+        would round the latitudes and longitudes to about half a meter and change the KDE results.
+        For the spatio-temporal KDE also the starting times of the movements are read, and for the hexagonal KDE the H3 cells.
 
         Returns:
             pd.DataFrame: The prepared DataFrame.
         """
 
         filepath = f'{data_folder_path}{file_name_for_kde_analysis}'
-        self.df_without_cntr_od = pd.read_csv(filepath, sep = ',')
+        columns = kde_columns + ['created_at_start'] if self.temporal else kde_columns
+        if self.h3_cells:
+            columns = columns + h3_columns
+        self.df_without_cntr_od = read_mobility_csv(filepath, columns)
 
         if 'CNTR_OD' not in self.df_without_cntr_od:
             print('Will create cntr_od')
@@ -68,6 +82,8 @@ class KDEdata():
         """
         Creates a 'CNTR_OD' column in the DataFrame.
 
+        The country pair is worked out once for every combination of the country codes instead of for every row.
+
         Args:
             df_without_cntr_od (pd.DataFrame): The DataFrame without the 'CNTR_OD' column.
 
@@ -75,11 +91,8 @@ class KDEdata():
             pd.DataFrame: The DataFrame with the 'CNTR_OD' column added.
         """
 
-        df_without_cntr_od['CNTR_ID_start'] = df_without_cntr_od['CNTR_ID_start'].astype(str)
-        df_without_cntr_od['CNTR_ID_end'] = df_without_cntr_od['CNTR_ID_end'].astype(str)
-
-        # Create a new 'CNTR_OD' column by joining and sorting 'CNTR_ID_start' and 'CNTR_ID_end' values for each row.
-        df_without_cntr_od['CNTR_OD'] = df_without_cntr_od.apply(lambda row: '_'.join(sorted([row['CNTR_ID_start'], row['CNTR_ID_end']])), axis=1)
+        # Create a new 'CNTR_OD' column by joining and sorting 'CNTR_ID_start' and 'CNTR_ID_end' values.
+        df_without_cntr_od['CNTR_OD'] = cntr_od_column(df_without_cntr_od['CNTR_ID_start'], df_without_cntr_od['CNTR_ID_end'])
         
         df_without_cntr_od = df_without_cntr_od.reset_index(drop=True)
 
@@ -89,15 +102,12 @@ class KDEdata():
     def __read_gpkg_file(self):
 
         """
-        Reads countries' borders as a geospatial polygon from a GeoPackage file.
+        Gets the countries' borders as geospatial polygons from the border service.
+
+        The border service reads the GeoPackage file and reprojects it only once, after which the borders are loaded from its cache.
 
         Returns:
             geopandas.GeoDataFrame: The countries' borders read from the GeoPackage file.
         """
 
-        filepath = f'{data_folder_path}{file_name_for_gpkg}'
-        self.border_data = gpd.read_file(filepath)
-
-        self.border_data = self.border_data.to_crs(epsg = self.program_epsg)
-
-        return self.border_data
\ No newline at end of file
+        return get_border_service(self.program_epsg).border_data
\ No newline at end of file
@@ -0,0 +1,311 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from matplotlib.figure import Figure
+from sklearn.neighbors import KernelDensity
+
+from KDE.kde_contours import contour_levels
+from KDE.kde_contours import contour_to_level_polygons
+from KDE.kde_binning import mesh_grid
+from KDE.kde_extent import extent_methods
+from KDE.kde_extent import robust_extent
+from KDE.kde_extent import limit_cells
+from KDE.kde_extent import grid_cells
+from KDE.kde_extent import outside_extent
+from KDE.kde_extent import default_extent_method
+from KDE.kde_extent import default_max_cells
+from KDE.kde_pair_surfaces import pair_bounds
+from KDE.kde_geometry_output import GeometryOutput
+
+class KdeEngine():
+
+    """
+    The computation of the KDE of a country pair, without plotting, saving or input questions.
+
+    The engine fits the KDE to a country's points, evaluates the log-density on a mesh grid, contours it to polygons and clips
+    the polygons with the country's border. It is used by the KdeVisualizer, which adds the plots and saving around it,
+    and by the Python API, which returns the polygons to the caller.
+
+    The mesh grid covers the extent of the country's points. By default the extent covers the points within the bandwidth of the
+    country's border, so that a few mis-geocoded points far away do not turn the grid of a border region into one of a continent,
+    and the grid has at most max_cells cells. The points outside the extent are reported, and left out of the KDE if drop_outliers is set.
+
+    Attributes:
+        analysis_bandwidth (int): The bandwidth of the KDE in meters.
+        kernel_type (str): The kernel type of the KDE (gaussian or epanechnikov).
+        metric_type (str): The metric type of the KDE (euclidean or haversine).
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        border_service (BorderService): The indexed country border data.
+        geometry_output (GeometryOutput): Snaps and validates the KDE polygons.
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+        mesh_margin (int): How far in meters the mesh grid extends outside the points.
+        tree_tuner (KdeTreeTuner): Chooses the tree settings of the KDE, the defaults of KernelDensity are used if None.
+        extent_method (str): How the extent of the mesh grid is chosen (bounds, quantile or border).
+        extent_quantile (float): The share of the points that can be left outside the extent on every side with the quantile method.
+        max_cells (int): The maximum amount of cells of the mesh grid, 0 for no maximum.
+        drop_outliers (bool): Whether the points outside the extent are left out of the KDE.
+
+    Methods:
+        guard_extent(self, country_coordinates): Sets the extent of a country's mesh grid and reports the outliers.
+        pair_grid_bounds(self, country_1_coordinates, country_2_coordinates): Returns the bounds of the shared mesh grid of a pair.
+        density_grid(self, country_coordinates, bounds=None): Fits the KDE and evaluates the log-density on a mesh grid.
+        contour(self, pred_grid, x_mesh, y_mesh, ax=None, pred_max=None): Creates the contours of a log-density grid.
+        contour_to_polygons(self, contour, labels): Converts the contours to snapped and validated polygons.
+        clip_to_region(self, kde_polygons, region): Clips the KDE polygons with a region.
+        country_kde(self, country_coordinates): Creates the KDE polygons of a country.
+        pair_kde(self, country_1_coordinates, country_2_coordinates): Creates the KDE polygons of a country pair.
+    """
+
+
+    def __init__(self, analysis_bandwidth, kernel_type, metric_type, program_epsg, border_service, geometry_output = None, mesh_step = 2000, mesh_margin = 50000, tree_tuner = None,
+                 extent_method = default_extent_method, extent_quantile = 0.001, max_cells = default_max_cells, drop_outliers = False):
+
+        """
+        Initialize the KdeEngine class.
+
+        Args:
+            analysis_bandwidth (int or str): The bandwidth of the KDE in meters.
+            kernel_type (str): The kernel type of the KDE (gaussian or epanechnikov).
+            metric_type (str): The metric type of the KDE (euclidean or haversine).
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            border_service (BorderService): The indexed country border data.
+            geometry_output (GeometryOutput, optional): Snaps and validates the KDE polygons, created for the mesh step if not given.
+            mesh_step (int): The distance between the cells of the mesh grid in meters.
+            mesh_margin (int): How far in meters the mesh grid extends outside the points.
+            tree_tuner (KdeTreeTuner, optional): Chooses the tree settings of the KDE, the defaults of KernelDensity are used if not given.
+            extent_method (str): How the extent of the mesh grid is chosen (bounds, quantile or border).
+            extent_quantile (float or str): The share of the points that can be left outside the extent on every side with the quantile method.
+            max_cells (int or str): The maximum amount of cells of the mesh grid, 0 for no maximum.
+            drop_outliers (bool): Whether the points outside the extent are left out of the KDE.
+        """
+
+        self.analysis_bandwidth = int(analysis_bandwidth)
+        self.kernel_type = kernel_type
+        self.metric_type = metric_type
+        self.program_epsg = program_epsg
+        self.border_service = border_service
+        self.mesh_step = mesh_step
+        self.mesh_margin = mesh_margin
+        self.geometry_output = GeometryOutput(mesh_step = mesh_step) if geometry_output is None else geometry_output
+        self.tree_tuner = tree_tuner
+
+        if extent_method not in extent_methods:
+            raise ValueError(f'Invalid extent method {extent_method}, the options are {", ".join(extent_methods)}.')
+        self.extent_method = extent_method
+        self.extent_quantile = float(extent_quantile)
+        self.max_cells = int(max_cells)
+        self.drop_outliers = drop_outliers
+
+
+    def guard_extent(self, country_coordinates):
+
+        """
+        Sets the extent of a country's mesh grid, so that outlying points do not widen it, and reports the points outside of it.
+
+        The extent is clipped with the extent method and then shrunk towards the median of the points if its mesh grid would have
+        more than the maximum amount of cells. The points outside the extent are kept, but they are not in the mesh grid and not
+        binned, or they are left out of the KDE altogether if drop_outliers is set.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+
+        Returns:
+            tuple: The points of the country with the extent set, a subset without the outliers if they are dropped,
+                and a report of the points, outliers and mesh cells.
+        """
+
+        if len(country_coordinates) == 0:
+            return country_coordinates, {'points': 0, 'outliers': 0, 'dropped': 0, 'raw_cells': 0, 'cells': 0}
+
+        xy = country_coordinates.xy
+        near_border = None
+        if self.extent_method == 'border':
+            # The points within the bandwidth of the country's border, tested against the buffered border in one vectorized query.
+            near_border = shapely.contains_xy(self.border_service.country_buffer(country_coordinates.country_id, self.analysis_bandwidth), xy[:, 0], xy[:, 1])
+
+        extent = robust_extent(xy, self.extent_method, near_border, self.analysis_bandwidth, self.extent_quantile)
+        extent = limit_cells(extent, np.median(xy, axis = 0), self.mesh_step, self.mesh_margin, self.max_cells)
+        outliers = outside_extent(xy, extent)
+
+        report = {'points': len(xy), 'outliers': int(outliers.sum()), 'dropped': 0,
+                  'raw_cells': grid_cells(country_coordinates.total_bounds, self.mesh_step, self.mesh_margin),
+                  'cells': grid_cells(extent, self.mesh_step, self.mesh_margin)}
+
+        if self.drop_outliers and outliers.any():
+            country_coordinates = country_coordinates.take(np.flatnonzero(~outliers))
+            report['dropped'] = report['outliers']
+
+        country_coordinates.extent = extent
+
+        return country_coordinates, report
+
+
+    def pair_grid_bounds(self, country_1_coordinates, country_2_coordinates):
+
+        """
+        Returns the bounds of the shared mesh grid of a pair, the extents of both countries limited to the maximum amount of cells.
+
+        Args:
+            country_1_coordinates (CountryPoints): The points of the first country.
+            country_2_coordinates (CountryPoints): The points of the second country.
+
+        Returns:
+            np.ndarray: The bounds (minx, miny, maxx, maxy) of the shared mesh grid.
+        """
+
+        bounds = pair_bounds(country_1_coordinates, country_2_coordinates)
+        center = np.median(np.concatenate([country_1_coordinates.xy, country_2_coordinates.xy]), axis = 0)
+
+        return limit_cells(bounds, center, self.mesh_step, self.mesh_margin, self.max_cells)
+
+
+    def density_grid(self, country_coordinates, bounds = None):
+
+        """
+        Fits the KDE to a country's points and evaluates the log-density on a mesh grid around the points.
+
+        With the tree tuner the KDE uses the fastest tree settings for the size class of the country's data.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+            bounds (np.ndarray, optional): The bounds the mesh grid covers, defaults to the grid bounds of the country's points.
+
+        Returns:
+            tuple: The log-density grid with the rows along the y-axis, the x and y mesh grids and the fitted KDE model.
+        """
+
+        if len(country_coordinates) == 0:
+            raise ValueError('The country has no points for the KDE.')
+
+        coordinates = country_coordinates.xy
+
+        # Create a mesh grid of x and y values based on the bounding box with added margins.
+        bds = country_coordinates.grid_bounds if bounds is None else bounds
+        x_mesh, y_mesh = mesh_grid(bds, self.mesh_step, self.mesh_margin)
+        query_points = np.vstack([x_mesh.flatten(), y_mesh.flatten()]).T
+
+        # The tree settings of the KDE, tuned for the size of the country's data if the tree tuner is on.
+        tree_parameters = {}
+        if self.tree_tuner is not None:
+            kde_settings = {'bandwidth': self.analysis_bandwidth, 'kernel': self.kernel_type, 'metric': self.metric_type}
+            tree_parameters = self.tree_tuner.tree_parameters(kde_settings, coordinates, query_points)
+
+        # Create a KDE model with the specified bandwidth, kernel type, and metric type.
+        kde = KernelDensity(bandwidth = self.analysis_bandwidth, kernel = f"{self.kernel_type}", metric = f"{self.metric_type}", **tree_parameters)
+
+        # Fit the KDE model to the coordinates of the given country.
+        kde.fit(coordinates)
+
+        # Calculate the log density for each point on the mesh grid using the KDE model.
+        pred = kde.score_samples(query_points)
+
+        return pred.reshape(x_mesh.shape), x_mesh, y_mesh, kde
+
+
+    def contour(self, pred_grid, x_mesh, y_mesh, ax = None, pred_max = None):
+
+        """
+        Creates the filled contours of a log-density grid.
+
+        Args:
+            pred_grid (np.ndarray): The log-density grid.
+            x_mesh (np.ndarray): The x mesh grid.
+            y_mesh (np.ndarray): The y mesh grid.
+            ax (matplotlib.axes.Axes, optional): The axes to draw the contours on, an off-screen figure is used if not given.
+            pred_max (float, optional): The highest log-density the levels are spread to, defaults to the highest value of the grid.
+                E.g. the bootstrap bounds are contoured with the levels of the KDE itself.
+
+        Returns:
+            tuple: The contour plot (QuadContourSet) and the labels of its levels.
+        """
+
+        levels, labels = contour_levels(pred_grid.max() if pred_max is None else pred_max)
+
+        if ax is None:
+            ax = Figure().add_subplot()
+
+        return ax.contourf(x_mesh, y_mesh, pred_grid, levels = levels), labels
+
+
+    def contour_to_polygons(self, contour, labels):
+
+        """
+        Converts the contours to polygons, which are snapped to a precision grid of the mesh and validated.
+
+        Args:
+            contour (QuadContourSet): The contour plot of the KDE.
+            labels (list): The labels of the contour levels.
+
+        Returns:
+            gpd.GeoDataFrame: The KDE polygons with their levels and areas.
+        """
+
+        df_of_polygons = pd.DataFrame(contour_to_level_polygons(contour, labels), columns = ['level', 'geometry'])
+        gdf_of_polygons = gpd.GeoDataFrame(df_of_polygons, geometry = 'geometry', crs = self.program_epsg)
+        gdf_of_polygons['area'] = gdf_of_polygons['geometry'].area
+
+        return self.geometry_output.full_detail(gdf_of_polygons)
+
+
+    def clip_to_region(self, kde_polygons, region):
+
+        """
+        Clips the KDE polygons with a region, such as the country's border polygons.
+
+        Args:
+            kde_polygons (gpd.GeoDataFrame): The KDE polygons of the country.
+            region (gpd.GeoDataFrame): The region to clip the KDE polygons with.
+
+        Returns:
+            gpd.GeoDataFrame: The clipped KDE polygons.
+        """
+
+        return gpd.overlay(kde_polygons, region, how = 'intersection')
+
+
+    def country_kde(self, country_coordinates):
+
+        """
+        Creates the KDE polygons of a country and clips them with the country's border.
+
+        The extent of the mesh grid is guarded first, unless it was already set.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country.
+
+        Returns:
+            tuple: The KDE polygons and the clipped KDE polygons of the country.
+        """
+
+        if country_coordinates.extent is None:
+            country_coordinates, report = self.guard_extent(country_coordinates)
+
+        pred_grid, x_mesh, y_mesh, kde = self.density_grid(country_coordinates)
+        contour, labels = self.contour(pred_grid, x_mesh, y_mesh)
+        kde_polygons = self.contour_to_polygons(contour, labels)
+
+        region = self.border_service.country(country_coordinates.country_id)
+
+        return kde_polygons, self.clip_to_region(kde_polygons, region)
+
+
+    def pair_kde(self, country_1_coordinates, country_2_coordinates):
+
+        """
+        Creates the KDE polygons of both countries of a country pair and merges their clipped polygons.
+
+        Args:
+            country_1_coordinates (CountryPoints): The points of the first country.
+            country_2_coordinates (CountryPoints): The points of the second country.
+
+        Returns:
+            tuple: The KDE polygons of the first and second country and the merged clipped KDE polygons.
+        """
+
+        country_1_polygons, country_1_clipped = self.country_kde(country_1_coordinates)
+        country_2_polygons, country_2_clipped = self.country_kde(country_2_coordinates)
+
+        merged_layers = pd.concat([country_1_clipped, country_2_clipped], ignore_index = True)
+
+        return country_1_polygons, country_2_polygons, merged_layers
@@ -0,0 +1,126 @@
+"""Guards of the extent of the mesh grid, so that a few mis-geocoded points far from a country do not blow up the grid of its KDE."""
+
+import math
+import numpy as np
+
+# How the extent of a country's mesh grid is chosen: the bounds of all points, the quantiles of the points widened by the bandwidth
+# or the points within the bandwidth of the country's border.
+extent_methods = ['bounds', 'quantile', 'border']
+
+# The defaults of the KdeEngine, the results of other settings have the settings in their names and run manifests.
+default_extent_method = 'border'
+default_max_cells = 4000000
+
+
+def grid_cells(bounds, mesh_step, mesh_margin):
+
+    """
+    Returns the amount of cells of the mesh grid around the bounds, the same amount as the mesh_grid of the binning creates.
+
+    Args:
+        bounds (np.ndarray): The bounds (minx, miny, maxx, maxy).
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+        mesh_margin (int): How far in meters the mesh grid extends outside the bounds.
+
+    Returns:
+        int: The amount of cells.
+    """
+
+    columns = math.ceil((bounds[2] - bounds[0] + 2 * mesh_margin) / mesh_step)
+    rows = math.ceil((bounds[3] - bounds[1] + 2 * mesh_margin) / mesh_step)
+
+    return columns * rows
+
+
+def robust_extent(xy, method, near_border = None, margin = 0, quantile = 0.001):
+
+    """
+    Returns the extent of a country's points, the bounds of the points clipped so that outlying points do not widen it.
+
+    With the border method the extent is the bounds of the points within the margin of the country's border, or of the quantiles
+    if the country has no border or no point is near it. With the quantile method the extent is clipped to the given lower and
+    upper quantiles of the x and y coordinates, widened by the margin. With the bounds method the extent is the bounds of all points.
+
+    Args:
+        xy (np.ndarray): The x and y coordinates of the points.
+        method (str): The method of the extent (bounds, quantile or border).
+        near_border (np.ndarray, optional): True for the points within the margin of the country's border, for the border method.
+        margin (float): How far in meters the extent reaches outside the quantiles, e.g. the bandwidth.
+        quantile (float): The share of the points that can be left outside the extent on every side with the quantile method.
+
+    Returns:
+        np.ndarray: The extent (minx, miny, maxx, maxy).
+    """
+
+    if method not in extent_methods:
+        raise ValueError(f'Invalid extent method {method}, the options are {", ".join(extent_methods)}.')
+
+    bounds = np.concatenate([xy.min(axis = 0), xy.max(axis = 0)])
+
+    if method == 'bounds':
+        return bounds
+
+    if method == 'border' and near_border is not None and near_border.any():
+        near_xy = xy[near_border]
+        return np.concatenate([near_xy.min(axis = 0), near_xy.max(axis = 0)])
+
+    lower, upper = np.quantile(xy, [quantile, 1 - quantile], axis = 0)
+    limits = np.concatenate([lower - margin, upper + margin])
+
+    return np.concatenate([np.maximum(bounds[:2], limits[:2]), np.minimum(bounds[2:], limits[2:])])
+
+
+def limit_cells(bounds, center, mesh_step, mesh_margin, max_cells):
+
+    """
+    Shrinks the bounds towards a center point until the mesh grid around them has at most the maximum amount of cells.
+
+    Both sides of the bounds are shrunk by the same share, so the center stays at the same relative position, e.g. the median
+    of the points where most of the mobility is.
+
+    Args:
+        bounds (np.ndarray): The bounds (minx, miny, maxx, maxy).
+        center (np.ndarray): The x and y coordinates the bounds are shrunk towards.
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+        mesh_margin (int): How far in meters the mesh grid extends outside the bounds.
+        max_cells (int): The maximum amount of cells of the mesh grid, 0 for no maximum.
+
+    Returns:
+        np.ndarray: The bounds whose mesh grid has at most the maximum amount of cells.
+    """
+
+    max_cells = int(max_cells)
+    if max_cells <= 0 or grid_cells(bounds, mesh_step, mesh_margin) <= max_cells:
+        return bounds
+
+    # Even a mesh grid around a single point has (2 * mesh_margin / mesh_step) ** 2 cells.
+    if grid_cells(np.concatenate([center, center]), mesh_step, mesh_margin) > max_cells:
+        raise ValueError(f'The maximum of {max_cells} mesh cells is smaller than the margin of the mesh grid alone.')
+
+    center = np.clip(center, bounds[:2], bounds[2:])
+    low, high = 0.0, 1.0
+    for _ in range(50):
+        share = (low + high) / 2
+        shrunk = np.concatenate([center - (center - bounds[:2]) * share, center + (bounds[2:] - center) * share])
+        if grid_cells(shrunk, mesh_step, mesh_margin) <= max_cells:
+            low = share
+        else:
+            high = share
+
+    return np.concatenate([center - (center - bounds[:2]) * low, center + (bounds[2:] - center) * low])
+
+
+def outside_extent(xy, extent):
+
+    """
+    Returns which points are outside an extent.
+
+    Args:
+        xy (np.ndarray): The x and y coordinates of the points.
+        extent (np.ndarray): The extent (minx, miny, maxx, maxy).
+
+    Returns:
+        np.ndarray: True for the points outside the extent.
+    """
+
+    return ((xy < extent[:2]) | (xy > extent[2:])).any(axis = 1)
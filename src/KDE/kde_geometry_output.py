@@ -0,0 +1,275 @@
+import os
+import numpy as np
+import shapely
+
+class GeometryOutput():
+
+    """
+    Output stage for the KDE contour polygons.
+
+    The contours that contourf emits have a vertex for every crossing of the 2 km mesh and every coordinate in full float precision,
+    which bloats the GeoPackages and slows down every later overlay and dissolve. This class snaps the polygons to a precision grid
+    that is consistent with the mesh, simplifies them topology-preservingly into several levels of detail (LOD) and validates every
+    level, so that gpd.overlay and unary_union never get invalid rings.
+
+    The full detail level (lod0) is only snapped to the precision grid, the other levels are simplified with a tolerance relative to
+    the mesh step. The levels of detail are written into the same GeoPackage: the first level as the first (default) layer and the
+    others as layers named after the level.
+
+    The contour bands of contourf are disjoint, but snapping and simplifying every band on its own moves the edges that neighbouring
+    bands share differently, so that the bands overlap. With disjoint_levels the bands are therefore rebuilt from one shared set
+    of edges, which is snapped and simplified once for every level of detail, so that the bands never overlap. The cumulative
+    levels of the merged map overlap on purpose, so it turns this off.
+
+    Attributes:
+        mesh_step (float): The distance between the mesh grid's cells in meters.
+        precision (float): The size of the precision grid in meters.
+        lod_tolerances (dict): The simplification tolerance in meters of each level of detail.
+        disjoint_levels (bool): Whether the bands of the levels are rebuilt from shared edges so that they do not overlap.
+
+    Methods:
+        prepare(self, gdf): Snaps the polygons to the precision grid and validates them.
+        make_disjoint(self, gdf, tolerance=0): Rebuilds the bands from one shared set of edges.
+        overlap_area(self, gdf): Returns the area where the bands overlap each other.
+        level_of_detail(self, gdf, lod): Creates a simplified level of detail of the polygons.
+        levels_of_detail(self, gdf): Creates every level of detail of the polygons.
+        full_detail(self, gdf): Creates the full detail level of the polygons.
+        write(self, gdf, file_path): Writes every level of detail of the polygons to a GeoPackage.
+    """
+
+
+    def __init__(self, mesh_step = 2000, precision = None, lod_tolerances = None, disjoint_levels = True):
+
+        """
+        Initialize the GeometryOutput class.
+
+        Args:
+            mesh_step (float): The distance between the mesh grid's cells in meters.
+            precision (float, optional): The size of the precision grid in meters, defaults to 1/100 of the mesh step.
+            lod_tolerances (dict, optional): The simplification tolerance of each level of detail, the first one being the full detail level.
+                Defaults to no simplification, 1/4 of a mesh step and one mesh step.
+            disjoint_levels (bool): Whether the bands of the levels are rebuilt from shared edges so that they do not overlap.
+        """
+
+        self.mesh_step = mesh_step
+        self.precision = mesh_step / 100 if precision is None else precision
+
+        if lod_tolerances is None:
+            lod_tolerances = {'lod0': 0, 'lod1': mesh_step / 4, 'lod2': mesh_step}
+
+        self.lod_tolerances = lod_tolerances
+        self.disjoint_levels = disjoint_levels
+
+
+    def prepare(self, gdf):
+
+        """
+        Snaps the polygons to the precision grid and validates them, and rebuilds the bands so that they do not overlap with disjoint_levels.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons.
+
+        Returns:
+            gpd.GeoDataFrame: A copy of the polygons snapped to the precision grid with only valid polygonal geometries.
+        """
+
+        gdf = gdf.copy()
+        gdf['geometry'] = self.__validate(shapely.set_precision(gdf.geometry.to_numpy(), self.precision))
+
+        if self.disjoint_levels:
+            return self.make_disjoint(gdf)
+
+        if 'area' in gdf:
+            gdf['area'] = gdf['geometry'].area
+
+        return gdf
+
+
+    def make_disjoint(self, gdf, tolerance = 0):
+
+        """
+        Rebuilds the bands from one shared set of edges, so that the bands do not overlap.
+
+        The edges of all the bands are noded once on the precision grid, simplified together if a tolerance is given, so that the
+        edge between two bands is simplified once for both, and polygonized into faces. Every face goes to the band which covers
+        most of it, and the faces of a band are joined with a coverage union. Neighbouring bands then have exactly the same edges.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons, already snapped to the precision grid.
+            tolerance (float): The simplification tolerance of the edges in meters, 0 for no simplification.
+
+        Returns:
+            gpd.GeoDataFrame: A copy of the polygons where no two bands overlap.
+        """
+
+        gdf = gdf.copy()
+        geometries = gdf.geometry.to_numpy()
+
+        edges = shapely.line_merge(shapely.union_all(shapely.boundary(geometries), grid_size = self.precision))
+        if tolerance > 0:
+            simplified = shapely.simplify(edges, tolerance, preserve_topology = True)
+            edges = shapely.union_all(shapely.get_parts(simplified), grid_size = self.precision)
+        faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(edges)))
+
+        # A face goes to the band which covers most of it, the faces which are mostly outside every band, e.g. in the holes of the bands, are left out.
+        face_index, band_index = shapely.STRtree(geometries).query(faces, predicate = 'intersects')
+        covered = shapely.area(shapely.intersection(faces[face_index], geometries[band_index]))
+        order = np.lexsort((-covered, face_index))
+        face_index, band_index, covered = face_index[order], band_index[order], covered[order]
+        first = np.unique(face_index, return_index = True)[1]
+        face_index, band_index, covered = face_index[first], band_index[first], covered[first]
+        inside = covered >= shapely.area(faces[face_index]) / 2
+        face_index, band_index = face_index[inside], band_index[inside]
+
+        bands = np.empty(len(geometries), dtype = object)
+        for band in range(len(geometries)):
+            band_faces = faces[face_index[band_index == band]]
+            bands[band] = shapely.coverage_union_all(band_faces) if len(band_faces) else shapely.Polygon()
+
+        gdf['geometry'] = self.__validate(bands)
+
+        if 'area' in gdf:
+            gdf['area'] = gdf['geometry'].area
+
+        return gdf
+
+
+    def overlap_area(self, gdf):
+
+        """
+        Returns the area where the bands overlap each other, which is 0 for disjoint bands.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons.
+
+        Returns:
+            float: The sum of the areas of the intersections of every two bands in square meters.
+        """
+
+        geometries = gdf.geometry.to_numpy()
+        first, second = np.triu_indices(len(geometries), k = 1)
+
+        return float(shapely.area(shapely.intersection(geometries[first], geometries[second])).sum())
+
+
+    def level_of_detail(self, gdf, lod):
+
+        """
+        Creates a simplified level of detail of the polygons.
+
+        The polygons are simplified topology-preservingly, then snapped again to the precision grid and validated. With
+        disjoint_levels the shared edges of the bands are simplified instead, once for both bands of an edge, see make_disjoint.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons, already prepared.
+            lod (str): The name of the level of detail in lod_tolerances.
+
+        Returns:
+            gpd.GeoDataFrame: The simplified polygons.
+        """
+
+        tolerance = self.lod_tolerances[lod]
+        if tolerance == 0:
+            return gdf
+
+        if self.disjoint_levels:
+            return self.make_disjoint(gdf, tolerance)
+
+        gdf = gdf.copy()
+        simplified = shapely.simplify(gdf.geometry.to_numpy(), tolerance, preserve_topology = True)
+        gdf['geometry'] = self.__validate(shapely.set_precision(simplified, self.precision))
+
+        if 'area' in gdf:
+            gdf['area'] = gdf['geometry'].area
+
+        return gdf
+
+
+    def levels_of_detail(self, gdf):
+
+        """
+        Creates every level of detail of the polygons.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons.
+
+        Returns:
+            dict: The polygons of every level of detail by the name of the level, the full detail level first.
+        """
+
+        prepared = self.prepare(gdf)
+
+        return {lod: self.level_of_detail(prepared, lod) for lod in self.lod_tolerances}
+
+
+    def full_detail(self, gdf):
+
+        """
+        Creates the full detail level of the polygons, which is the level that is used in the further analysis.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons.
+
+        Returns:
+            gpd.GeoDataFrame: The polygons of the full detail level.
+        """
+
+        return self.level_of_detail(self.prepare(gdf), next(iter(self.lod_tolerances)))
+
+
+    def write(self, gdf, file_path):
+
+        """
+        Writes every level of detail of the polygons to a GeoPackage.
+
+        A previous file is removed first so that the full detail level is always the first layer, which is the one read by default.
+
+        Args:
+            gdf (gpd.GeoDataFrame): The contour polygons.
+            file_path (str): The path of the GeoPackage file.
+
+        Returns:
+            gpd.GeoDataFrame: The full detail level that was written.
+        """
+
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+        full_detail = None
+
+        for lod, level in self.levels_of_detail(gdf).items():
+
+            if full_detail is None:
+                full_detail = level
+                level.to_file(file_path, driver='GPKG')
+            else:
+                level.to_file(file_path, layer = lod, driver='GPKG')
+
+        return full_detail
+
+
+    def __validate(self, geometries):
+
+        """
+        Repairs invalid geometries and keeps only their polygonal parts.
+
+        Args:
+            geometries (np.ndarray): An array of shapely geometries.
+
+        Returns:
+            np.ndarray: The valid polygonal geometries.
+        """
+
+        invalid = ~shapely.is_valid(geometries)
+        if invalid.any():
+            geometries = geometries.copy()
+            geometries[invalid] = shapely.make_valid(geometries[invalid])
+
+        # Repairing can leave lines or points in a collection, only the polygons are kept.
+        collections = shapely.get_type_id(geometries) == shapely.GeometryType.GEOMETRYCOLLECTION
+        for index in collections.nonzero()[0]:
+            parts = shapely.get_parts(shapely.get_parts(geometries[index]))
+            polygons = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON]
+            geometries[index] = shapely.multipolygons(polygons)
+
+        return geometries
@@ -0,0 +1,301 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+from KDE.kde_contours import contour_levels
+from KDE.kde_contours import contour_to_level_polygons
+from get_dotenv import output_folder_path
+from get_dotenv import output_all_path
+
+class DensityGridStore():
+
+    """
+    Store for the log-density grids of the KDE visualization.
+
+    Every country's log-density grid is saved as a .npy array together with a .json file holding its georeferencing
+    metadata (origin, step, shape, EPSG) and the KDE parameters. The grids are opened as memory-mapped arrays, so only the
+    grids that a request needs are loaded and only the parts of them that are read. From the store the KDE can be re-contoured,
+    re-clipped and re-rendered with other levels or styles without fitting the KDE to the raw points again.
+
+    Attributes:
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        store_path (str): The folder where the grids are saved.
+
+    Methods:
+        grid_key(self, cntr_od, country_id, analysis_bandwidth, movement_limit, kernel_type, metric_type, variant=None): Creates the key of a grid.
+        save_grid(self, ...): Saves a log-density grid and its metadata.
+        grids(self, cntr_od=None, country_id=None): Lists the metadata of the saved grids.
+        metadata(self, key): Reads the metadata of a grid.
+        load_grid(self, key): Opens a grid as a memory-mapped array.
+        mesh(self, metadata): Recreates the mesh grid of a grid.
+        recontour(self, key, amount_of_levels=20): Creates the contour polygons of a grid.
+        reclip(self, key, region, amount_of_levels=20): Creates the contour polygons of a grid clipped to a region.
+        rerender(self, keys, border_service, file_path=None, amount_of_levels=20, cmap='inferno'): Renders clipped contours of grids to a map.
+    """
+
+
+    def __init__(self, program_epsg, store_path = None):
+
+        """
+        Initialize the DensityGridStore class.
+
+        Args:
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            store_path (str, optional): The folder of the store, defaults to density_grids/ in the output folder.
+        """
+
+        self.program_epsg = program_epsg
+
+        if store_path is None:
+            store_path = f'{output_folder_path}{output_all_path}density_grids/'
+
+        self.store_path = store_path
+
+
+    def grid_key(self, cntr_od, country_id, analysis_bandwidth, movement_limit, kernel_type, metric_type, variant = None):
+
+        """
+        Creates the key of a grid, which is also the grid's file name without the file extension.
+
+        The other grids of a country, e.g. the time slices of the spatio-temporal KDE or the bootstrap quantiles,
+        have their variant at the end of their key.
+
+        Returns:
+            str: The key of the grid.
+        """
+
+        key = f'{cntr_od}/{country_id}_{analysis_bandwidth}BW_{movement_limit}movelimit_{kernel_type}_{metric_type}'
+
+        return key if variant is None else f'{key}_{variant}'
+
+
+    def save_grid(self, cntr_od, country_id, pred_grid, origin, step, analysis_bandwidth, movement_limit, kernel_type, metric_type, variant = None):
+
+        """
+        Saves a log-density grid and its georeferencing metadata.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+            country_id (str): The identifier of the country.
+            pred_grid (np.ndarray): The log-density grid with the rows along the y-axis.
+            origin (tuple): The x and y coordinates of the grid's first cell.
+            step (float): The distance between the grid's cells in meters.
+            analysis_bandwidth (int): The bandwidth of the KDE.
+            movement_limit (str): The movement limit in kilometers.
+            kernel_type (str): The kernel type of the KDE.
+            metric_type (str): The metric type of the KDE.
+            variant (str, optional): The variant of the grid, e.g. the time slice month_1TBW_Jan or the bootstrap quantile 200bootstrap_q05,
+                which starts with the variant of the run's settings.
+
+        Returns:
+            str: The key of the saved grid.
+        """
+
+        key = self.grid_key(cntr_od, country_id, analysis_bandwidth, movement_limit, kernel_type, metric_type, variant)
+        os.makedirs(os.path.dirname(f'{self.store_path}{key}'), exist_ok = True)
+
+        pred_grid = np.ascontiguousarray(pred_grid, dtype = np.float32)
+        np.save(f'{self.store_path}{key}.npy', pred_grid)
+
+        metadata = {
+            'key': key,
+            'cntr_od': cntr_od,
+            'country_id': country_id,
+            'variant': variant,
+            'origin': [float(origin[0]), float(origin[1])],
+            'step': float(step),
+            'shape': list(pred_grid.shape),
+            'epsg': self.program_epsg,
+            'max': float(np.nanmax(pred_grid)),
+            'parameters': {
+                'analysis_bandwidth': analysis_bandwidth,
+                'movement_limit': movement_limit,
+                'kernel_type': kernel_type,
+                'metric_type': metric_type,
+            },
+        }
+
+        with open(f'{self.store_path}{key}.json', 'w') as file:
+            json.dump(metadata, file, indent = 2)
+
+        return key
+
+
+    def grids(self, cntr_od = None, country_id = None):
+
+        """
+        Lists the metadata of the saved grids, without loading the grids themselves.
+
+        Args:
+            cntr_od (str, optional): Lists only the grids of this country pair.
+            country_id (str, optional): Lists only the grids of this country.
+
+        Returns:
+            list: The metadata dictionaries of the grids.
+        """
+
+        if not os.path.isdir(self.store_path):
+            return []
+
+        found = []
+        for pair_folder in sorted(os.listdir(self.store_path)):
+            if cntr_od is not None and pair_folder != cntr_od:
+                continue
+
+            folder = os.path.join(self.store_path, pair_folder)
+            if not os.path.isdir(folder):
+                continue
+
+            for filename in sorted(os.listdir(folder)):
+                if filename.endswith('.json'):
+                    metadata = self.metadata(f'{pair_folder}/{filename[:-5]}')
+                    if country_id is None or metadata['country_id'] == country_id:
+                        found.append(metadata)
+
+        return found
+
+
+    def metadata(self, key):
+
+        """
+        Reads the metadata of a grid.
+
+        Args:
+            key (str): The key of the grid.
+
+        Returns:
+            dict: The metadata of the grid.
+        """
+
+        with open(f'{self.store_path}{key}.json') as file:
+            return json.load(file)
+
+
+    def load_grid(self, key):
+
+        """
+        Opens a grid as a read-only memory-mapped array.
+
+        Args:
+            key (str): The key of the grid.
+
+        Returns:
+            tuple: The memory-mapped grid (np.memmap) and its metadata (dict).
+        """
+
+        return np.load(f'{self.store_path}{key}.npy', mmap_mode = 'r'), self.metadata(key)
+
+
+    def mesh(self, metadata):
+
+        """
+        Recreates the x and y mesh grid of a grid from its metadata.
+
+        Args:
+            metadata (dict): The metadata of the grid.
+
+        Returns:
+            tuple: The x and y mesh grids.
+        """
+
+        rows, columns = metadata['shape']
+        x0, y0 = metadata['origin']
+        step = metadata['step']
+
+        return np.meshgrid(x0 + np.arange(columns) * step, y0 + np.arange(rows) * step)
+
+
+    def recontour(self, key, amount_of_levels = 20):
+
+        """
+        Creates the contour polygons of a grid.
+
+        The contours are created on an off-screen figure so that nothing is shown to the user.
+
+        Args:
+            key (str): The key of the grid.
+            amount_of_levels (int): The amount of contour levels.
+
+        Returns:
+            gpd.GeoDataFrame: The contour polygons with their levels and areas.
+        """
+
+        pred_grid, metadata = self.load_grid(key)
+        x_mesh, y_mesh = self.mesh(metadata)
+        levels, labels = contour_levels(metadata['max'], amount_of_levels)
+
+        ax = Figure().add_subplot()
+        contour = ax.contourf(x_mesh, y_mesh, pred_grid, levels = levels)
+
+        df_of_polygons = pd.DataFrame(contour_to_level_polygons(contour, labels), columns = ['level', 'geometry'])
+        gdf_of_polygons = gpd.GeoDataFrame(df_of_polygons, geometry = 'geometry', crs = metadata['epsg'])
+        gdf_of_polygons['area'] = gdf_of_polygons['geometry'].area
+
+        return gdf_of_polygons
+
+
+    def reclip(self, key, region, amount_of_levels = 20):
+
+        """
+        Creates the contour polygons of a grid clipped to a region, such as the country's border polygon.
+
+        Args:
+            key (str): The key of the grid.
+            region (gpd.GeoDataFrame): The region to clip the contour polygons with.
+            amount_of_levels (int): The amount of contour levels.
+
+        Returns:
+            gpd.GeoDataFrame: The clipped contour polygons.
+        """
+
+        gdf_of_polygons = self.recontour(key, amount_of_levels)
+
+        return gpd.overlay(gdf_of_polygons, region.to_crs(gdf_of_polygons.crs), how = 'intersection')
+
+
+    def rerender(self, keys, border_service, file_path = None, amount_of_levels = 20, cmap = 'inferno'):
+
+        """
+        Renders the clipped contours of one or more grids, e.g. both countries of a pair, to a map.
+
+        Every grid is clipped to the border polygon of its own country.
+
+        Args:
+            keys (list): The keys of the grids.
+            border_service (BorderService): The indexed country border data.
+            file_path (str, optional): Where to save the map as .png, the map is only returned if not given.
+            amount_of_levels (int): The amount of contour levels.
+            cmap (str): The colormap of the contour levels.
+
+        Returns:
+            tuple: The figure and the merged clipped contour polygons (gpd.GeoDataFrame).
+        """
+
+        clipped_layers = []
+        regions = []
+        for key in keys:
+            country_id = self.metadata(key)['country_id']
+            region = border_service.country(country_id)
+            clipped_layers.append(self.reclip(key, region, amount_of_levels))
+            regions.append(region)
+
+        merged_layers = pd.concat(clipped_layers, ignore_index = True)
+
+        # An off-screen figure like in recontour, so that repeated calls do not leave figures open in pyplot.
+        fig = Figure(figsize=(10, 10))
+        ax = fig.add_subplot()
+        for region in regions:
+            region.plot(ax = ax, alpha = 0.1, facecolor = 'grey', edgecolor = 'black')
+        merged_layers.plot(column = 'level', cmap = plt.get_cmap(cmap).reversed(), alpha = 0.8, ax = ax)
+        for region in regions:
+            region.plot(ax = ax, alpha = 0.4, facecolor = 'none', edgecolor = 'black')
+        ax.axis('off')
+
+        if file_path is not None:
+            fig.savefig(file_path, bbox_inches='tight', dpi = 300)
+
+        return fig, merged_layers
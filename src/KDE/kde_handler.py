@@ -1,8 +1,40 @@
+import traceback
+
 from CountryCodes.lst_of_cntr_od import lst_of_cntr_od
 from KDE.kde_visualizer import KdeVisualizer
 from KDE.kde_country_organizer import CountryOrganizer
 from KDE.kde_data import KDEdata
-import sys
+from KDE.kde_instrumentation import KdeInstrumentation
+from KDE.kde_run_manifest import KdeRunManifest
+from KDE.kde_result_backend import run_parameters
+from KDE.kde_background_writer import BackgroundWriter
+from KDE.kde_extent import extent_methods
+from KDE.kde_hexagonal import kde_engines
+from KDE.kde_pair_discovery import pair_sources
+from KDE.kde_pair_discovery import pair_orders
+from KDE.kde_pair_discovery import pair_point_counts
+from KDE.kde_pair_discovery import data_pairs
+from KDE.kde_pair_discovery import adjacent_pairs
+from KDE.kde_pair_discovery import pair_costs
+from KDE.kde_pair_discovery import schedule_pairs
+from KDE.kde_pair_discovery import shard_pairs
+from get_dotenv import result_backend
+from get_dotenv import profile_pairs
+from get_dotenv import progressive_kde
+from get_dotenv import temporal_kde
+from get_dotenv import temporal_bandwidth
+from get_dotenv import bootstrap_replicates
+from get_dotenv import shared_pair_grid
+from get_dotenv import kde_tree_tuning
+from get_dotenv import write_queue_size
+from get_dotenv import extent_method
+from get_dotenv import max_grid_cells
+from get_dotenv import drop_extent_outliers
+from get_dotenv import kde_engine
+from get_dotenv import h3_resolution
+from get_dotenv import pair_source
+from get_dotenv import min_pair_points
+from get_dotenv import pair_order
 
 class KdeHandler():
 
@@ -10,9 +42,12 @@ class KdeHandler():
     Class for handling Kernel Density Estimation (KDE) visualization based on user input.
 
     This class initializes the KDE visualization for the entire list of country pairs or for one specific country pair, depending on user input.
+    In a batch run the KDE visualization is done for a given list of country pairs, with data that has been read in once for all the batch jobs.
+    The country pairs of a run of all pairs come from lst_of_cntr_od, the data or the border adjacency, and they are run from the most
+    expensive to the cheapest by the amount of their points or their time in an earlier run.
 
     Attributes:
-        type_of_kde_analysis (str): The type of KDE visualization (pair or all).
+        type_of_kde_analysis (str): The type of KDE visualization (pair, all or batch).
         analysis_bandwidth (str): The bandwidth for the KDE visualization.
         kernel_type (str): The kernel type for the KDE visualization (gaussian or epanechnikov).
         metric_type (str): The metric type for the KDE visualization (euclidean, haversine, or none).
@@ -20,25 +55,80 @@ class KdeHandler():
         movement_limit (str): The movement limit in kilometers.
         country_pair (list): A list of country abbreviations for pair visualization.
         program_epsg (int): The EPSG code for the program's coordinate reference system.
+        result_backend_type (str): The result backend of the KDE polygons (files, gpkg or parquet).
+        instrumentation (KdeInstrumentation): Records the time and memory use of every stage and writes the run report.
+        resume (bool): Whether the country pairs which are already done in the run manifest are skipped in multi and batch runs.
+        manifest (KdeRunManifest): The run manifest of the KDE parameters, with the status of every country pair.
+        progressive (bool): Whether the KDE is first previewed from a subsample and then refined until its contours stop changing.
+        temporal (str): The time step of the spatio-temporal KDE (month, weekday or hour_of_week), or no.
+        temporal_bandwidth (float): The bandwidth of the spatio-temporal KDE's temporal kernel in time slices.
+        bootstrap (int): The amount of bootstrap replicates of the confidence bands of the contours, 0 for no confidence bands.
+        shared_grid (bool): Whether both countries of a pair are evaluated on one mesh grid and the pair's derived surfaces are created.
+        tree_tuning (str): The maximum relative error of the density with tuned tree settings of the KDE, or no.
+        writer (BackgroundWriter): Writes the figures and results of the country pairs while the next pair is computed.
+        extent (str): How the extent of the countries' mesh grids is chosen (bounds, quantile or border).
+        max_cells (int): The maximum amount of cells of a mesh grid, 0 for no maximum.
+        drop_outliers (bool): Whether the points outside the extent of the mesh grid are left out of the KDE.
+        kde_engine (str): The engine of the KDE, the mesh grid or the H3 cells (mesh or hexagonal).
+        h3_resolution (str): The H3 resolution of the hexagonal KDE, or auto.
+        pair_source (str): Where the country pairs of a run of all pairs come from (list, data or borders).
+        min_points (int): The minimum amount of points of each country of a pair found in the data.
+        pair_order (str): The order of the country pairs of a multi or batch run, by estimated cost or as listed (cost or list).
+        shard (str): The shard of the country pairs that this run computes, e.g. 2/4, or None for all of them.
+        pair_costs (pd.Series): The estimated cost of every country pair in the data.
+        pending_pairs (list): The country pairs whose writes are not yet recorded in the run manifest.
         failed_countries_list (list): A list to store failed countries during visualization.
 
     Methods:
         multi_kde_country_list(self): Returns a list of country pairs for multi-country KDE visualization.
+        __schedule(self, country_list): Orders the country pairs by their estimated cost and selects the pairs of the shard.
         initialize(self): Initializes the KDE visualization based on user input.
         pair_kde_analysis(self, country_od, country1_id, country2_id): Performs KDE visualization for a specific country pair.
         multi_kde_analysis(self, country_list): Calls the pair_kde_analysis function to performs KDE visualization for multiple country pairs in order.
+        __record_written_pairs(self, wait=False): Records the country pairs whose writes are finished in the run manifest.
+        __pair_timings(self, pair_measurements): Returns the timings of a country pair for the run manifest.
         __get_cntr_od(self, country_pair): Determines the canonical country pair identifier.
         countries_id(self, country_od): Extracts country identifiers from the country pair identifier.
     """
 
 
-    def __init__(self, kde_questions):
+    def __init__(self, kde_questions, kde_data = None, country_list = None, result_backend_type = result_backend, profile = profile_pairs == 'yes', resume = True, progressive = progressive_kde == 'yes', temporal = temporal_kde, temporal_bandwidth = temporal_bandwidth, bootstrap = bootstrap_replicates, shared_grid = shared_pair_grid == 'yes', tree_tuning = kde_tree_tuning, write_queue = write_queue_size,
+                 extent = extent_method, max_cells = max_grid_cells, drop_outliers = drop_extent_outliers == 'yes', kde_engine = kde_engine, h3_resolution = h3_resolution,
+                 pair_source = pair_source, min_points = min_pair_points, pair_order = pair_order, shard = None):
 
         """
         Initialize the KdeHandler class based on user input from KdeQuestions.
 
         Args:
-            kde_questions (KdeQuestions): An instance of KdeQuestions containing user-provided parameters.
+            kde_questions (KdeQuestions or KdeParameters): The user-provided or batch job parameters.
+            kde_data (KDEdata, optional): Data that has already been read in, it is read in here if not given.
+            country_list (list, optional): The country pairs of a batch run.
+            result_backend_type (str): The result backend of the KDE polygons, defaults to RESULT_BACKEND in the .env file.
+            profile (bool): Whether every country pair is profiled with cProfile, defaults to PROFILE_PAIRS in the .env file.
+            resume (bool): Whether the country pairs which are already done in the run manifest are skipped in multi and batch runs.
+            progressive (bool): Whether the KDE is previewed from a subsample and refined, defaults to PROGRESSIVE_KDE in the .env file.
+            temporal (str): The time step of the spatio-temporal KDE (month, weekday or hour_of_week) or no, defaults to TEMPORAL_KDE in the .env file.
+            temporal_bandwidth (float or str): The temporal bandwidth in time slices, defaults to TEMPORAL_BANDWIDTH in the .env file.
+            bootstrap (int or str): The amount of bootstrap replicates of the confidence bands, 0 for none, defaults to BOOTSTRAP_REPLICATES in the .env file.
+            shared_grid (bool): Whether both countries of a pair are evaluated on one mesh grid and the combined, log-ratio and difference
+                surfaces are created, defaults to SHARED_PAIR_GRID in the .env file.
+            tree_tuning (str or float): The maximum relative error of the density with tuned tree settings, or no for the defaults of
+                KernelDensity, defaults to KDE_TREE_TUNING in the .env file.
+            write_queue (int or str): The amount of writes queued to the background writer at a time, 0 for writing right away,
+                defaults to WRITE_QUEUE_SIZE in the .env file.
+            extent (str): How the extent of the countries' mesh grids is chosen (bounds, quantile or border), defaults to EXTENT_METHOD in the .env file.
+            max_cells (int or str): The maximum amount of cells of a mesh grid, 0 for no maximum, defaults to MAX_GRID_CELLS in the .env file.
+            drop_outliers (bool): Whether the points outside the extent are left out of the KDE, defaults to DROP_EXTENT_OUTLIERS in the .env file.
+            kde_engine (str): The engine of the KDE (mesh or hexagonal), defaults to KDE_ENGINE in the .env file.
+                The hexagonal KDE has no mesh grid, so it cannot be combined with the progressive, spatio-temporal or bootstrap KDE or the shared grid.
+            h3_resolution (int or str): The H3 resolution of the hexagonal KDE or auto, defaults to H3_RESOLUTION in the .env file.
+            pair_source (str): Where the country pairs of a run of all pairs come from, lst_of_cntr_od, every pair in the data or the
+                neighbouring countries in the border data (list, data or borders), defaults to PAIR_SOURCE in the .env file.
+            min_points (int or str): The minimum amount of points of each country of a pair found in the data, defaults to MIN_PAIR_POINTS in the .env file.
+            pair_order (str): The order of the country pairs of a multi or batch run, from the most expensive to the cheapest or as listed
+                (cost or list), defaults to PAIR_ORDER in the .env file.
+            shard (str, optional): The shard of the country pairs that this run computes, e.g. 2/4 for the second of four shards
+                of about the same cost, which are run on different machines. All country pairs are run if not given.
         """
         
         self.type_of_kde_analysis = kde_questions.type_of_kde_analysis
@@ -49,9 +139,58 @@ class KdeHandler():
         self.movement_limit = kde_questions.movement_limit
         self.country_pair = kde_questions.country_pair
 
+        self.kde_data = kde_data
+        self.country_list = country_list
+        self.result_backend_type = result_backend_type
+        self.instrumentation = KdeInstrumentation(profile = profile)
+        self.resume = resume
+        self.progressive = progressive
+        self.temporal = temporal
+        self.temporal_bandwidth = float(temporal_bandwidth)
+        self.bootstrap = int(bootstrap)
+        self.shared_grid = shared_grid
+        self.tree_tuning = str(tree_tuning)
+        self.writer = BackgroundWriter(write_queue)
+        if extent not in extent_methods:
+            raise ValueError(f'Invalid extent method {extent}, the options are {", ".join(extent_methods)}.')
+        self.extent = extent
+        self.max_cells = int(max_cells)
+        self.drop_outliers = drop_outliers
+        if kde_engine not in kde_engines:
+            raise ValueError(f'Invalid KDE engine {kde_engine}, the options are {", ".join(kde_engines)}.')
+        if kde_engine == 'hexagonal' and (self.progressive or self.temporal != 'no' or self.bootstrap > 0 or self.shared_grid):
+            raise ValueError('The hexagonal KDE has no mesh grid, so it cannot be combined with the progressive, spatio-temporal or bootstrap KDE or the shared grid.')
+        self.kde_engine = kde_engine
+        self.h3_resolution = str(h3_resolution)
+        if pair_source not in pair_sources:
+            raise ValueError(f'Invalid pair source {pair_source}, the options are {", ".join(pair_sources)}.')
+        if pair_order not in pair_orders:
+            raise ValueError(f'Invalid pair order {pair_order}, the options are {", ".join(pair_orders)}.')
+        self.pair_source = pair_source
+        self.min_points = int(min_points)
+        self.pair_order = pair_order
+        self.shard = None
+        if shard is not None:
+            shard_number, shards = (int(part) for part in str(shard).split('/'))
+            if not 1 <= shard_number <= shards:
+                raise ValueError(f'Invalid shard {shard}, it has to be e.g. 2/4 for the second of four shards.')
+            self.shard = f'{shard_number}/{shards}'
+        self.pair_costs = None
+        self.pending_pairs = []
+
+        manifest_parameters = run_parameters(self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type, temporal = self.temporal,
+                                             temporal_bandwidth = self.temporal_bandwidth, bootstrap = self.bootstrap, shared_grid = self.shared_grid,
+                                             drop_outliers = self.drop_outliers, kde_engine = self.kde_engine, h3_resolution = self.h3_resolution,
+                                             progressive = self.progressive, tree_tuning = self.tree_tuning, extent = self.extent, max_cells = self.max_cells)
+        # The results of a pair are only usable from the backend they were written to, so a run with another backend does not skip them.
+        manifest_parameters['result_backend'] = self.result_backend_type
+        if self.shard is not None:
+            manifest_parameters['shard'] = self.shard
+        self.manifest = KdeRunManifest(manifest_parameters)
+
         self.program_epsg = 3035
-        self.__initialize_kde_handling()
         self.failed_countries_list = []
+        self.__initialize_kde_handling()
     
 
     def __initialize_kde_handling(self):
@@ -71,21 +210,42 @@ class KdeHandler():
             It calls the multi_kde_country_list method to fetch the list of the country pairs        
             and then calls for the method multi_kde_analysis with the list of country pairs as parameter.           
             There it iterates thorugh the list and does a kde visualization for each country pair in the list iteratively. 
+
+        If the type of the kde analysis is batch, then the same is done for the country pairs of the batch job.
+
+        Finally the queued writes are finished and recorded in the run manifest, also if the analysis fails,
+        and the time and memory use of every stage and write is written to the run report.
         """
-        self.data = KDEdata(self.program_epsg)
+        with self.instrumentation.stage('load_data') as counts:
+            self.data = KDEdata(self.program_epsg, self.temporal != 'no', self.kde_engine == 'hexagonal') if self.kde_data is None else self.kde_data
+            counts['rows'] = len(self.data.df)
         self.df = self.data.df
         self.border_data = self.data.border_data
+        self.border_service = self.data.border_service
 
-        if self.type_of_kde_analysis == "pair":
-            country_od = self.__get_cntr_od(self.country_pair)
-            country1_id, country2_id = self.__countries_id(country_od)
-            self.__pair_kde_analysis(country_od, country1_id, country2_id)
-            
+        try:
+            if self.type_of_kde_analysis == "pair":
+                country_od = self.__get_cntr_od(self.country_pair)
+                country1_id, country2_id = self.__countries_id(country_od)
+                self.__pair_kde_analysis(country_od, country1_id, country2_id)
+                
 
-        if self.type_of_kde_analysis == "all":
-            country_list = self.__multi_kde_country_list()
-            self.__multi_kde_analysis(country_list)  
-            self.__multi_kde_analysis(lst_of_cntr_od)  
+            if self.type_of_kde_analysis == "all":
+                country_list = self.__multi_kde_country_list()
+                self.__multi_kde_analysis(country_list)  
+
+            if self.type_of_kde_analysis == "batch":
+                country_list = self.__multi_kde_country_list() if self.country_list is None else self.country_list
+                self.__multi_kde_analysis(country_list)
+
+        finally:
+            with self.instrumentation.stage('flush_writes', pairs = len(self.pending_pairs)):
+                self.writer.close()
+            self.__record_written_pairs(wait = True)
+            self.instrumentation.writes = self.writer.jobs
+
+        json_path, csv_path = self.instrumentation.write_report()
+        print(f'Run report saved to {json_path} and {csv_path}')
     
 
     def __pair_kde_analysis(self, country_od, country1_id, country2_id):
@@ -97,24 +257,46 @@ class KdeHandler():
         saving the data of each country pairs into their own DataFrames. It then creates an instance of the 
         KdeVisualizer class, with multiple parameters among the DataFrame created above and creates the kde visualization. 
 
+        The status, output paths and timings of the country pair, and the traceback if it fails, are recorded in the run manifest.
+        The pair is recorded as done only when its results and figures are written, which happens in the background
+        while the next country pair is computed.
+
         Args:
             country_od (str): The canonical country pair identifier.
             country1_id (str): The identifier of the first country in the pair.
             country2_id (str): The identifier of the second country in the pair.
         """
 
-        self.country_1 = CountryOrganizer(self.df, country_od, country1_id, self.extent_of_kde_analysis, self.program_epsg, self.movement_limit)
-        self.country_2 = CountryOrganizer(self.df, country_od, country2_id, self.extent_of_kde_analysis, self.program_epsg, self.movement_limit)
-        self.country_1_coordinates = self.country_1.country_coordinates
-        self.country_2_coordinates = self.country_2.country_coordinates
-
-        print('KDE datahandler now done, proceed to analysis...')
-        print(' ')
-        kde_analysis = KdeVisualizer(self.country_1_coordinates, self.country_2_coordinates, country_od, country1_id, country2_id, self.type_of_kde_analysis, self.analysis_bandwidth, self.kernel_type, self.metric_type, self.extent_of_kde_analysis, self.movement_limit, self.program_epsg, self.border_data)
+        self.instrumentation.start_pair(country_od)
+        self.manifest.start(country_od)
+
+        try:
+            with self.instrumentation.stage('organize', country = country1_id) as counts:
+                self.country_1 = CountryOrganizer(self.df, country_od, country1_id, self.extent_of_kde_analysis, self.program_epsg, self.movement_limit)
+                counts['points'] = len(self.country_1.country_points)
+            with self.instrumentation.stage('organize', country = country2_id) as counts:
+                self.country_2 = CountryOrganizer(self.df, country_od, country2_id, self.extent_of_kde_analysis, self.program_epsg, self.movement_limit)
+                counts['points'] = len(self.country_2.country_points)
+            self.country_1_coordinates = self.country_1.country_points
+            self.country_2_coordinates = self.country_2.country_points
+
+            print('KDE datahandler now done, proceed to analysis...')
+            print(' ')
+            kde_analysis = KdeVisualizer(self.country_1_coordinates, self.country_2_coordinates, country_od, country1_id, country2_id, self.type_of_kde_analysis, self.analysis_bandwidth, self.kernel_type, self.metric_type, self.extent_of_kde_analysis, self.movement_limit, self.program_epsg, self.border_service,
+                                         result_backend_type = self.result_backend_type, instrumentation = self.instrumentation, progressive = self.progressive,
+                                         temporal = self.temporal, temporal_bandwidth = self.temporal_bandwidth, bootstrap = self.bootstrap,
+                                         shared_grid = self.shared_grid, tree_tuning = self.tree_tuning, writer = self.writer, extent = self.extent,
+                                         max_cells = self.max_cells, drop_outliers = self.drop_outliers, kde_engine = self.kde_engine, h3_resolution = self.h3_resolution)
+
+        except Exception as error:
+            timings = self.__pair_timings(self.instrumentation.end_pair('failed'))
+            self.manifest.failed(country_od, repr(error), traceback.format_exc(), timings)
+            raise
+
+        self.pending_pairs.append((country_od, kde_analysis.output_futures, self.instrumentation.end_pair('done')))
+        self.__record_written_pairs()
         print(' ')
         print('Program has finished.')
-        if self.type_of_kde_analysis == 'pair':
-            sys.exit()
 
 
     def __multi_kde_analysis(self, country_list):
@@ -127,21 +309,71 @@ class KdeHandler():
         the program is continued and the failed country pair is added to the failed_country_list so that the user knows 
         which country pairs failed. 
 
+        When resuming, the country pairs which are already done in the run manifest, e.g. before a crash, are skipped.
+        The country pairs are run from the most expensive to the cheapest, or only those of the shard of this run.
+
         Args:
             country_list (list): A list of country pair identifiers.
         """
-        
-        failed_countries_list = []
+
+        country_list = self.__schedule(country_list)
+
+        if self.resume:
+            done_pairs = [country_od for country_od in country_list if self.manifest.is_done(country_od)]
+            if done_pairs:
+                print(f'{len(done_pairs)} country pairs are already done in {self.manifest.manifest_path} and are skipped.')
+            country_list = [country_od for country_od in country_list if country_od not in done_pairs]
+
+        self.instrumentation.total_pairs = len(country_list)
+        self.instrumentation.pair_costs = {country_od: self.pair_costs.get(country_od, 0) for country_od in country_list}
+
         for country_od in country_list:
             country1_id, country2_id = self.__countries_id(country_od)
             try: 
                 self.__pair_kde_analysis(country_od, country1_id, country2_id)
-            except:
-                print(f'Analysis failed for {country_od}')
-                failed_countries_list.append(country_od)
+            except Exception as error:
+                print(f'Analysis failed for {country_od}: {error!r}')
+                self.failed_countries_list.append(country_od)
                 print(f'{country_od} added to list')
-        print(failed_countries_list)
-        sys.exit()
+        print(self.failed_countries_list)
+
+
+    def __record_written_pairs(self, wait = False):
+
+        """
+        Records the country pairs whose writes are finished in the run manifest, as done with their output paths or as failed
+        with the error of the first failed write. The failed pairs are also marked failed in the run report.
+
+        Args:
+            wait (bool): Whether to wait for the writes that are not finished yet.
+        """
+
+        pending_pairs = []
+        for country_od, output_futures, pair_measurements in self.pending_pairs:
+            if not wait and not all(future.done() for future in output_futures):
+                pending_pairs.append((country_od, output_futures, pair_measurements))
+                continue
+
+            errors = [future.exception() for future in output_futures if future.exception() is not None]
+            timings = self.__pair_timings(pair_measurements)
+
+            if errors:
+                pair_measurements['status'] = 'write_failed'
+                self.manifest.failed(country_od, repr(errors[0]), ''.join(traceback.format_exception(errors[0])), timings)
+                self.failed_countries_list.append(country_od)
+                print(f'{country_od} failed, its results could not be written.')
+
+            else:
+                self.manifest.done(country_od, [path for future in output_futures for path in future.result()], timings)
+
+        self.pending_pairs = pending_pairs
+
+
+    def __pair_timings(self, pair_measurements):
+
+        """Returns the wall and CPU time and the memory use of the country pair's measurements for the run manifest."""
+
+        return {key: pair_measurements[key] for key in ['wall_seconds', 'cpu_seconds', 'process_peak_rss_mb', 'peak_rss_increase_mb']}
 
 
     def __get_cntr_od(self, country_pair):
@@ -173,10 +405,70 @@ class KdeHandler():
         """
         Returns a list of country pairs for multi-country KDE visualization.
 
+        With the list source the pairs are those of lst_of_cntr_od which have points of both countries in the data, and the pairs
+        of the data which are not in the list are printed, so that they are not left out without notice. With the data source the pairs are every pair of the data whose both countries
+        have at least the minimum amount of points, and with the borders source only those of neighbouring countries.
+
         Returns:
             list: A list of country pair identifiers.
         """
 
-        cntr_od_lst = lst_of_cntr_od
-        return cntr_od_lst
+        point_counts = self.__pair_point_counts()
+        found_pairs = data_pairs(point_counts, self.min_points)
+
+        if self.pair_source == 'list':
+            unlisted_pairs = [country_od for country_od in found_pairs if country_od not in lst_of_cntr_od]
+            if unlisted_pairs:
+                print(f'{len(unlisted_pairs)} country pairs of the data are not in lst_of_cntr_od and are not run: {", ".join(unlisted_pairs)}')
+
+            # A pair without the points of one of its countries would only fail.
+            pairs_with_points = set(data_pairs(point_counts))
+            listed_pairs = [country_od for country_od in lst_of_cntr_od if country_od in pairs_with_points]
+            if len(listed_pairs) < len(lst_of_cntr_od):
+                print(f'{len(lst_of_cntr_od) - len(listed_pairs)} country pairs of lst_of_cntr_od have no points of one of the countries in the data and are not run.')
+            return listed_pairs
+
+        if self.pair_source == 'borders':
+            neighbours = set(adjacent_pairs(self.border_service))
+            found_pairs = [country_od for country_od in found_pairs if country_od in neighbours]
+
+        print(f'{len(found_pairs)} country pairs found from the {self.pair_source}.')
+        return found_pairs
+
+
+    def __pair_point_counts(self):
+
+        """Returns the amount of points of both countries of every country pair in the data, within the movement limit."""
+
+        return pair_point_counts(self.df, self.movement_limit if self.extent_of_kde_analysis == 'yes' else None)
+
+
+    def __schedule(self, country_list):
+
+        """
+        Orders the country pairs from the most expensive to the cheapest and selects the pairs of the shard of this run.
+
+        The cost of a pair is its time in an earlier run with the same parameters, or estimated from the amount of its points.
+        The shards are split by the amount of points only, so that every machine splits the pairs into the same shards.
+
+        Args:
+            country_list (list): A list of country pair identifiers.
+
+        Returns:
+            list: The country pairs of the run in the order they are run.
+        """
+
+        point_counts = self.__pair_point_counts()
+
+        if self.shard is not None:
+            shard_number, shards = (int(part) for part in self.shard.split('/'))
+            country_list = shard_pairs(country_list, pair_costs(point_counts), shards)[shard_number - 1]
+            print(f'Shard {self.shard} has {len(country_list)} country pairs.')
+
+        self.pair_costs = pair_costs(point_counts, self.manifest.pair_seconds())
+
+        if self.pair_order == 'list':
+            return list(country_list)
+
+        return schedule_pairs(country_list, self.pair_costs)
     
\ No newline at end of file
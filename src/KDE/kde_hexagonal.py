@@ -0,0 +1,306 @@
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from h3.api import numpy_int as h3
+from pyproj import Transformer
+from shapely.geometry import Polygon
+from shapely.geometry import MultiPolygon
+
+from KDE.kde_contours import contour_levels
+from KDE.kde_country_organizer import lonlat_transformer
+
+# The engines of the KDE, the mesh grid of the KdeEngine or the H3 cells of the HexagonalKde.
+kde_engines = ['mesh', 'hexagonal']
+
+# The kernels of the hexagonal KDE, with how many bandwidths from a cell the kernel reaches. The gaussian kernel is cut where its
+# density has fallen under the contour floor, the epanechnikov kernel is zero beyond one bandwidth.
+kernel_reach = {'gaussian': 4, 'epanechnikov': 1}
+
+# The automatic H3 resolution has at least this many cells per bandwidth between the centers of neighbouring cells.
+cells_per_bandwidth = 3
+
+# The largest k-ring of an occupied cell, 3k(k+1)+1 cells for a reach of k. Finer resolutions spread every occupied cell
+# to so many cells that the density takes too much time and memory.
+max_ring_cells = 10000
+
+# The mean radius of the Earth in meters, for the great-circle distances between the cell centers.
+earth_radius = 6371008.8
+
+
+def auto_resolution(analysis_bandwidth, finest_resolution = 10):
+
+    """
+    Returns the coarsest H3 resolution whose neighbouring cells are at most a third of the bandwidth apart.
+
+    Args:
+        analysis_bandwidth (int): The bandwidth of the KDE in meters.
+        finest_resolution (int): The finest resolution that is returned, the resolution of the cells of the data.
+
+    Returns:
+        int: The H3 resolution.
+    """
+
+    for resolution in range(finest_resolution + 1):
+        if cell_spacing(resolution) <= analysis_bandwidth / cells_per_bandwidth:
+            return resolution
+
+    return finest_resolution
+
+
+def cell_spacing(resolution):
+
+    """
+    Returns the average distance in meters between the centers of neighbouring H3 cells of a resolution.
+
+    Args:
+        resolution (int): The H3 resolution.
+
+    Returns:
+        float: The distance between the centers of neighbouring cells.
+    """
+
+    return math.sqrt(3) * h3.edge_length(resolution, 'm')
+
+
+class HexagonalKde():
+
+    """
+    The KDE of a country on H3 cells instead of a mesh grid, for very large datasets.
+
+    The points of the country are aggregated to the H3 cells of the chosen resolution, straight from the H3 cells of the data
+    (the h3_cell attribute of the points) when they were read in, otherwise from the coordinates. Every occupied cell spreads its
+    points to the cells of its k-ring with the kernel of the great-circle distance between the cell centers, so the density is
+    computed only on the sparse set of cells within the kernel's reach of the points, not on a dense grid around the whole country.
+    Like the density grids of the KdeEngine the densities are log-densities per square meter of the points moved to the centers of
+    their cells, so they are contoured with the same contour levels. The polygon of a contour level is the union of the cells whose
+    log-density is within the level, and it is clipped with the country's border like the contours of the mesh grid.
+
+    The distances are great-circle distances for both the euclidean and the haversine metric, because the cells are on the sphere.
+
+    Attributes:
+        engine (KdeEngine): The KDE engine whose bandwidth, kernel, polygons and borders are used.
+        resolution (int): The H3 resolution of the cells, the cells of the data are used as they are if it is finer than them.
+        to_lonlat (Transformer): Transforms the coordinates of the program's EPSG to longitudes and latitudes.
+
+    Methods:
+        cell_counts(self, country_coordinates): Aggregates the points of a country to H3 cells.
+        density(self, cells, counts): Smooths the counts of the cells with the kernel over the k-rings of the cells.
+        contour_to_polygons(self, cells, log_density): Creates the polygons of the contour levels from the unions of the cells.
+        country_kde(self, country_coordinates): Creates the KDE polygons of a country.
+        pair_kde(self, country_1_coordinates, country_2_coordinates): Creates the KDE polygons of a country pair.
+        __reach(self, resolution): Returns how many cells from an occupied cell its kernel reaches.
+        __kernel(self, distances): Returns the kernel density at the distances.
+    """
+
+
+    def __init__(self, engine, resolution = 'auto'):
+
+        """
+        Initialize the HexagonalKde class.
+
+        Args:
+            engine (KdeEngine): The KDE engine whose bandwidth, kernel, polygons and borders are used.
+            resolution (int or str): The H3 resolution of the cells, or auto for the coarsest resolution with at least three cells per bandwidth.
+        """
+
+        if engine.kernel_type not in kernel_reach:
+            raise ValueError(f'The hexagonal KDE supports only the {" and ".join(kernel_reach)} kernels, not {engine.kernel_type}.')
+
+        self.engine = engine
+        self.resolution = auto_resolution(engine.analysis_bandwidth) if str(resolution) == 'auto' else int(resolution)
+        if not 0 <= self.resolution <= 15:
+            raise ValueError(f'Invalid H3 resolution {resolution}, the options are 0 to 15 or auto.')
+
+        self.to_lonlat = Transformer.from_crs(engine.program_epsg, 4326, always_xy = True)
+
+
+    def cell_counts(self, country_coordinates):
+
+        """
+        Aggregates the points of a country to the H3 cells of the resolution.
+
+        With the H3 cells of the data the parents of the different cells are looked up once, without the coordinates.
+        Otherwise the cells of the different coordinates are looked up, which are few when the points are the centers of H3 cells.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country.
+
+        Returns:
+            tuple: The occupied H3 cells (np.ndarray of integers) and the amount of points in each.
+        """
+
+        if len(country_coordinates) == 0:
+            raise ValueError('The country has no points for the KDE.')
+
+        if 'h3_cell' in country_coordinates.attributes:
+            codes, data_cells = pd.factorize(country_coordinates.attributes['h3_cell'], sort = False)
+            data_cells = [h3.string_to_h3(cell) for cell in data_cells]
+            resolution = min(self.resolution, h3.h3_get_resolution(data_cells[0]))
+            cells = np.array([h3.h3_to_parent(cell, resolution) for cell in data_cells], dtype = np.uint64)
+
+        else:
+            xy, codes = np.unique(country_coordinates.xy, axis = 0, return_inverse = True)
+            lon, lat = self.to_lonlat.transform(xy[:, 0], xy[:, 1])
+            cells = np.array([h3.geo_to_h3(y, x, self.resolution) for x, y in zip(lon, lat)], dtype = np.uint64)
+
+        cells, cell_codes = np.unique(cells, return_inverse = True)
+        counts = np.bincount(cell_codes[codes.ravel()], minlength = len(cells))
+
+        return cells, counts
+
+
+    def density(self, cells, counts):
+
+        """
+        Smooths the counts of the occupied cells with the kernel over the k-rings of the cells.
+
+        The k-rings of the occupied cells are the sparse adjacency of the cells: every occupied cell adds the kernel of the distance
+        to every cell of its k-ring, weighted by its amount of points. The reach of the k-rings is worked out from the resolution
+        of the occupied cells, which is coarser than the chosen resolution when the cells of the data are coarser.
+
+        Args:
+            cells (np.ndarray): The occupied H3 cells.
+            counts (np.ndarray): The amount of points in each occupied cell.
+
+        Returns:
+            tuple: The H3 cells within the kernel's reach of the occupied cells and their log-densities per square meter.
+        """
+
+        reach = self.__reach(h3.h3_get_resolution(int(cells[0])))
+        rings = [h3.k_ring(int(cell), reach) for cell in cells]
+        sizes = np.array([len(ring) for ring in rings])
+        targets = np.concatenate(rings)
+        sources = np.repeat(np.arange(len(cells)), sizes)
+
+        target_codes, target_cells = pd.factorize(targets, sort = True)
+        target_cells = np.asarray(target_cells, dtype = np.uint64)
+
+        # The great-circle distances between the centers of the occupied cells and the cells of their k-rings.
+        lat, lon = np.radians(np.array([h3.h3_to_geo(int(cell)) for cell in target_cells])).T
+        source_codes = np.searchsorted(target_cells, cells)
+        lat_1, lon_1 = lat[source_codes][sources], lon[source_codes][sources]
+        lat_2, lon_2 = lat[target_codes], lon[target_codes]
+        haversine = np.sin((lat_2 - lat_1) / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+        distances = 2 * earth_radius * np.arcsin(np.sqrt(haversine))
+
+        density = np.bincount(target_codes, weights = self.__kernel(distances) * counts[sources], minlength = len(target_cells)) / counts.sum()
+        inside = density > 0
+
+        return target_cells[inside], np.log(density[inside])
+
+
+    def contour_to_polygons(self, cells, log_density):
+
+        """
+        Creates the polygons of the contour levels from the unions of the cells whose log-density is within each level.
+
+        The levels are those of the contours of the mesh grid, spread from the contour floor to the highest log-density,
+        and the polygons are projected to the program's EPSG, snapped and validated like the contours of the mesh grid.
+
+        Args:
+            cells (np.ndarray): The H3 cells.
+            log_density (np.ndarray): The log-density of every cell.
+
+        Returns:
+            gpd.GeoDataFrame: The KDE polygons with their levels and areas.
+        """
+
+        levels, labels = contour_levels(log_density.max())
+        # The band of a cell is the level under its log-density, the highest log-density belongs to the highest band like in contourf.
+        bands = np.minimum(np.searchsorted(levels, log_density, side = 'right') - 1, len(levels) - 2)
+        to_program_epsg = lonlat_transformer(self.engine.program_epsg)
+
+        level_polygons = []
+        for band in np.unique(bands[bands >= 0]):
+            outlines = h3.h3_set_to_multi_polygon(cells[bands == band], geo_json = True)
+            multi = MultiPolygon([Polygon(rings[0], rings[1:]) for rings in outlines])
+            multi = shapely.transform(multi, lambda lonlat: np.column_stack(to_program_epsg.transform(lonlat[:, 0], lonlat[:, 1])))
+            level_polygons.append((labels[band], multi))
+
+        df_of_polygons = pd.DataFrame(level_polygons, columns = ['level', 'geometry'])
+        gdf_of_polygons = gpd.GeoDataFrame(df_of_polygons, geometry = 'geometry', crs = self.engine.program_epsg)
+        gdf_of_polygons['area'] = gdf_of_polygons['geometry'].area
+
+        return self.engine.geometry_output.full_detail(gdf_of_polygons)
+
+
+    def country_kde(self, country_coordinates):
+
+        """
+        Creates the KDE polygons of a country on the H3 cells and clips them with the country's border.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country.
+
+        Returns:
+            tuple: The KDE polygons and the clipped KDE polygons of the country.
+        """
+
+        cells, counts = self.cell_counts(country_coordinates)
+        kde_polygons = self.contour_to_polygons(*self.density(cells, counts))
+
+        region = self.engine.border_service.country(country_coordinates.country_id)
+
+        return kde_polygons, self.engine.clip_to_region(kde_polygons, region)
+
+
+    def pair_kde(self, country_1_coordinates, country_2_coordinates):
+
+        """
+        Creates the KDE polygons of both countries of a country pair on the H3 cells and merges their clipped polygons.
+
+        Args:
+            country_1_coordinates (CountryPoints): The points of the first country.
+            country_2_coordinates (CountryPoints): The points of the second country.
+
+        Returns:
+            tuple: The KDE polygons of the first and second country and the merged clipped KDE polygons.
+        """
+
+        country_1_polygons, country_1_clipped = self.country_kde(country_1_coordinates)
+        country_2_polygons, country_2_clipped = self.country_kde(country_2_coordinates)
+
+        merged_layers = pd.concat([country_1_clipped, country_2_clipped], ignore_index = True)
+
+        return country_1_polygons, country_2_polygons, merged_layers
+
+
+    def __reach(self, resolution):
+
+        """
+        Returns the k of the k-rings, how many cells of a resolution from an occupied cell its kernel reaches.
+
+        Args:
+            resolution (int): The H3 resolution of the occupied cells.
+
+        Returns:
+            int: The reach of the kernel in cells.
+
+        Raises:
+            ValueError: If the k-rings of the resolution are larger than max_ring_cells.
+        """
+
+        bandwidth = self.engine.analysis_bandwidth
+        reach = math.ceil(kernel_reach[self.engine.kernel_type] * bandwidth / cell_spacing(resolution))
+        ring_cells = 3 * reach * (reach + 1) + 1
+
+        if ring_cells > max_ring_cells:
+            raise ValueError(f'The H3 resolution {resolution} is too fine for the bandwidth of {bandwidth} m: the kernel of every occupied cell '
+                             f'reaches {ring_cells} cells, more than the limit of {max_ring_cells}. Use a coarser resolution or auto '
+                             f'(resolution {auto_resolution(bandwidth)}).')
+
+        return reach
+
+
+    def __kernel(self, distances):
+
+        """Returns the density of the kernel at the distances in meters, per square meter, normalized like the kernels of KernelDensity."""
+
+        bandwidth = self.engine.analysis_bandwidth
+
+        if self.engine.kernel_type == 'gaussian':
+            return np.exp(-0.5 * (distances / bandwidth) ** 2) / (2 * np.pi * bandwidth ** 2)
+
+        return np.clip(1 - (distances / bandwidth) ** 2, 0, None) * 2 / (np.pi * bandwidth ** 2)
@@ -0,0 +1,249 @@
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timedelta
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows, where the memory use is not measured.
+    resource = None
+
+from get_dotenv import output_folder_path
+from get_dotenv import output_all_path
+
+class KdeInstrumentation():
+
+    """
+    Records the wall time, CPU time, peak memory use and counts of every stage of a KDE run.
+
+    The memory is measured with the peak resident memory of the process, which only grows. A stage or country pair is
+    recorded with the process peak at its end (process_peak_rss_mb) and with how much it raised the process peak
+    (peak_rss_increase_mb), which is 0 for a stage or pair that used less memory than an earlier one.
+
+    The stages are measured with the stage context manager, and the stages of a country pair are grouped between start_pair and
+    end_pair. After every country pair the progress of the run is printed with an estimate of the remaining time. At the end of the
+    run the measurements are written to a JSON and a CSV run report. Optionally every country pair is profiled with cProfile, and
+    the profiles are saved as .prof files which can be opened e.g. with pstats or snakeviz.
+
+    Attributes:
+        total_pairs (int): The amount of country pairs in the run, used for the estimate of the remaining time.
+        pair_costs (dict): The estimated cost of every country pair of the run, for the estimate of the remaining time, or None.
+        profile (bool): Whether every country pair is profiled with cProfile.
+        report_path (str): The folder of the run reports and profiles.
+        run_id (str): The identifier of the run, the time when it was started.
+        stages (list): The measurements of the stages.
+        pairs (list): The measurements of the country pairs.
+        writes (list): The wait and write time and the error of every background write.
+
+    Methods:
+        start_pair(self, cntr_od): Starts measuring a country pair.
+        end_pair(self, status='done'): Stops measuring the country pair, prints the progress and returns the measurements of the pair.
+        stage(self, name, **counts): Context manager which measures a stage.
+        write_report(self): Writes the measurements to the JSON and CSV run reports.
+    """
+
+
+    def __init__(self, total_pairs = 1, profile = False, report_path = None):
+
+        """
+        Initialize the KdeInstrumentation class.
+
+        Args:
+            total_pairs (int): The amount of country pairs in the run.
+            profile (bool): Whether every country pair is profiled with cProfile.
+            report_path (str, optional): The folder of the run reports, defaults to run_reports/ in the output folder.
+        """
+
+        self.total_pairs = total_pairs
+        self.pair_costs = None
+        self.profile = profile
+        self.report_path = f'{output_folder_path}{output_all_path}run_reports/' if report_path is None else report_path
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+
+        self.stages = []
+        self.pairs = []
+        self.writes = []
+        self.__pair = None
+        self.__run_start = time.perf_counter()
+
+
+    def start_pair(self, cntr_od):
+
+        """
+        Starts measuring a country pair, and profiling it if profiling is on.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+        """
+
+        self.__pair = {'pair': cntr_od, 'wall_start': time.perf_counter(), 'cpu_start': time.process_time(), 'peak_rss_start': self.__peak_rss_mb(), 'profiler': None}
+
+        if self.profile:
+            self.__pair['profiler'] = cProfile.Profile()
+            self.__pair['profiler'].enable()
+
+
+    def end_pair(self, status = 'done'):
+
+        """
+        Stops measuring the country pair and prints the progress of the run with the estimated remaining time.
+
+        With the estimated costs of the country pairs the remaining time is the time per cost of the finished pairs times the cost
+        of the remaining pairs, because the pairs run from the most expensive to the cheapest take less and less time.
+
+        Args:
+            status (str): The status of the country pair, done or failed.
+
+        Returns:
+            dict: The measurements of the country pair, None if no country pair was started.
+        """
+
+        if self.__pair is None:
+            return None
+
+        profile_path = None
+        if self.__pair['profiler'] is not None:
+            self.__pair['profiler'].disable()
+            os.makedirs(f'{self.report_path}profiles/', exist_ok = True)
+            profile_path = f"{self.report_path}profiles/{self.run_id}_{self.__pair['pair']}.prof"
+            self.__pair['profiler'].dump_stats(profile_path)
+
+        wall_seconds = time.perf_counter() - self.__pair['wall_start']
+        self.pairs.append({
+            'pair': self.__pair['pair'],
+            'status': status,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': time.process_time() - self.__pair['cpu_start'],
+            **self.__peak_rss_since(self.__pair['peak_rss_start']),
+            'profile_path': profile_path,
+        })
+        self.__pair = None
+
+        done = len(self.pairs)
+        total_seconds = sum(pair['wall_seconds'] for pair in self.pairs)
+        remaining_seconds = total_seconds / done * max(self.total_pairs - done, 0)
+
+        if self.pair_costs:
+            finished = {pair['pair'] for pair in self.pairs}
+            done_cost = sum(self.pair_costs.get(cntr_od, 0) for cntr_od in finished)
+            if done_cost > 0:
+                remaining_seconds = total_seconds / done_cost * sum(cost for cntr_od, cost in self.pair_costs.items() if cntr_od not in finished)
+
+        eta = timedelta(seconds = round(remaining_seconds))
+        print(f"[{done}/{self.total_pairs}] {self.pairs[-1]['pair']} {status} in {wall_seconds:.1f} s, estimated time remaining {eta}")
+
+        return self.pairs[-1]
+
+
+    @contextmanager
+    def stage(self, name, **counts):
+
+        """
+        Measures the wall time, CPU time and peak memory use of a stage.
+
+        The counts of the stage, e.g. the amount of points or mesh cells, can be given as keyword arguments
+        or added to the yielded dictionary inside the with block.
+
+        Args:
+            name (str): The name of the stage.
+            **counts: The counts of the stage.
+
+        Yields:
+            dict: The counts of the stage.
+        """
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        peak_rss_start = self.__peak_rss_mb()
+
+        try:
+            yield counts
+
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            self.stages.append({
+                'pair': None if self.__pair is None else self.__pair['pair'],
+                'stage': name,
+                'wall_seconds': wall_seconds,
+                'cpu_seconds': time.process_time() - cpu_start,
+                **self.__peak_rss_since(peak_rss_start),
+                **counts,
+            })
+
+            described_counts = ''.join(f', {value} {key}' for key, value in counts.items() if key != 'country')
+            country = f" {counts['country']}" if 'country' in counts else ''
+            print(f'    {name}{country}: {wall_seconds:.2f} s{described_counts}')
+
+
+    def write_report(self):
+
+        """
+        Writes the measurements of the stages and country pairs to the JSON and CSV run reports.
+
+        The background writes, with the errors of the failed writes, are only in the JSON run report.
+
+        Returns:
+            tuple: The paths of the JSON and CSV run reports.
+        """
+
+        os.makedirs(self.report_path, exist_ok = True)
+        json_path = f'{self.report_path}run_{self.run_id}.json'
+        csv_path = f'{self.report_path}run_{self.run_id}.csv'
+
+        report = {
+            'run_id': self.run_id,
+            'total_pairs': self.total_pairs,
+            'wall_seconds': time.perf_counter() - self.__run_start,
+            'process_peak_rss_mb': self.__peak_rss_mb(),
+            'pairs': self.pairs,
+            'stages': self.stages,
+            'writes': self.writes,
+        }
+
+        with open(json_path, 'w') as file:
+            json.dump(report, file, indent = 2)
+
+        columns = list(dict.fromkeys(key for stage in self.stages for key in stage))
+        with open(csv_path, 'w', newline = '') as file:
+            writer = csv.DictWriter(file, fieldnames = columns)
+            writer.writeheader()
+            writer.writerows(self.stages)
+
+        return json_path, csv_path
+
+
+    def __peak_rss_since(self, peak_rss_start):
+
+        """
+        Returns the peak resident memory of the process and how much it grew since the start of a stage or country pair.
+
+        Args:
+            peak_rss_start (float): The peak resident memory of the process at the start in megabytes, or None.
+
+        Returns:
+            dict: The process_peak_rss_mb and peak_rss_increase_mb in megabytes, None if the memory cannot be measured.
+        """
+
+        peak_rss = self.__peak_rss_mb()
+        peak_rss_increase = None if peak_rss is None else peak_rss - peak_rss_start
+
+        return {'process_peak_rss_mb': peak_rss, 'peak_rss_increase_mb': peak_rss_increase}
+
+
+    def __peak_rss_mb(self):
+
+        """Returns the peak resident memory of the process so far in megabytes, or None if it cannot be measured."""
+
+        if resource is None:
+            return None
+
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # The peak memory is in bytes on macOS and in kilobytes elsewhere.
+        return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
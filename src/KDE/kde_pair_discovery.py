@@ -0,0 +1,170 @@
+"""
+Discovery of the country pairs of a run from the mobility data or the border adjacency, and their scheduling by estimated cost.
+
+The country pairs of a run of all pairs come from the hand-maintained lst_of_cntr_od, from every pair in the data, or from the pairs
+of neighbouring countries in the border GeoPackage which have points in the data. The cost of a pair is estimated from the amount of
+its points, or from the wall time of the pair in an earlier run with the same KDE parameters, and the pairs are run from the most
+expensive to the cheapest, so that a giant pair is not left running alone at the end. For runs split over several machines, the
+pairs are split into shards of about the same total cost.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Where the country pairs of a run of all pairs come from: the lst_of_cntr_od list, every pair in the data or the neighbouring countries.
+pair_sources = ['list', 'data', 'borders']
+
+# The order in which the country pairs are run: from the most expensive to the cheapest, or in the order of the list.
+pair_orders = ['cost', 'list']
+
+
+def pair_point_counts(df, movement_limit = None):
+
+    """
+    Returns the amount of points of both countries of every cross-border country pair in the mobility data.
+
+    The points of a country are the starting points of the pair's movements which start in it and the ending points of those which
+    end in it, like in the CountryOrganizer. The rows are only counted, so the data is not copied or projected.
+
+    Args:
+        df (pd.DataFrame): The mobility data with the CNTR_ID_start, CNTR_ID_end and CNTR_OD columns.
+        movement_limit (int or str, optional): Only the movements of at most this many kilometers are counted.
+
+    Returns:
+        pd.DataFrame: The country_1_points and country_2_points of every country pair, indexed by the canonical pair identifier.
+    """
+
+    columns = df[['CNTR_OD', 'CNTR_ID_start', 'CNTR_ID_end']]
+    if movement_limit is not None:
+        columns = columns.loc[df['distance_km'] <= int(movement_limit)]
+
+    starts = columns.groupby(['CNTR_OD', 'CNTR_ID_start'], observed = True).size().rename_axis(['pair', 'country'])
+    ends = columns.groupby(['CNTR_OD', 'CNTR_ID_end'], observed = True).size().rename_axis(['pair', 'country'])
+    counts = pd.concat([starts, ends]).groupby(level = ['pair', 'country']).sum()
+    counts.index = counts.index.map(lambda key: (str(key[0]), str(key[1])))
+
+    rows = {}
+    for pair in sorted({pair for pair, _ in counts.index}):
+        country1_id, country2_id = pair[:2], pair[3:5]
+        if country1_id == country2_id:
+            continue
+        rows[pair] = (counts.get((pair, country1_id), 0), counts.get((pair, country2_id), 0))
+
+    return pd.DataFrame.from_dict(rows, orient = 'index', columns = ['country_1_points', 'country_2_points'], dtype = np.int64)
+
+
+def data_pairs(point_counts, min_points = 1):
+
+    """
+    Returns the country pairs of the data whose both countries have at least the minimum amount of points.
+
+    Args:
+        point_counts (pd.DataFrame): The amount of points of both countries of every country pair.
+        min_points (int): The minimum amount of points of each country of a pair.
+
+    Returns:
+        list: The canonical country pair identifiers in alphabetical order.
+    """
+
+    enough = (point_counts[['country_1_points', 'country_2_points']] >= int(min_points)).all(axis = 1)
+
+    return sorted(point_counts.index[enough])
+
+
+def adjacent_pairs(border_service, tolerance = 1000):
+
+    """
+    Returns the pairs of countries whose borders are at most the tolerance apart in the border data.
+
+    The tolerance bridges the small gaps between the borders of neighbouring countries in generalized border data.
+
+    Args:
+        border_service (BorderService): The indexed country border data.
+        tolerance (float): The largest distance in meters between the borders of neighbouring countries.
+
+    Returns:
+        list: The canonical country pair identifiers in alphabetical order.
+    """
+
+    country_ids = list(border_service.country_ids())
+    geometries = np.array([border_service.country_geometry(country_id) for country_id in country_ids])
+
+    first, second = shapely.STRtree(geometries).query(geometries, predicate = 'dwithin', distance = tolerance)
+
+    return sorted({'_'.join(sorted([country_ids[i], country_ids[j]])) for i, j in zip(first, second) if i != j})
+
+
+def pair_costs(point_counts, pair_seconds = None):
+
+    """
+    Estimates the cost of every country pair.
+
+    Without earlier timings the cost is the amount of points of the pair. With the wall times of pairs in an earlier run the cost
+    is in seconds: the earlier time of the pairs that have one, and for the others their points times the median seconds per point
+    of the timed pairs.
+
+    Args:
+        point_counts (pd.DataFrame): The amount of points of both countries of every country pair.
+        pair_seconds (dict, optional): The wall time in seconds of country pairs in an earlier run.
+
+    Returns:
+        pd.Series: The estimated cost of every country pair.
+    """
+
+    points = point_counts[['country_1_points', 'country_2_points']].sum(axis = 1).astype(np.float64)
+    timed = pd.Series({pair: seconds for pair, seconds in (pair_seconds or {}).items() if pair in points.index and points[pair] > 0}, dtype = np.float64)
+
+    if timed.empty:
+        return points
+
+    costs = points * (timed / points[timed.index]).median()
+    costs[timed.index] = timed
+
+    return costs
+
+
+def schedule_pairs(country_list, costs):
+
+    """
+    Orders the country pairs from the most expensive to the cheapest.
+
+    The pairs without a cost, e.g. without points in the data, are run last, and pairs of the same cost in alphabetical order.
+
+    Args:
+        country_list (list): The canonical country pair identifiers.
+        costs (pd.Series): The estimated cost of the country pairs.
+
+    Returns:
+        list: The country pairs from the most expensive to the cheapest.
+    """
+
+    return sorted(country_list, key = lambda pair: (-costs.get(pair, 0), pair))
+
+
+def shard_pairs(country_list, costs, shards):
+
+    """
+    Splits the country pairs into shards of about the same total cost, so that runs of the shards on several machines end together.
+
+    The pairs are given from the most expensive to the cheapest to the shard with the lowest total cost so far, and every shard
+    keeps the pairs from the most expensive to the cheapest.
+
+    Args:
+        country_list (list): The canonical country pair identifiers.
+        costs (pd.Series): The estimated cost of the country pairs.
+        shards (int): The amount of shards.
+
+    Returns:
+        list: The country pairs of every shard.
+    """
+
+    shard_lists = [[] for _ in range(int(shards))]
+    shard_costs = np.zeros(int(shards))
+
+    for pair in schedule_pairs(country_list, costs):
+        shard = int(np.argmin(shard_costs))
+        shard_lists[shard].append(pair)
+        shard_costs[shard] += costs.get(pair, 0)
+
+    return shard_lists
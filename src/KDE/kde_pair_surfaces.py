@@ -0,0 +1,62 @@
+"""Surfaces derived from the density grids of both countries of a pair, which are evaluated on the same mesh grid."""
+
+import numpy as np
+
+from KDE.kde_contours import contour_floor
+
+# The derived surfaces of a country pair, in the order they are drawn.
+surface_names = ['combined', 'log_ratio', 'difference']
+
+
+def pair_bounds(country_1_coordinates, country_2_coordinates):
+
+    """
+    Returns the bounds of the mesh grids of both countries, which the shared mesh grid of the pair covers.
+
+    Args:
+        country_1_coordinates (CountryPoints): The points of the first country.
+        country_2_coordinates (CountryPoints): The points of the second country.
+
+    Returns:
+        np.ndarray: The bounds (minx, miny, maxx, maxy) of the mesh grids of both countries.
+    """
+
+    bounds_1 = country_1_coordinates.grid_bounds
+    bounds_2 = country_2_coordinates.grid_bounds
+
+    return np.concatenate([np.minimum(bounds_1[:2], bounds_2[:2]), np.maximum(bounds_1[2:], bounds_2[2:])])
+
+
+def pair_surfaces(pred_grid_1, pred_grid_2, points_1, points_2):
+
+    """
+    Derives the combined density, the log-ratio and the difference of the densities of the two countries of a pair.
+
+    The combined surface is the log-density of the points of both countries together, the mixture of the two densities weighted by
+    the amounts of points. The log-ratio is the log-density of the first country minus that of the second, positive where the first
+    country's mobility is relatively denser, and it is left empty (NaN) where both log-densities are under the contour floor, because
+    the ratio of two densities which are practically zero is only noise. The difference is the density of the first country minus
+    that of the second per square kilometer, which shows the asymmetry in absolute terms.
+
+    Args:
+        pred_grid_1 (np.ndarray): The log-density grid of the first country.
+        pred_grid_2 (np.ndarray): The log-density grid of the second country, on the same mesh grid.
+        points_1 (int): The amount of points of the first country.
+        points_2 (int): The amount of points of the second country.
+
+    Returns:
+        dict: The combined, log_ratio and difference grids (np.ndarray).
+    """
+
+    if pred_grid_1.shape != pred_grid_2.shape:
+        raise ValueError(f'The density grids of the pair have different shapes {pred_grid_1.shape} and {pred_grid_2.shape}, they have to be on the same mesh grid.')
+
+    pred_grid_1 = np.asarray(pred_grid_1, dtype = np.float64)
+    pred_grid_2 = np.asarray(pred_grid_2, dtype = np.float64)
+    share_1 = points_1 / (points_1 + points_2)
+
+    combined = np.logaddexp(pred_grid_1 + np.log(share_1), pred_grid_2 + np.log1p(-share_1))
+    log_ratio = np.where(np.maximum(pred_grid_1, pred_grid_2) > contour_floor, pred_grid_1 - pred_grid_2, np.nan)
+    difference = (np.exp(pred_grid_1) - np.exp(pred_grid_2)) * 1000 ** 2
+
+    return {'combined': combined.astype(np.float32), 'log_ratio': log_ratio.astype(np.float32), 'difference': difference.astype(np.float32)}
@@ -0,0 +1,73 @@
+from CountryCodes.country_abbreviations import iso_country_codes
+
+class KdeParameters():
+
+    """
+    The parameters of a KDE visualization given without the input questions, e.g. from a batch job file.
+
+    The class has the same attributes as KdeQuestions, so that it can be given to the KdeHandler instead of the input questions.
+    The parameters are validated with the same rules as the input questions, but an invalid parameter raises a ValueError
+    instead of asking again.
+
+    Attributes:
+        type_of_kde_analysis (str): The type of KDE visualization (pair, all or batch).
+        analysis_bandwidth (str): The bandwidth (search radius) in meters.
+        kernel_type (str): The kernel type (gaussian or epanechnikov).
+        metric_type (str): The metric type (euclidean, haversine or none).
+        extent_of_kde_analysis (str): Whether to limit movement distances (yes or no).
+        movement_limit (str): The movement limit in kilometers, or 'no'.
+        country_pair (list): The country abbreviations of a pair visualization, or None.
+
+    Methods:
+        __init__(self, ...): Initializes and validates the parameters.
+        __validate(self): Raises a ValueError for invalid parameters.
+    """
+
+
+    def __init__(self, analysis_bandwidth, kernel_type, metric_type, movement_limit = 'no', type_of_kde_analysis = 'batch', country_pair = None):
+
+        """
+        Initialize and validate the KDE parameters.
+
+        Args:
+            analysis_bandwidth (int or str): The bandwidth (search radius) in meters.
+            kernel_type (str): The kernel type (gaussian or epanechnikov).
+            metric_type (str): The metric type (euclidean, haversine or none).
+            movement_limit (int or str): The movement limit in kilometers, 'no' for no limit.
+            type_of_kde_analysis (str): The type of KDE visualization (pair, all or batch).
+            country_pair (list, optional): The two country abbreviations of a pair visualization.
+        """
+
+        self.type_of_kde_analysis = type_of_kde_analysis
+        self.analysis_bandwidth = str(analysis_bandwidth)
+        self.kernel_type = kernel_type
+        self.metric_type = metric_type
+        self.movement_limit = str(movement_limit)
+        self.extent_of_kde_analysis = 'no' if self.movement_limit == 'no' else 'yes'
+        self.country_pair = country_pair
+
+        self.__validate()
+
+
+    def __validate(self):
+
+        """Raises a ValueError if a parameter is not one of the options of the input questions."""
+
+        if self.type_of_kde_analysis not in ('pair', 'all', 'batch'):
+            raise ValueError(f'Invalid type of KDE analysis {self.type_of_kde_analysis}, the options are pair, all and batch.')
+
+        if not self.analysis_bandwidth.isdigit():
+            raise ValueError(f'Invalid bandwidth {self.analysis_bandwidth}, it has to be given in meters (40km as 40000).')
+
+        if self.kernel_type not in ('gaussian', 'epanechnikov'):
+            raise ValueError(f'Invalid kernel type {self.kernel_type}, the options are gaussian and epanechnikov.')
+
+        if self.metric_type not in ('euclidean', 'haversine', 'none'):
+            raise ValueError(f'Invalid metric type {self.metric_type}, the options are euclidean and haversine.')
+
+        if self.extent_of_kde_analysis == 'yes' and not self.movement_limit.isdigit():
+            raise ValueError(f'Invalid movement limit {self.movement_limit}, it has to be given in kilometres (200km as 200) or as no.')
+
+        if self.type_of_kde_analysis == 'pair':
+            if self.country_pair is None or len(self.country_pair) != 2 or any(country not in iso_country_codes for country in self.country_pair):
+                raise ValueError(f'Invalid country pair {self.country_pair}, two country abbreviations are needed.')
@@ -0,0 +1,247 @@
+import math
+import time
+import numpy as np
+
+from KDE.kde_contours import contour_levels
+
+class ProgressiveKde():
+
+    """
+    Progressive refinement of a country's KDE density grid with stratified subsamples.
+
+    The KDE is first computed on a stratified subsample of the points, which is sized so that the relative standard error of the
+    density in the densest bandwidth-sized cell stays under the target error, and the preview is published before the refinement starts.
+    The grid is then refined with subsamples that grow by the growth factor up to all points, and the refinement stops as soon as
+    the contour bands change only in grid cells holding less than the tolerance of the density between two steps.
+
+    The subsample is stratified by bandwidth-sized cells, so that every part of the country keeps its share of the points. Every
+    point has the same chance to be in the subsample, so the density of the subsample is an unbiased estimate of the density of all
+    points without weighting the points, which would make the KDE of scikit-learn many times slower.
+
+    Attributes:
+        engine (KdeEngine): The KDE engine which computes the density grids.
+        target_error (float): The relative standard error of the density in the densest cell of the preview.
+        tolerance (float): The share of the density in grid cells whose contour band may change between two steps when the refinement stops.
+        growth (int): How many times bigger each refinement step's subsample is.
+        min_points (int): The smallest subsample.
+        seed (int): The seed of the random subsamples.
+        steps (list): The amount of points, seconds and share of the density in changed cells of every step of the latest density grid.
+
+    Methods:
+        sample_size(self, country_coordinates): Returns the size of the preview's subsample.
+        stratified_sample(self, country_coordinates, size): Returns a stratified subsample of the points.
+        density_grid(self, country_coordinates, publish=None, bounds=None): Computes the density grid progressively.
+        changed_share(self, pred_grid, previous_grid): Returns the share of the density in grid cells whose contour band changed.
+        __refine(self, country_coordinates, sizes, bounds, preview): Refines the density grid until it stops changing.
+        __step(self, country_coordinates, size, bounds): Computes the density grid of one subsample.
+        __cell_counts(self, coordinates): Returns the bandwidth-sized cell of every point and the amount of points in every cell.
+    """
+
+
+    def __init__(self, engine, target_error = 0.1, tolerance = 0.05, growth = 4, min_points = 1000, seed = 0):
+
+        """
+        Initialize the ProgressiveKde class.
+
+        Args:
+            engine (KdeEngine): The KDE engine which computes the density grids.
+            target_error (float): The relative standard error of the density in the densest cell of the preview.
+            tolerance (float): The share of the density in grid cells whose contour band may change between two steps when the refinement stops.
+            growth (int): How many times bigger each refinement step's subsample is.
+            min_points (int): The smallest subsample.
+            seed (int): The seed of the random subsamples.
+        """
+
+        self.engine = engine
+        self.target_error = target_error
+        self.tolerance = tolerance
+        self.growth = growth
+        self.min_points = min_points
+        self.seed = seed
+        self.steps = []
+
+
+    def sample_size(self, country_coordinates):
+
+        """
+        Returns the size of the preview's subsample.
+
+        The density of a cell is estimated from the points of the subsample near it, and its relative standard error is about
+        1 / sqrt(k) for k points. The subsample keeps 1 / target_error² points in the densest bandwidth-sized cell, where the
+        highest contour levels are, and the same share of the points everywhere else.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+
+        Returns:
+            int: The amount of points of the preview's subsample.
+        """
+
+        counts = self.__cell_counts(country_coordinates.xy)[1]
+        share = min(1, 1 / (self.target_error ** 2 * counts.max()))
+
+        return min(len(country_coordinates), max(self.min_points, math.ceil(share * len(country_coordinates))))
+
+
+    def stratified_sample(self, country_coordinates, size):
+
+        """
+        Returns a stratified subsample of the points.
+
+        The same share of the points is drawn at random from every bandwidth-sized cell. The fractions of the cells' quotas are
+        rounded at random, so that every point has the same chance to be in the subsample also in the cells with few points.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+            size (int): The amount of points of the subsample.
+
+        Returns:
+            CountryPoints: The subsample.
+        """
+
+        if size >= len(country_coordinates):
+            return country_coordinates
+
+        rng = np.random.default_rng(self.seed)
+        cell_ids, counts = self.__cell_counts(country_coordinates.xy)
+        quota = np.floor(counts * size / len(country_coordinates) + rng.random(len(counts))).astype(np.int64)
+
+        # The points of every cell in a random order, and each point's rank in its cell.
+        order = rng.permutation(len(cell_ids))
+        order = order[np.argsort(cell_ids[order], kind = 'stable')]
+        ordered_cells = cell_ids[order]
+        rank = np.arange(len(order)) - np.searchsorted(ordered_cells, ordered_cells)
+
+        selected = np.sort(order[rank < quota[ordered_cells]])
+
+        return country_coordinates.take(selected)
+
+
+    def density_grid(self, country_coordinates, publish = None, bounds = None):
+
+        """
+        Computes the density grid of a country progressively.
+
+        The preview is computed first and given to the publish function, e.g. for a preview plot, before the refinement starts.
+        The refinement is not run in a thread next to the publishing, because the KDE of scikit-learn holds the GIL and the preview
+        would only be published once the refinement is done. The mesh grid always covers the extent of all points, so the grids of
+        the steps can be compared.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+            publish (callable, optional): Called with the preview's log-density grid, x and y mesh grids and amount of points.
+            bounds (np.ndarray, optional): The bounds the mesh grid covers, defaults to the grid bounds of all points of the country.
+
+        Returns:
+            tuple: The refined log-density grid, the x and y mesh grids and the KDE model of the last step.
+        """
+
+        if len(country_coordinates) == 0:
+            raise ValueError('The country has no points for the KDE.')
+
+        bounds = country_coordinates.grid_bounds if bounds is None else bounds
+        size = self.sample_size(country_coordinates)
+        sizes = []
+        while size < len(country_coordinates):
+            sizes.append(size)
+            size *= self.growth
+        sizes.append(len(country_coordinates))
+
+        self.steps = []
+        preview = self.__step(country_coordinates, sizes[0], bounds)
+
+        if len(sizes) == 1:
+            return preview
+
+        if publish is not None:
+            publish(preview[0], preview[1], preview[2], self.steps[0]['points'])
+
+        return self.__refine(country_coordinates, sizes[1:], bounds, preview)
+
+
+    def changed_share(self, pred_grid, previous_grid):
+
+        """
+        Returns the share of the density in the grid cells whose contour band changed between two log-density grids.
+
+        The contour bands are the bands of the filled contours of each grid, so the share tells how much the contour polygons changed.
+        The cells are weighted by their density, because the contour bands of the many cells far from the points keep changing
+        with every subsample although there is hardly any mobility in them.
+
+        Args:
+            pred_grid (np.ndarray): The log-density grid.
+            previous_grid (np.ndarray): The log-density grid of the previous step.
+
+        Returns:
+            float: The share of the density in the changed grid cells.
+        """
+
+        bands = np.digitize(pred_grid, contour_levels(pred_grid.max())[0])
+        previous_bands = np.digitize(previous_grid, contour_levels(previous_grid.max())[0])
+
+        # The density relative to the highest density, so that the exponent of the log-density does not underflow.
+        density = np.exp(pred_grid - pred_grid.max())
+
+        return float(density[bands != previous_bands].sum() / density.sum())
+
+
+    def __refine(self, country_coordinates, sizes, bounds, preview):
+
+        """
+        Refines the density grid with the growing subsamples until the contour bands change less than the tolerance.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+            sizes (list): The amounts of points of the refinement steps.
+            bounds (np.ndarray): The bounds of all points, which the mesh grid covers.
+            preview (tuple): The density grid of the preview.
+
+        Returns:
+            tuple: The log-density grid, the x and y mesh grids and the KDE model of the last step.
+        """
+
+        result = preview
+        for size in sizes:
+            previous_grid = result[0]
+            result = self.__step(country_coordinates, size, bounds)
+            self.steps[-1]['changed_share'] = self.changed_share(result[0], previous_grid)
+            print(f"    The contour bands changed in grid cells with {self.steps[-1]['changed_share']:.1%} of the density")
+
+            if self.steps[-1]['changed_share'] < self.tolerance:
+                break
+
+        return result
+
+
+    def __step(self, country_coordinates, size, bounds):
+
+        """
+        Computes the density grid of one stratified subsample and records the step.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG.
+            size (int): The amount of points of the subsample.
+            bounds (np.ndarray): The bounds of all points, which the mesh grid covers.
+
+        Returns:
+            tuple: The log-density grid, the x and y mesh grids and the KDE model.
+        """
+
+        start = time.perf_counter()
+        sample = self.stratified_sample(country_coordinates, size)
+        result = self.engine.density_grid(sample, bounds = bounds)
+
+        self.steps.append({'points': len(sample), 'seconds': time.perf_counter() - start, 'changed_share': None})
+        print(f"    KDE step with {len(sample)} of {len(country_coordinates)} points took {self.steps[-1]['seconds']:.2f} s")
+
+        return result
+
+
+    def __cell_counts(self, coordinates):
+
+        """Returns the bandwidth-sized cell of every point and the amount of points in every cell."""
+
+        cells = np.floor(coordinates / self.engine.analysis_bandwidth).astype(np.int64)
+        _, cell_ids, counts = np.unique(cells, axis = 0, return_inverse = True, return_counts = True)
+
+        return cell_ids.reshape(-1), counts
@@ -0,0 +1,664 @@
+"""
+Result backends for the KDE polygons of the country pairs.
+
+A backend receives all results of one country pair at once: each country's KDE polygons and the merged clipped polygons.
+The files backend writes them as separate GeoPackages like before, the gpkg backend writes them into one GeoPackage with
+a layer per country pair and the parquet backend appends them into one GeoParquet dataset partitioned by country pair.
+The results in the gpkg and parquet backends have pair, country, kind (country or merged), lod, level and parameter columns,
+so that later stages can load every result of a parameter set in one scan.
+The variant column and the file names hold the settings which change the results, e.g. the confidence bands or the hexagonal KDE,
+so that a run with other settings never overwrites the results of the same bandwidth, movement limit, kernel and metric.
+The GeoPackages of the files and gpkg backends are read in parallel threads with pyogrio's Arrow reader.
+"""
+
+import os
+import struct
+import numbers
+import sqlite3
+import fiona
+import shapely
+import pandas as pd
+import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyogrio
+except ImportError:
+    # Without pyogrio the GeoPackages are read with fiona, which is slower but gives the same results.
+    pyogrio = None
+
+from KDE.kde_extent import default_extent_method
+from KDE.kde_extent import default_max_cells
+from get_dotenv import output_folder_path
+from get_dotenv import output_all_path
+from get_dotenv import temporal_kde
+from get_dotenv import temporal_bandwidth
+from get_dotenv import bootstrap_replicates
+from get_dotenv import shared_pair_grid
+from get_dotenv import drop_extent_outliers
+from get_dotenv import kde_engine
+from get_dotenv import h3_resolution
+from get_dotenv import progressive_kde
+from get_dotenv import kde_tree_tuning
+from get_dotenv import extent_method
+from get_dotenv import max_grid_cells
+
+# The columns of the results in the consolidated backends.
+result_columns = ['pair', 'country', 'kind', 'lod', 'level', 'area', 'bandwidth', 'movement_limit', 'kernel', 'metric', 'variant', 'geometry']
+
+# The amount of threads reading GeoPackage layers at a time, reading is mostly waiting for the disk and GDAL.
+read_workers = 8
+
+
+def run_parameters(analysis_bandwidth, movement_limit, kernel_type, metric_type, temporal = temporal_kde, temporal_bandwidth = temporal_bandwidth,
+                   bootstrap = bootstrap_replicates, shared_grid = shared_pair_grid == 'yes', drop_outliers = drop_extent_outliers == 'yes',
+                   kde_engine = kde_engine, h3_resolution = h3_resolution, progressive = progressive_kde == 'yes', tree_tuning = kde_tree_tuning,
+                   extent = extent_method, max_cells = max_grid_cells):
+
+    """
+    Returns the parameters of a KDE run which change its results, for the run manifest and the names of the results and figures.
+
+    The settings are only in the parameters when they are not the defaults, so the results of the default settings keep their names.
+
+    Args:
+        analysis_bandwidth (int or str): The bandwidth of the KDE in meters.
+        movement_limit (str): The movement limit in kilometers, or no.
+        kernel_type (str): The kernel type of the KDE.
+        metric_type (str): The metric type of the KDE.
+        temporal (str): The time step of the spatio-temporal KDE, or no, defaults to TEMPORAL_KDE in the .env file.
+        temporal_bandwidth (float or str): The temporal bandwidth in time slices, defaults to TEMPORAL_BANDWIDTH in the .env file.
+        bootstrap (int or str): The amount of bootstrap replicates, 0 for none, defaults to BOOTSTRAP_REPLICATES in the .env file.
+        shared_grid (bool): Whether both countries are evaluated on one mesh grid, defaults to SHARED_PAIR_GRID in the .env file.
+        drop_outliers (bool): Whether the points outside the extent are left out, defaults to DROP_EXTENT_OUTLIERS in the .env file.
+        kde_engine (str): The engine of the KDE (mesh or hexagonal), defaults to KDE_ENGINE in the .env file.
+        h3_resolution (int or str): The H3 resolution of the hexagonal KDE or auto, defaults to H3_RESOLUTION in the .env file.
+        progressive (bool): Whether the KDE is refined from a subsample until its contours stop changing, defaults to PROGRESSIVE_KDE in the .env file.
+        tree_tuning (str or float): The maximum relative error of the tuned tree settings or no, defaults to KDE_TREE_TUNING in the .env file.
+        extent (str): How the extent of the mesh grids is chosen, defaults to EXTENT_METHOD in the .env file.
+        max_cells (int or str): The maximum amount of cells of a mesh grid, defaults to MAX_GRID_CELLS in the .env file.
+
+    Returns:
+        dict: The analysis_bandwidth, movement_limit, kernel_type and metric_type of the KDE, and the time_step and temporal_bandwidth,
+            bootstrap_replicates, shared_grid, drop_outliers, h3_resolution, progressive, tree_tuning, extent_method and max_cells
+            if they are not the defaults.
+    """
+
+    parameters = {'analysis_bandwidth': analysis_bandwidth, 'movement_limit': movement_limit, 'kernel_type': kernel_type, 'metric_type': metric_type}
+
+    if temporal != 'no':
+        parameters.update({'time_step': temporal, 'temporal_bandwidth': f'{float(temporal_bandwidth):g}'})
+    if int(bootstrap) > 0:
+        parameters['bootstrap_replicates'] = int(bootstrap)
+    if shared_grid:
+        parameters['shared_grid'] = 'yes'
+    if drop_outliers:
+        parameters['drop_outliers'] = 'yes'
+    if kde_engine == 'hexagonal':
+        parameters['h3_resolution'] = str(h3_resolution)
+    if progressive:
+        parameters['progressive'] = 'yes'
+    if str(tree_tuning) != 'no':
+        parameters['tree_tuning'] = f'{float(tree_tuning):g}'
+    if extent != default_extent_method:
+        parameters['extent_method'] = extent
+    if int(max_cells) != default_max_cells:
+        parameters['max_cells'] = int(max_cells)
+
+    return parameters
+
+
+def parameter_stem(parameters):
+
+    """
+    Creates the part of the file names that describes the KDE parameters, with the variant of the settings at the end.
+
+    Args:
+        parameters (dict): The parameters of the KDE run, see run_parameters.
+
+    Returns:
+        str: The parameter part of the file names.
+    """
+
+    stem = f"{parameters['analysis_bandwidth']}BW_{parameters['movement_limit']}movelimit_{parameters['kernel_type']}_{parameters['metric_type']}"
+    variant = variant_stem(parameters)
+
+    return f'{stem}_{variant}' if variant else stem
+
+
+def variant_stem(parameters):
+
+    """
+    Creates the part of the file names that describes the settings of the KDE run which are not the defaults.
+
+    Args:
+        parameters (dict): The parameters of the KDE run, see run_parameters.
+
+    Returns:
+        str: The variant of the settings, e.g. 200bootstrap_sharedgrid, or an empty string for the default settings.
+    """
+
+    variants = []
+    if 'time_step' in parameters:
+        variants.append(f"{parameters['time_step']}_{parameters['temporal_bandwidth']}TBW")
+    if 'bootstrap_replicates' in parameters:
+        variants.append(f"{parameters['bootstrap_replicates']}bootstrap")
+    if 'shared_grid' in parameters:
+        variants.append('sharedgrid')
+    if 'drop_outliers' in parameters:
+        variants.append('dropoutliers')
+    if 'h3_resolution' in parameters:
+        variants.append(f"hex{parameters['h3_resolution']}")
+    if 'progressive' in parameters:
+        variants.append('progressive')
+    if 'tree_tuning' in parameters:
+        variants.append(f"tuned{parameters['tree_tuning']}")
+    if 'extent_method' in parameters:
+        variants.append(f"{parameters['extent_method']}extent")
+    if 'max_cells' in parameters:
+        variants.append(f"{parameters['max_cells']}maxcells")
+
+    return '_'.join(variants)
+
+
+def read_layers(layers, program_epsg = 3035):
+
+    """
+    Reads GeoPackage layers in parallel threads and concatenates them into one GeoDataFrame.
+
+    The layers are read with pyogrio's Arrow reader, which runs without the GIL, or with fiona if pyogrio is not installed.
+
+    Args:
+        layers (list): (file_path, layer, where, pair) tuples, where layer is None for the first layer, where is an SQL where clause
+            or None and pair is added as the pair column if it is not None.
+        program_epsg (int): The EPSG code of the empty GeoDataFrame which is returned when there are no layers.
+
+    Returns:
+        gpd.GeoDataFrame: The rows of all layers in the order of the layers.
+    """
+
+    if not layers:
+        return empty_results(program_epsg)
+
+    def read_layer(file_path, layer, where, pair):
+        if pyogrio is None:
+            layer_result = gpd.read_file(file_path, layer = layer, where = where)
+        else:
+            layer_result = pyogrio.read_dataframe(file_path, layer = layer, where = where, use_arrow = True)
+
+        if pair is not None:
+            layer_result['pair'] = pair
+
+        return layer_result
+
+    with ThreadPoolExecutor(max_workers = max(1, min(read_workers, len(layers)))) as executor:
+        results = list(executor.map(lambda arguments: read_layer(*arguments), layers))
+
+    return gpd.GeoDataFrame(pd.concat(results, ignore_index = True), crs = results[0].crs)
+
+
+def empty_results(program_epsg = 3035):
+
+    """
+    Returns an empty GeoDataFrame with the columns of the results, for reads which find no results, e.g. before any pair is done.
+
+    Args:
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+
+    Returns:
+        gpd.GeoDataFrame: The empty results.
+    """
+
+    return gpd.GeoDataFrame(columns = result_columns, geometry = 'geometry', crs = program_epsg)
+
+
+def sql_literal(value):
+
+    """
+    Returns the SQL literal of a value, for the where clauses of the GeoPackage reads.
+
+    Args:
+        value (str, int or float): The value, strings are quoted with their single quotes doubled.
+
+    Returns:
+        str: The SQL literal.
+    """
+
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+
+    return repr(float(value))
+
+
+def sql_identifier(name):
+
+    """Returns the quoted SQL identifier of a table or column name, with its double quotes doubled."""
+
+    return '"' + name.replace('"', '""') + '"'
+
+
+# The envelope sizes in bytes by the envelope indicator of the GeoPackage geometry header.
+gpkg_envelope_sizes = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def gpkg_bounds(blob):
+
+    """
+    Returns the bounds of a GeoPackage geometry blob, from the envelope of its header or else from its WKB.
+
+    Args:
+        blob (bytes): The GeoPackage geometry blob.
+
+    Returns:
+        tuple: The minimum x, minimum y, maximum x and maximum y, or None for an empty geometry.
+    """
+
+    flags = blob[3]
+    if flags & 0x10:
+        return None
+
+    byte_order = '<' if flags & 0x01 else '>'
+    envelope = (flags >> 1) & 0x07
+    if envelope:
+        min_x, max_x, min_y, max_y = struct.unpack_from(f'{byte_order}4d', blob, 8)
+        return min_x, min_y, max_x, max_y
+
+    return shapely.from_wkb(blob[8:]).bounds
+
+
+def register_gpkg_functions(connection):
+
+    """
+    Registers the spatial SQL functions which the R-tree triggers of a GeoPackage call, on a plain SQLite connection.
+
+    GDAL registers them on its own connections, so without them SQLite can not insert rows into the layers of a GeoPackage.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the GeoPackage.
+    """
+
+    def bound(index):
+        def function(blob):
+            bounds = gpkg_bounds(blob) if blob is not None else None
+            return bounds[index] if bounds is not None else None
+        return function
+
+    connection.create_function('ST_IsEmpty', 1, lambda blob: None if blob is None else int(gpkg_bounds(blob) is None), deterministic = True)
+    for index, name in enumerate(['ST_MinX', 'ST_MinY', 'ST_MaxX', 'ST_MaxY']):
+        connection.create_function(name, 1, bound(index), deterministic = True)
+
+
+def create_result_backend(backend_type, geometry_output, results_path = None):
+
+    """
+    Creates the result backend of the given type.
+
+    Args:
+        backend_type (str): The type of the backend (files, gpkg or parquet).
+        geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+        results_path (str, optional): The folder of the results, defaults to the output_all folder.
+
+    Returns:
+        FileResultBackend, GeoPackageResultBackend or GeoParquetResultBackend: The result backend.
+    """
+
+    backends = {'files': FileResultBackend, 'gpkg': GeoPackageResultBackend, 'parquet': GeoParquetResultBackend}
+
+    if backend_type not in backends:
+        raise ValueError(f'Unknown result backend {backend_type}, the options are files, gpkg and parquet.')
+
+    return backends[backend_type](geometry_output, results_path)
+
+
+class FileResultBackend():
+
+    """
+    Result backend which writes every result of a country pair to its own GeoPackage file.
+
+    Attributes:
+        geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+        results_path (str): The folder of the result files.
+
+    Methods:
+        write_pair(self, cntr_od, results, parameters): Writes the results of a country pair.
+        read_results(self, parameters, pairs, kind='merged', lod=None, program_epsg=3035): Reads the results of the given country pairs.
+    """
+
+
+    def __init__(self, geometry_output, results_path = None):
+
+        """
+        Initialize the FileResultBackend class.
+
+        Args:
+            geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+            results_path (str, optional): The folder of the result files, defaults to the output_all folder.
+        """
+
+        self.geometry_output = geometry_output
+        self.results_path = f'{output_folder_path}{output_all_path}' if results_path is None else results_path
+
+
+    def write_pair(self, cntr_od, results, parameters):
+
+        """
+        Writes the results of a country pair, each to its own GeoPackage file.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+            results (list): (kind, country_id, gpd.GeoDataFrame) tuples, where kind is country, merged or the lower or upper bound of the confidence bands.
+            parameters (dict): The parameters of the KDE run, see run_parameters.
+
+        Returns:
+            list: The paths of the written files.
+        """
+
+        file_paths = []
+        for kind, country_id, gdf in results:
+            file_path = f'{self.results_path}{self.__file_name(kind, cntr_od, country_id, parameters)}'
+            self.geometry_output.write(gdf, file_path)
+            file_paths.append(file_path)
+
+        return file_paths
+
+
+    def read_results(self, parameters, pairs, kind = 'merged', lod = None, program_epsg = 3035):
+
+        """
+        Reads the results of the given country pairs from their files, in parallel threads. The pairs without a file are skipped.
+
+        Args:
+            parameters (dict): The parameters of the KDE run, see run_parameters.
+            pairs (list): The canonical country pair identifiers.
+            kind (str): The kind of the results, merged is the only kind that can be read from the files.
+            lod (str, optional): The level of detail, defaults to the full detail level.
+            program_epsg (int): The EPSG code of the empty results which are returned when there are no country pairs.
+
+        Returns:
+            gpd.GeoDataFrame: The results with a pair column.
+        """
+
+        file_paths = {cntr_od: f'{self.results_path}{self.__file_name(kind, cntr_od, None, parameters)}' for cntr_od in pairs}
+
+        return read_layers([(file_path, lod, None, cntr_od) for cntr_od, file_path in file_paths.items() if os.path.exists(file_path)], program_epsg)
+
+
+    def __file_name(self, kind, cntr_od, country_id, parameters):
+
+        """Creates the file name of a result."""
+
+        if kind == 'country':
+            return f'geo_file_for_country_{country_id}_in_country_pair_{cntr_od}_{parameter_stem(parameters)}.gpkg'
+
+        if kind in ('lower', 'upper'):
+            return f'{kind}_bound_for_country_{country_id}_in_country_pair_{cntr_od}_{parameter_stem(parameters)}.gpkg'
+
+        return f'merged_{cntr_od}_{parameter_stem(parameters)}.gpkg'
+
+
+class ConsolidatedResultBackend():
+
+    """
+    Base class for the result backends which keep every country pair in one dataset.
+
+    The results of a pair are flattened into one table with a row per level, level of detail, kind and country before they are written.
+
+    Attributes:
+        geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+        results_path (str): The folder of the results.
+
+    Methods:
+        write_pair(self, cntr_od, results, parameters): Writes the results of a country pair in one bulk write.
+        read_results(self, parameters, pairs=None, kind='merged', lod=None, program_epsg=3035): Reads the results in one scan.
+    """
+
+
+    def __init__(self, geometry_output, results_path = None):
+
+        """
+        Initialize the ConsolidatedResultBackend class.
+
+        Args:
+            geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+            results_path (str, optional): The folder of the results, defaults to the output_all folder.
+        """
+
+        self.geometry_output = geometry_output
+        self.results_path = f'{output_folder_path}{output_all_path}' if results_path is None else results_path
+
+
+    def write_pair(self, cntr_od, results, parameters):
+
+        """
+        Writes the results of a country pair in one bulk write.
+
+        Previous results of the same pair and parameters are replaced.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+            results (list): (kind, country_id, gpd.GeoDataFrame) tuples, where kind is country, merged or the lower or upper bound of the confidence bands.
+            parameters (dict): The parameters of the KDE run, see run_parameters.
+
+        Returns:
+            list: The path of the written dataset.
+        """
+
+        tables = []
+        for kind, country_id, gdf in results:
+            for lod, level in self.geometry_output.levels_of_detail(gdf).items():
+                tables.append(self.__result_table(level, cntr_od, country_id, kind, lod, parameters))
+
+        pair_results = gpd.GeoDataFrame(pd.concat(tables, ignore_index = True), crs = tables[0].crs)
+
+        return [self._write_pair_results(cntr_od, pair_results, parameters)]
+
+
+    def read_results(self, parameters, pairs = None, kind = 'merged', lod = None, program_epsg = 3035):
+
+        """
+        Reads the results of a parameter set in one scan.
+
+        Args:
+            parameters (dict): The parameters of the KDE run, see run_parameters.
+            pairs (list, optional): Reads only these country pairs, defaults to all country pairs.
+            kind (str): The kind of the results, country or merged.
+            lod (str, optional): The level of detail, defaults to the full detail level.
+            program_epsg (int): The EPSG code of the empty results which are returned when nothing is found.
+
+        Returns:
+            gpd.GeoDataFrame: The results.
+        """
+
+        if pairs is not None and not pairs:
+            return empty_results(program_epsg)
+
+        if lod is None:
+            lod = next(iter(self.geometry_output.lod_tolerances))
+
+        filters = [('kind', '==', kind), ('lod', '==', lod),
+                   ('bandwidth', '==', int(parameters['analysis_bandwidth'])),
+                   ('movement_limit', '==', str(parameters['movement_limit'])),
+                   ('kernel', '==', parameters['kernel_type']), ('metric', '==', parameters['metric_type']),
+                   ('variant', '==', variant_stem(parameters))]
+
+        if pairs is not None:
+            filters.append(('pair', 'in', list(pairs)))
+
+        return self._read_filtered(filters, pairs, program_epsg)
+
+
+    def __result_table(self, gdf, cntr_od, country_id, kind, lod, parameters):
+
+        """Flattens one level of detail of a result to the columns of the consolidated backends."""
+
+        table = gpd.GeoDataFrame({
+            'pair': cntr_od,
+            'country': gdf['CNTR_OD'].values if 'CNTR_OD' in gdf else country_id,
+            'kind': kind,
+            'lod': lod,
+            'level': gdf['level'].values,
+            'area': gdf.geometry.area.values,
+            'bandwidth': int(parameters['analysis_bandwidth']),
+            'movement_limit': str(parameters['movement_limit']),
+            'kernel': parameters['kernel_type'],
+            'metric': parameters['metric_type'],
+            'variant': variant_stem(parameters),
+        }, geometry = gdf.geometry.values, crs = gdf.crs)
+
+        return table[result_columns]
+
+
+class GeoPackageResultBackend(ConsolidatedResultBackend):
+
+    """
+    Result backend which writes every country pair into its own layer of one GeoPackage.
+
+    The rows of a parameter set are replaced with a delete of its previous rows and an append of the new rows in one SQLite
+    transaction, so a crash never loses the results of the pair's other parameter sets and a write only costs the rows it replaces.
+    """
+
+
+    def __init__(self, geometry_output, results_path = None):
+
+        """
+        Initialize the GeoPackageResultBackend class.
+
+        Args:
+            geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+            results_path (str, optional): The folder of the results.gpkg file, defaults to the output_all folder.
+        """
+
+        super().__init__(geometry_output, results_path)
+        self.file_path = f'{self.results_path}results.gpkg'
+
+
+    def _write_pair_results(self, cntr_od, pair_results, parameters):
+
+        """Replaces the pair's results of the parameter set in the pair's layer."""
+
+        if not (os.path.exists(self.file_path) and cntr_od in fiona.listlayers(self.file_path)):
+            pair_results.to_file(self.file_path, layer = cntr_od, driver='GPKG')
+            return self.file_path
+
+        # GDAL encodes the new rows into a temporary GeoPackage, from which they are appended to the pair's layer with SQL.
+        temporary_path = f'{self.file_path}.{cntr_od}.tmp.gpkg'
+        pair_results.to_file(temporary_path, layer = cntr_od, driver='GPKG')
+
+        try:
+            self.__replace_rows(cntr_od, temporary_path, pair_results)
+        finally:
+            os.remove(temporary_path)
+
+        return self.file_path
+
+
+    def __replace_rows(self, cntr_od, temporary_path, pair_results):
+
+        """
+        Deletes the previous rows of the parameter set from the pair's layer and appends the new rows, in one SQLite transaction.
+
+        Args:
+            cntr_od (str): The country pair, which is the name of its layer.
+            temporary_path (str): The path of the temporary GeoPackage with the new rows in a layer of the same name.
+            pair_results (gpd.GeoDataFrame): The new rows, whose first row holds the parameter set.
+        """
+
+        layer = sql_identifier(cntr_od)
+        first = pair_results.iloc[0]
+
+        connection = sqlite3.connect(self.file_path, timeout = 60, isolation_level = None)
+        try:
+            register_gpkg_functions(connection)
+            connection.execute('ATTACH DATABASE ? AS new_rows', (temporary_path,))
+
+            columns = [row[1] for row in connection.execute(f'PRAGMA main.table_info({layer})')]
+            new_columns = [row[1] for row in connection.execute(f'PRAGMA new_rows.table_info({layer})') if row[1] != 'fid']
+
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                # Layers written before a column existed, e.g. the variant column, get it with an empty default.
+                for column in new_columns:
+                    if column not in columns:
+                        connection.execute(f"ALTER TABLE main.{layer} ADD COLUMN {sql_identifier(column)} TEXT DEFAULT ''")
+
+                connection.execute(f"""DELETE FROM main.{layer} WHERE bandwidth = ? AND movement_limit = ? AND kernel = ?
+                                       AND metric = ? AND COALESCE(variant, '') = ?""",
+                                   (int(first['bandwidth']), str(first['movement_limit']), first['kernel'], first['metric'], first['variant']))
+
+                column_list = ', '.join(sql_identifier(column) for column in new_columns)
+                connection.execute(f'INSERT INTO main.{layer} ({column_list}) SELECT {column_list} FROM new_rows.{layer}')
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+            connection.execute('DETACH DATABASE new_rows')
+        finally:
+            connection.close()
+
+
+    def _read_filtered(self, filters, pairs, program_epsg):
+
+        """Reads the matching rows of every pair layer with an SQL where clause, the layers in parallel threads."""
+
+        if not os.path.exists(self.file_path):
+            return empty_results(program_epsg)
+
+        layers = fiona.listlayers(self.file_path)
+        pairs = layers if pairs is None else [cntr_od for cntr_od in pairs if cntr_od in layers]
+
+        where = ' AND '.join(f'{sql_identifier(column)} = {sql_literal(value)}' for column, operator, value in filters if operator == '==')
+
+        return read_layers([(self.file_path, cntr_od, where, None) for cntr_od in pairs], program_epsg)
+
+
+class GeoParquetResultBackend(ConsolidatedResultBackend):
+
+    """
+    Result backend which appends every country pair into one GeoParquet dataset partitioned by country pair.
+
+    Each pair and parameter set is one file in the pair's folder. The file is written to a temporary file first
+    and then moved in place, so a crash never leaves half written results in the dataset.
+    """
+
+
+    def __init__(self, geometry_output, results_path = None):
+
+        """
+        Initialize the GeoParquetResultBackend class.
+
+        Args:
+            geometry_output (GeometryOutput): The output stage that creates the levels of detail of the polygons.
+            results_path (str, optional): The folder of the results.parquet dataset, defaults to the output_all folder.
+        """
+
+        super().__init__(geometry_output, results_path)
+        self.dataset_path = f'{self.results_path}results.parquet/'
+
+
+    def _write_pair_results(self, cntr_od, pair_results, parameters):
+
+        """Writes the pair's results of the parameter set to its own file in the pair's folder."""
+
+        pair_folder = f'{self.dataset_path}{cntr_od}/'
+        os.makedirs(pair_folder, exist_ok = True)
+
+        # Files starting with an underscore are skipped when the dataset is read.
+        file_path = f'{pair_folder}{parameter_stem(parameters)}.parquet'
+        temporary_path = f'{pair_folder}_{parameter_stem(parameters)}.parquet.tmp'
+        pair_results.to_parquet(temporary_path, index = False)
+        os.replace(temporary_path, file_path)
+
+        return file_path
+
+
+    def _read_filtered(self, filters, pairs, program_epsg):
+
+        """Reads the matching rows of the whole dataset in one columnar scan."""
+
+        if not os.path.exists(self.dataset_path):
+            return empty_results(program_epsg)
+
+        return gpd.read_parquet(self.dataset_path, filters = filters)
@@ -0,0 +1,187 @@
+import os
+import json
+from datetime import datetime
+
+from KDE.kde_result_backend import parameter_stem
+from get_dotenv import output_folder_path
+from get_dotenv import output_all_path
+
+class KdeRunManifest():
+
+    """
+    Keeps the run manifest of the KDE runs with one set of KDE parameters.
+
+    The manifest records the status (running, done or failed), the parameters, the output paths, the timings and the error with its
+    traceback of every country pair. It is written after every change of a country pair, so after a crash a rerun with the same parameters can
+    skip the country pairs that are already done, and the merged map of all KDEs knows which country pairs have results.
+
+    Attributes:
+        parameters (dict): The parameters of the KDE run, which are in the name of the manifest like in the names of the results.
+        manifest_path (str): The path of the manifest JSON file.
+        pairs (dict): The entry of every country pair in the manifest.
+
+    Methods:
+        is_done(self, cntr_od): Whether the country pair is already done with the same parameters and its outputs exist.
+        done_pairs(self): Returns the country pairs which are done.
+        failed_pairs(self): Returns the country pairs which failed.
+        pair_seconds(self): Returns the wall time of the country pairs which are done.
+        start(self, cntr_od): Marks the country pair as running.
+        done(self, cntr_od, output_paths, timings): Marks the country pair as done.
+        failed(self, cntr_od, error, error_traceback, timings): Marks the country pair as failed.
+        __usable(self, entry): Whether a done entry has the same parameters and its outputs exist.
+        __write(self): Writes the manifest to its JSON file.
+    """
+
+
+    def __init__(self, parameters, manifest_path = None):
+
+        """
+        Initialize the KdeRunManifest class and read in the earlier manifest with the same parameters, if there is one.
+
+        Args:
+            parameters (dict): The parameters of the KDE run (see run_parameters of the result backends) and the shard of a run
+                split over several machines.
+            manifest_path (str, optional): The path of the manifest JSON file, defaults to run_manifests/ in the output folder
+                with the parameters in the file name.
+        """
+
+        self.parameters = {key: str(value) for key, value in parameters.items()}
+
+        if manifest_path is None:
+            # The runs with other settings, e.g. the confidence bands or the hexagonal KDE, have the stem of their results, so they do not skip the pairs done without them.
+            # Every shard of a run split over several machines has its own manifest too, so that the machines do not overwrite each other's manifest.
+            shard_stem = f"_shard{parameters['shard'].replace('/', 'of')}" if 'shard' in parameters else ''
+            manifest_path = f'{output_folder_path}{output_all_path}run_manifests/{parameter_stem(parameters)}{shard_stem}.json'
+        self.manifest_path = manifest_path
+
+        self.pairs = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                self.pairs = json.load(file)['pairs']
+
+
+    def is_done(self, cntr_od):
+
+        """
+        Whether the country pair is already done in this or an earlier run, with the same parameters and with all of its outputs still there.
+
+        A pair done with another result backend or other settings, or whose results were removed, is not done, so that it is run again.
+        """
+
+        entry = self.pairs.get(cntr_od)
+
+        return entry is not None and self.__usable(entry)
+
+
+    def done_pairs(self):
+
+        """
+        Returns the country pairs which are done with the same parameters and whose outputs exist.
+
+        Returns:
+            list: The canonical country pair identifiers.
+        """
+
+        return [cntr_od for cntr_od, entry in self.pairs.items() if self.__usable(entry)]
+
+
+    def failed_pairs(self):
+
+        """
+        Returns the country pairs which failed, or were still running when the program stopped.
+
+        Returns:
+            list: The canonical country pair identifiers.
+        """
+
+        return [cntr_od for cntr_od, entry in self.pairs.items() if entry['status'] != 'done']
+
+
+    def pair_seconds(self):
+
+        """
+        Returns the wall time of the country pairs which are done, for estimating the cost of the pairs in the next run.
+
+        Returns:
+            dict: The wall time in seconds of every country pair which is done.
+        """
+
+        return {cntr_od: entry['timings']['wall_seconds'] for cntr_od, entry in self.pairs.items()
+                if entry['status'] == 'done' and entry.get('timings') and entry['timings'].get('wall_seconds') is not None}
+
+
+    def start(self, cntr_od):
+
+        """
+        Marks the country pair as running, so that a crash during the country pair can be seen in the manifest.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+        """
+
+        self.pairs[cntr_od] = {'status': 'running', 'started': datetime.now().isoformat(timespec = 'seconds')}
+        self.__write()
+
+
+    def done(self, cntr_od, output_paths, timings):
+
+        """
+        Marks the country pair as done.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+            output_paths (list): The paths of the saved results.
+            timings (dict): The wall and CPU time and peak memory of the country pair.
+        """
+
+        self.pairs[cntr_od].update({'status': 'done', 'finished': datetime.now().isoformat(timespec = 'seconds'), 'parameters': self.parameters,
+                                    'output_paths': output_paths, 'timings': timings, 'error': None, 'traceback': None})
+        self.__write()
+
+
+    def failed(self, cntr_od, error, error_traceback, timings):
+
+        """
+        Marks the country pair as failed.
+
+        Args:
+            cntr_od (str): The canonical country pair identifier.
+            error (str): The error message.
+            error_traceback (str): The formatted traceback of the error.
+            timings (dict): The wall and CPU time and peak memory of the country pair.
+        """
+
+        self.pairs[cntr_od].update({'status': 'failed', 'finished': datetime.now().isoformat(timespec = 'seconds'), 'parameters': self.parameters,
+                                    'output_paths': [], 'timings': timings, 'error': error, 'traceback': error_traceback})
+        self.__write()
+
+
+    def __usable(self, entry):
+
+        """
+        Whether an entry of the manifest is done with the same parameters and all of its output paths exist.
+
+        The shard is left out of the comparison, so that the entries of the shards' manifests are usable in the manifest of the whole run.
+        """
+
+        if entry.get('status') != 'done':
+            return False
+
+        parameters = {key: value for key, value in entry.get('parameters', {}).items() if key != 'shard'}
+        if parameters != {key: value for key, value in self.parameters.items() if key != 'shard'}:
+            return False
+
+        return bool(entry.get('output_paths')) and all(os.path.exists(path) for path in entry['output_paths'])
+
+
+    def __write(self):
+
+        """Writes the manifest to a temporary file and replaces the manifest with it, so that a crash never leaves half a manifest."""
+
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok = True)
+        temporary_path = f'{self.manifest_path}.tmp'
+
+        with open(temporary_path, 'w') as file:
+            json.dump({'parameters': self.parameters, 'pairs': self.pairs}, file, indent = 2)
+
+        os.replace(temporary_path, self.manifest_path)
@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from KDE.kde_binning import mesh_grid
+from KDE.kde_binning import mesh_cells
+from KDE.kde_binning import inside_mesh
+from KDE.kde_binning import log_density
+
+# The time steps of the spatio-temporal KDE and the amount of time slices of each, all of them are cyclic.
+time_steps = {'month': 12, 'weekday': 7, 'hour_of_week': 168}
+
+# The labels of the time slices, used in the grid keys and plot titles.
+weekday_labels = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+month_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# The most memory in bytes for the float32 grids of all time slices, the smoothed histogram and the log-densities.
+max_grid_bytes = 4 * 1024 ** 3
+
+
+def time_slice_labels(time_step):
+
+    """
+    Returns the labels of the time slices of a time step, e.g. Jan to Dec for month and Mon00 to Sun23 for hour_of_week.
+
+    Args:
+        time_step (str): The time step, month, weekday or hour_of_week.
+
+    Returns:
+        list: The labels of the time slices in order.
+    """
+
+    if time_step == 'month':
+        return month_labels
+
+    if time_step == 'weekday':
+        return weekday_labels
+
+    return [f'{weekday}{hour:02d}' for weekday in weekday_labels for hour in range(24)]
+
+
+class SpatioTemporalKde():
+
+    """
+    The spatio-temporal KDE of a country, with a density grid for every time slice of a month, weekday or hour of the week.
+
+    The points are binned once into a three-dimensional histogram with the time slices along the first axis and the mesh grid's
+    rows and columns along the other two, and the histogram is smoothed with a separable Gaussian filter: the spatial kernel has
+    the analysis bandwidth as its standard deviation and the temporal kernel the temporal bandwidth in time slices, wrapping around
+    the year, the week or the hours of the week. Every time slice of the result is the KDE of the points weighted by the temporal kernel
+    around that slice, so one convolution gives all time slices, where separate KDEs would fit the points of every slice again.
+
+    The binning moves every point to its nearest mesh cell, which is exact enough when the mesh step is a fraction of the bandwidth.
+    Like the density grids of the KdeEngine the slices are log-densities per square meter, normalized by the temporally weighted
+    amount of points of each slice, so they can be contoured with the same contour levels. Only the Gaussian kernel with the
+    euclidean metric is separable, so the other kernels and metrics are not supported.
+
+    The histogram is counted and smoothed in place in float32, so the time slices take two float32 grids, the histogram and the
+    log-densities, and a mesh grid whose time slices would take more than max_grid_bytes is refused before they are allocated.
+
+    Attributes:
+        analysis_bandwidth (int): The spatial bandwidth of the KDE in meters.
+        temporal_bandwidth (float): The temporal bandwidth in time slices, 0 for no smoothing between the time slices.
+        time_step (str): The time step, month, weekday or hour_of_week.
+        mesh_step (int): The distance between the cells of the mesh grid in meters.
+        mesh_margin (int): How far in meters the mesh grid extends outside the points.
+        max_grid_bytes (int): The most memory in bytes for the grids of all time slices.
+        slice_labels (list): The labels of the time slices.
+
+    Methods:
+        time_index(self, times): Returns the time slice of every timestamp.
+        density_grids(self, country_coordinates, bounds=None): Computes the log-density grid of every time slice.
+        __histogram(self, coordinates, slices, x_mesh, y_mesh): Bins the points into the three-dimensional histogram.
+    """
+
+
+    def __init__(self, analysis_bandwidth, temporal_bandwidth = 1, time_step = 'month', kernel_type = 'gaussian', metric_type = 'euclidean', mesh_step = 2000, mesh_margin = 50000, max_grid_bytes = max_grid_bytes):
+
+        """
+        Initialize the SpatioTemporalKde class.
+
+        Args:
+            analysis_bandwidth (int or str): The spatial bandwidth of the KDE in meters.
+            temporal_bandwidth (float): The temporal bandwidth in time slices, 0 for no smoothing between the time slices.
+            time_step (str): The time step, month, weekday or hour_of_week.
+            kernel_type (str): The kernel type of the KDE, only gaussian is supported.
+            metric_type (str): The metric type of the KDE, only euclidean is supported.
+            mesh_step (int): The distance between the cells of the mesh grid in meters.
+            mesh_margin (int): How far in meters the mesh grid extends outside the points.
+            max_grid_bytes (int): The most memory in bytes for the grids of all time slices.
+        """
+
+        if time_step not in time_steps:
+            raise ValueError(f'Invalid time step {time_step}, the options are month, weekday and hour_of_week.')
+
+        if kernel_type != 'gaussian' or metric_type != 'euclidean':
+            raise ValueError(f'The spatio-temporal KDE supports only the gaussian kernel with the euclidean metric, not {kernel_type} with {metric_type}.')
+
+        self.analysis_bandwidth = int(analysis_bandwidth)
+        self.temporal_bandwidth = float(temporal_bandwidth)
+        self.time_step = time_step
+        self.mesh_step = mesh_step
+        self.mesh_margin = mesh_margin
+        self.max_grid_bytes = max_grid_bytes
+        self.slice_labels = time_slice_labels(time_step)
+
+
+    def time_index(self, times):
+
+        """
+        Returns the time slice of every timestamp.
+
+        The timestamps are parsed as UTC, so the weekdays and hours are those of UTC.
+
+        Args:
+            times (pd.Series): The timestamps, as text or datetimes.
+
+        Returns:
+            np.ndarray: The time slice of every timestamp, -1 for missing or unreadable timestamps.
+        """
+
+        times = pd.to_datetime(times, utc = True, errors = 'coerce')
+
+        if self.time_step == 'month':
+            index = times.dt.month - 1
+
+        elif self.time_step == 'weekday':
+            index = times.dt.weekday
+
+        else:
+            index = times.dt.weekday * 24 + times.dt.hour
+
+        return index.fillna(-1).to_numpy(dtype = np.int64)
+
+
+    def density_grids(self, country_coordinates, bounds = None):
+
+        """
+        Computes the log-density grid of every time slice of a country with one binned three-dimensional convolution.
+
+        Args:
+            country_coordinates (CountryPoints): The points of the country in the program's EPSG with a created_at_start attribute column.
+            bounds (np.ndarray, optional): The bounds the mesh grid covers, defaults to the grid bounds of the country's points.
+
+        Returns:
+            tuple: The log-density grids with the time slices along the first axis and the rows along the y-axis,
+                the x and y mesh grids and the amount of points in every time slice.
+        """
+
+        if 'created_at_start' not in country_coordinates.attributes:
+            raise ValueError('The spatio-temporal KDE needs the created_at_start column in the data.')
+
+        slices = self.time_index(country_coordinates.attributes['created_at_start'])
+        with_time = slices >= 0
+        if not with_time.any():
+            raise ValueError('The country has no points with a timestamp for the spatio-temporal KDE.')
+
+        # The same mesh grid as the density grid of the KdeEngine, so the grids of both can be compared.
+        bds = country_coordinates.grid_bounds if bounds is None else bounds
+        x_mesh, y_mesh = mesh_grid(bds, self.mesh_step, self.mesh_margin)
+
+        # The smoothed histogram and the log-densities are float32 grids of every time slice.
+        grid_bytes = 2 * len(self.slice_labels) * x_mesh.size * np.dtype(np.float32).itemsize
+        if grid_bytes > self.max_grid_bytes:
+            raise ValueError(f'The {len(self.slice_labels)} time slices of the {x_mesh.size} mesh cells need {grid_bytes / 1024 ** 3:.1f} GB, more than the '
+                             f'{self.max_grid_bytes / 1024 ** 3:.1f} GB of the spatio-temporal KDE. Use a coarser time step, a larger mesh step or fewer MAX_GRID_CELLS.')
+
+        # The points outside the mesh grid, the outliers outside the country's extent, are not binned.
+        binned = with_time & inside_mesh(country_coordinates.xy, x_mesh, y_mesh, self.mesh_step)
+        coordinates = country_coordinates.xy[binned]
+        histogram = self.__histogram(coordinates, slices[binned], x_mesh, y_mesh)
+        slice_counts = np.bincount(slices[binned], minlength = len(self.slice_labels))
+
+        # The spatial kernel does not wrap, the temporal kernel wraps around the cycle of the time step.
+        sigma = (self.temporal_bandwidth, self.analysis_bandwidth / self.mesh_step, self.analysis_bandwidth / self.mesh_step)
+        smoothed = ndimage.gaussian_filter(histogram, sigma, mode = ('wrap', 'constant', 'constant'), output = histogram)
+        weighted_counts = ndimage.gaussian_filter1d(slice_counts.astype(np.float64), self.temporal_bandwidth, mode = 'wrap') if self.temporal_bandwidth > 0 else slice_counts.astype(np.float64)
+
+        # The density per square meter of every time slice.
+        pred_grids = log_density(smoothed, weighted_counts[:, None, None], self.mesh_step)
+
+        return pred_grids, x_mesh, y_mesh, slice_counts.astype(np.int64)
+
+
+    def __histogram(self, coordinates, slices, x_mesh, y_mesh):
+
+        """
+        Bins the points to their nearest mesh cell in their time slice.
+
+        The points are sorted by time slice and counted one slice at a time straight into the float32 histogram, so only the
+        counts of one slice are ever held as integers.
+
+        Returns:
+            np.ndarray: The amount of points of every time slice and mesh cell as float32, with the time slices along the first axis.
+        """
+
+        rows, columns = x_mesh.shape
+        cells = mesh_cells(coordinates, x_mesh, y_mesh, self.mesh_step)
+
+        order = np.argsort(slices, kind = 'stable')
+        slice_starts = np.searchsorted(slices[order], np.arange(len(self.slice_labels) + 1))
+
+        histogram = np.zeros((len(self.slice_labels), rows, columns), dtype = np.float32)
+        for index in range(len(self.slice_labels)):
+            slice_cells = cells[order[slice_starts[index]:slice_starts[index + 1]]]
+            if len(slice_cells):
+                histogram[index] = np.bincount(slice_cells, minlength = rows * columns).reshape(rows, columns)
+
+        return histogram
@@ -0,0 +1,221 @@
+import os
+import json
+import math
+import time
+import itertools
+import threading
+import numpy as np
+from sklearn.neighbors import KernelDensity
+
+from KDE.kde_contours import contour_floor
+from get_dotenv import output_folder_path
+from get_dotenv import output_all_path
+
+# The tree settings that are benchmarked: the tree type, the leaf size, the order of the tree traversal and the relative tolerance
+# as a share of the maximum relative error.
+tree_algorithms = ['kd_tree', 'ball_tree']
+leaf_sizes = [20, 40, 100]
+traversal_orders = [True, False]
+tolerance_shares = [0, 0.1, 1]
+
+class KdeTreeTuner():
+
+    """
+    Chooses the fastest tree settings of scikit-learn's KernelDensity for a country's points, within a maximum relative error.
+
+    The KDE of scikit-learn evaluates the density with a KD-tree or a ball tree. The tree type, the leaf size, whether the tree is
+    traversed breadth first and the relative tolerance rtol change the time of the evaluation many times over, depending on how
+    dense the points are compared to the bandwidth. The tuner fits the KDE with every combination of the settings to a random
+    sample of the points, times the evaluation on a random sample of the mesh grid's cells after a warm-up evaluation, as the best
+    of several repeats, and compares the log-densities with
+    the exact evaluation of the default settings. The fastest settings whose relative error of the density stays under the maximum
+    in the cells above the contour floor are chosen.
+
+    The choice is cached per size class, the kernel, metric and bandwidth and the order of magnitude of the amount of points,
+    in a JSON file, so the benchmark is run only once for all the countries of the same size class, also in later runs.
+
+    Attributes:
+        max_relative_error (float): The maximum relative error of the density of the chosen settings.
+        sample_points (int): The largest amount of points the settings are benchmarked with.
+        sample_cells (int): The amount of mesh cells the evaluation is timed on.
+        repeats (int): How many times the evaluation of every combination is timed, the fastest time counts.
+        cache_path (str): The path of the JSON cache of the chosen settings.
+        seed (int): The seed of the random samples.
+
+    Methods:
+        size_class(self, kde_settings, points): Returns the size class of a country's KDE.
+        tree_parameters(self, kde_settings, coordinates, query_points): Returns the tree settings of a country's KDE.
+        benchmark(self, kde_settings, coordinates, query_points): Benchmarks every combination of the tree settings.
+        __candidates(self, metric_type): Returns the combinations of the tree settings to benchmark.
+        __read_cache(self): Reads the cached choices.
+        __write_cache(self, cache): Writes the cached choices.
+    """
+
+
+    def __init__(self, max_relative_error = 0.01, sample_points = 10000, sample_cells = 500, repeats = 3, cache_path = None, seed = 0):
+
+        """
+        Initialize the KdeTreeTuner class.
+
+        Args:
+            max_relative_error (float or str): The maximum relative error of the density of the chosen settings.
+            sample_points (int): The largest amount of points the settings are benchmarked with.
+            sample_cells (int): The amount of mesh cells the evaluation is timed on.
+            repeats (int): How many times the evaluation of every combination is timed, the fastest time counts.
+            cache_path (str, optional): The path of the JSON cache, defaults to kde_tree_tuning.json in the output folder.
+            seed (int): The seed of the random samples.
+        """
+
+        self.max_relative_error = float(max_relative_error)
+        self.sample_points = sample_points
+        self.sample_cells = sample_cells
+        self.repeats = repeats
+        self.cache_path = f'{output_folder_path}{output_all_path}kde_tree_tuning.json' if cache_path is None else cache_path
+        self.seed = seed
+        self.__lock = threading.Lock()
+
+
+    def size_class(self, kde_settings, points):
+
+        """
+        Returns the size class of a country's KDE, which the choice of the tree settings is cached by.
+
+        Args:
+            kde_settings (dict): The bandwidth, kernel and metric of the KDE.
+            points (int): The amount of points of the country.
+
+        Returns:
+            str: The size class, e.g. gaussian_euclidean_20000BW_1e4points_0.01error.
+        """
+
+        magnitude = int(math.floor(math.log10(max(points, 1))))
+
+        return f"{kde_settings['kernel']}_{kde_settings['metric']}_{kde_settings['bandwidth']}BW_1e{magnitude}points_{self.max_relative_error:g}error"
+
+
+    def tree_parameters(self, kde_settings, coordinates, query_points):
+
+        """
+        Returns the tree settings of a country's KDE, from the cache or by benchmarking them.
+
+        Args:
+            kde_settings (dict): The bandwidth, kernel and metric of the KDE.
+            coordinates (np.ndarray): The x and y coordinates of the country's points.
+            query_points (np.ndarray): The x and y coordinates of the mesh grid's cells.
+
+        Returns:
+            dict: The algorithm, leaf_size, breadth_first and rtol keyword arguments of KernelDensity.
+        """
+
+        size_class = self.size_class(kde_settings, len(coordinates))
+
+        with self.__lock:
+            cache = self.__read_cache()
+            if size_class in cache:
+                return cache[size_class]['parameters']
+
+            results = self.benchmark(kde_settings, coordinates, query_points)
+            accurate = [result for result in results if result['relative_error'] <= self.max_relative_error]
+            fastest = min(accurate, key = lambda result: result['seconds'])
+            default = results[0]
+
+            cache[size_class] = {'parameters': fastest['parameters'], 'seconds': fastest['seconds'], 'default_seconds': default['seconds'],
+                                 'relative_error': fastest['relative_error'], 'sample_points': fastest['points']}
+            self.__write_cache(cache)
+
+        print(f"    Tree settings for {size_class}: {fastest['parameters']}, {default['seconds'] / fastest['seconds']:.1f} times faster than the defaults")
+
+        return fastest['parameters']
+
+
+    def benchmark(self, kde_settings, coordinates, query_points):
+
+        """
+        Benchmarks every combination of the tree settings on a sample of the points and the mesh grid's cells.
+
+        The relative error of the density is measured against the exact evaluation with rtol 0, only in the cells above
+        the contour floor, because the contours do not depend on the cells below it.
+
+        Every combination is evaluated once untimed as a warm-up, so the first combination, the defaults, does not also take
+        the cold-start cost of the first evaluation, and then timed repeats times, of which the fastest time counts.
+
+        Args:
+            kde_settings (dict): The bandwidth, kernel and metric of the KDE.
+            coordinates (np.ndarray): The x and y coordinates of the country's points.
+            query_points (np.ndarray): The x and y coordinates of the mesh grid's cells.
+
+        Returns:
+            list: The parameters, seconds, relative error and amount of points of every combination.
+        """
+
+        rng = np.random.default_rng(self.seed)
+        if len(coordinates) > self.sample_points:
+            coordinates = coordinates[rng.choice(len(coordinates), self.sample_points, replace = False)]
+        if len(query_points) > self.sample_cells:
+            query_points = query_points[rng.choice(len(query_points), self.sample_cells, replace = False)]
+
+        reference = None
+        results = []
+        for parameters in self.__candidates(kde_settings['metric']):
+            kde = KernelDensity(bandwidth = kde_settings['bandwidth'], kernel = kde_settings['kernel'], metric = kde_settings['metric'], **parameters)
+            kde.fit(coordinates)
+
+            pred = kde.score_samples(query_points)
+
+            seconds = math.inf
+            for _ in range(self.repeats):
+                start = time.perf_counter()
+                kde.score_samples(query_points)
+                seconds = min(seconds, time.perf_counter() - start)
+
+            # The first candidate is exact, so it is the reference of the others.
+            if reference is None:
+                reference = pred
+                counted = reference > contour_floor
+
+            relative_error = float(np.abs(np.expm1(pred[counted] - reference[counted])).max()) if counted.any() else 0.0
+            results.append({'parameters': parameters, 'seconds': seconds, 'relative_error': relative_error, 'points': len(coordinates)})
+
+        return results
+
+
+    def __candidates(self, metric_type):
+
+        """
+        Returns the combinations of the tree settings, the defaults of KernelDensity first.
+
+        The haversine metric is supported only by the ball tree.
+        """
+
+        algorithms = ['ball_tree'] if metric_type == 'haversine' else tree_algorithms
+        candidates = [{'algorithm': algorithm, 'leaf_size': leaf_size, 'breadth_first': breadth_first, 'rtol': share * self.max_relative_error}
+                      for algorithm, leaf_size, breadth_first, share in itertools.product(algorithms, leaf_sizes, traversal_orders, tolerance_shares)]
+
+        default = {'algorithm': algorithms[0], 'leaf_size': 40, 'breadth_first': True, 'rtol': 0}
+        candidates.remove(default)
+
+        return [default] + candidates
+
+
+    def __read_cache(self):
+
+        """Reads the cached choices of the tree settings, an empty cache if there is no cache file yet."""
+
+        if not os.path.exists(self.cache_path):
+            return {}
+
+        with open(self.cache_path) as file:
+            return json.load(file)
+
+
+    def __write_cache(self, cache):
+
+        """Writes the cached choices to a temporary file and replaces the cache file with it."""
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok = True)
+        temporary_path = f'{self.cache_path}.tmp'
+
+        with open(temporary_path, 'w') as file:
+            json.dump(cache, file, indent = 2)
+
+        os.replace(temporary_path, self.cache_path)
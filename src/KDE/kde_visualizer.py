@@ -1,18 +1,52 @@
+import io
 import pandas as pd 
-import geopandas as gpd
+import numpy as np
 import contextily
 import matplotlib.pyplot as plt
-import numpy as np
-from shapely.geometry import Polygon
-from shapely.geometry import MultiPolygon
 import time
-from sklearn.neighbors import KernelDensity
+import math
+import shapely
+from matplotlib.collections import LineCollection
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 import matplotlib.patches as mpatches
 from matplotlib_scalebar.scalebar import ScaleBar
 
+from matplotlib.figure import Figure
+
+from KDE.kde_engine import KdeEngine
+from KDE.kde_progressive import ProgressiveKde
+from KDE.kde_spatiotemporal import SpatioTemporalKde
+from KDE.kde_bootstrap import BootstrapKde
+from KDE.kde_hexagonal import HexagonalKde
+from KDE.kde_tree_tuning import KdeTreeTuner
+from KDE.kde_pair_surfaces import pair_bounds
+from KDE.kde_pair_surfaces import pair_surfaces
+from KDE.kde_pair_surfaces import surface_names
+from KDE.kde_contours import contour_floor
+from KDE.kde_contours import contour_levels
+from KDE.kde_instrumentation import KdeInstrumentation
+from KDE.kde_grid_store import DensityGridStore
+from KDE.kde_geometry_output import GeometryOutput
+from KDE.kde_result_backend import create_result_backend
+from KDE.kde_result_backend import run_parameters
+from KDE.kde_result_backend import parameter_stem
+from KDE.kde_result_backend import variant_stem
+from KDE.kde_background_writer import BackgroundWriter
 from get_dotenv import output_folder_path
 from get_dotenv import output_all_path
+from get_dotenv import result_backend
+from get_dotenv import progressive_kde
+from get_dotenv import temporal_kde
+from get_dotenv import temporal_bandwidth
+from get_dotenv import bootstrap_replicates
+from get_dotenv import shared_pair_grid
+from get_dotenv import kde_tree_tuning
+from get_dotenv import extent_method
+from get_dotenv import extent_quantile
+from get_dotenv import max_grid_cells
+from get_dotenv import drop_extent_outliers
+from get_dotenv import kde_engine
+from get_dotenv import h3_resolution
 
 class KdeVisualizer():
 
@@ -23,30 +57,46 @@ class KdeVisualizer():
     It initializes the visualization, performs the KDE calculations, and generates visualizations based on user-defined parameters.
 
     Args:
-        country_1_coordinates (gpd.GeoDataFrame): GeoDataFrame for the first country.
-        country_2_coordinates (gpd.GeoDataFrame): GeoDataFrame for the second country.
+        country_1_coordinates (CountryPoints): The points of the first country.
+        country_2_coordinates (CountryPoints): The points of the second country.
         country_od (str): Canonical country pair identifier.
         country1_id (str): Abbreviation of the first country.
         country2_id (str): Abbreviation of the second country.
-        type_of_kde_analysis (str): Type of analysis ('pair' or 'multi').
+        type_of_kde_analysis (str): Type of analysis ('pair', 'all' or 'batch').
         analysis_bandwidth (str): Bandwidth for the KDE visualization.
         kernel_type (str): Type of kernel for the KDE visualization.
         metric_type (str): Type of metric used for the KDE visualization.
         extent_of_kde_analysis (str): Whether to limit movement distances (yes or no).
         movement_limit (str): The movement limit in kilometers.
         program_epsg (int): The EPSG code for the program's coordinate reference system.
-        border_data (gpd.GeoDataFrame): GeoDataFrame containing country border data.
+        border_service (BorderService): The indexed country border data.
+        result_backend_type (str): The result backend of the KDE polygons (files, gpkg or parquet).
+        instrumentation (KdeInstrumentation): Records the time and memory use of the stages.
+        progressive (bool): Whether the KDE is first previewed from a subsample and then refined until its contours stop changing.
+        temporal (str): The time step of the spatio-temporal KDE (month, weekday or hour_of_week), or no.
+        temporal_bandwidth (float): The bandwidth of the spatio-temporal KDE's temporal kernel in time slices.
+        bootstrap (int): The amount of bootstrap replicates of the confidence bands of the contours, 0 for no confidence bands.
+        shared_grid (bool): Whether both countries are evaluated on one mesh grid and the pair's derived surfaces are created.
+        tree_tuning (str): The maximum relative error of the density with tuned tree settings of the KDE, or no.
+        writer (BackgroundWriter): Writes the figures and results of the pair, in the background if its queue size is above 0.
+        extent (str): How the extent of the countries' mesh grids is chosen (bounds, quantile or border).
+        max_cells (int): The maximum amount of cells of a mesh grid, 0 for no maximum.
+        drop_outliers (bool): Whether the points outside the extent of the mesh grid are left out of the KDE.
+        kde_engine (str): The engine of the KDE, the mesh grid or the H3 cells (mesh or hexagonal).
+        h3_resolution (str): The H3 resolution of the hexagonal KDE, or auto.
+        parameters (dict): The parameters of the KDE run which change its results, in the names of the results, figures and grids.
+        output_futures (list): The futures of the pair's writes, each with the list of the written paths.
     """
 
 
-    def __init__(self, country_1_coordinates, country_2_coordinates, country_od, country1_id, country2_id, type_of_kde_analysis, analysis_bandwidth, kernel_type, metric_type, extent_of_kde_analysis, movement_limit, program_epsg, border_data):
+    def __init__(self, country_1_coordinates, country_2_coordinates, country_od, country1_id, country2_id, type_of_kde_analysis, analysis_bandwidth, kernel_type, metric_type, extent_of_kde_analysis, movement_limit, program_epsg, border_service, result_backend_type = result_backend, instrumentation = None, progressive = progressive_kde == 'yes', temporal = temporal_kde, temporal_bandwidth = temporal_bandwidth, bootstrap = bootstrap_replicates, shared_grid = shared_pair_grid == 'yes', tree_tuning = kde_tree_tuning, writer = None, extent = extent_method, max_cells = max_grid_cells, drop_outliers = drop_extent_outliers == 'yes', kde_engine = kde_engine, h3_resolution = h3_resolution):
 
         """
         Initialize the KdeVisualizer class with the provided parameters.
 
         Args:
-            country_1_coordinates (gpd.GeoDataFrame): GeoDataFrame for the first country.
-            country_2_coordinates (gpd.GeoDataFrame): GeoDataFrame for the second country.
+            country_1_coordinates (CountryPoints): The points of the first country.
+            country_2_coordinates (CountryPoints): The points of the second country.
             country_od (str): Canonical country pair identifier.
             country1_id (str): Abbreviation of the first country.
             country2_id (str): Abbreviation of the second country.
@@ -57,7 +107,24 @@ class KdeVisualizer():
             extent_of_kde_analysis (str): Whether to limit movement distances (yes or no).
             movement_limit (str): The movement limit in kilometers.
             program_epsg (int): The EPSG code for the program's coordinate reference system.
-            border_data (gpd.GeoDataFrame): GeoDataFrame containing country border data.
+            border_service (BorderService): The indexed country border data.
+            result_backend_type (str): The result backend of the KDE polygons, defaults to RESULT_BACKEND in the .env file.
+            instrumentation (KdeInstrumentation, optional): Records the time and memory use of the stages, e.g. for the whole run in the KdeHandler.
+            progressive (bool): Whether the KDE is first previewed from a subsample and then refined until its contours stop changing,
+                defaults to PROGRESSIVE_KDE in the .env file.
+            temporal (str): The time step of the spatio-temporal KDE (month, weekday or hour_of_week) or no, defaults to TEMPORAL_KDE in the .env file.
+            temporal_bandwidth (float or str): The temporal bandwidth in time slices, defaults to TEMPORAL_BANDWIDTH in the .env file.
+            bootstrap (int or str): The amount of bootstrap replicates of the confidence bands, 0 for none, defaults to BOOTSTRAP_REPLICATES in the .env file.
+            shared_grid (bool): Whether both countries are evaluated on one mesh grid covering the whole pair and the combined density,
+                log-ratio and difference surfaces of the pair are created, defaults to SHARED_PAIR_GRID in the .env file.
+            tree_tuning (str or float): The maximum relative error of the density with tuned tree settings, or no for the defaults of
+                KernelDensity, defaults to KDE_TREE_TUNING in the .env file.
+            writer (BackgroundWriter, optional): Writes the figures and results of the pair, they are written right away if not given.
+            extent (str): How the extent of the countries' mesh grids is chosen (bounds, quantile or border), defaults to EXTENT_METHOD in the .env file.
+            max_cells (int or str): The maximum amount of cells of a mesh grid, 0 for no maximum, defaults to MAX_GRID_CELLS in the .env file.
+            drop_outliers (bool): Whether the points outside the extent are left out of the KDE, defaults to DROP_EXTENT_OUTLIERS in the .env file.
+            kde_engine (str): The engine of the KDE (mesh or hexagonal), defaults to KDE_ENGINE in the .env file.
+            h3_resolution (int or str): The H3 resolution of the hexagonal KDE or auto, defaults to H3_RESOLUTION in the .env file.
         """
 
         self.country_1_coordinates = country_1_coordinates
@@ -72,7 +139,31 @@ class KdeVisualizer():
         self.extent_of_kde_analysis = extent_of_kde_analysis
         self.movement_limit = movement_limit
         self.program_epsg = program_epsg
-        self.border_data = border_data
+        self.border_service = border_service
+        self.grid_store = DensityGridStore(self.program_epsg)
+        self.geometry_output = GeometryOutput(mesh_step = 2000)
+        self.tree_tuner = None if str(tree_tuning) == 'no' else KdeTreeTuner(tree_tuning)
+        self.engine = KdeEngine(self.analysis_bandwidth, self.kernel_type, self.metric_type, self.program_epsg, self.border_service, self.geometry_output, tree_tuner = self.tree_tuner,
+                                extent_method = extent, extent_quantile = extent_quantile, max_cells = max_cells, drop_outliers = drop_outliers)
+        self.result_backend_type = result_backend_type
+        self.result_backend = create_result_backend(self.result_backend_type, self.geometry_output)
+        self.instrumentation = KdeInstrumentation() if instrumentation is None else instrumentation
+        self.progressive_kde = ProgressiveKde(self.engine) if progressive else None
+        self.spatiotemporal_kde = None if temporal == 'no' else SpatioTemporalKde(self.analysis_bandwidth, temporal_bandwidth, temporal, self.kernel_type, self.metric_type, self.engine.mesh_step, self.engine.mesh_margin)
+        self.bootstrap_kde = BootstrapKde(self.engine, bootstrap) if int(bootstrap) > 0 else None
+        self.bootstrap_bands = {}
+        self.hexagonal_kde = HexagonalKde(self.engine, h3_resolution) if kde_engine == 'hexagonal' else None
+        self.parameters = run_parameters(self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type, temporal = temporal,
+                                         temporal_bandwidth = temporal_bandwidth, bootstrap = bootstrap, shared_grid = shared_grid,
+                                         drop_outliers = drop_outliers, kde_engine = kde_engine, h3_resolution = h3_resolution,
+                                         progressive = progressive, tree_tuning = tree_tuning, extent = extent, max_cells = max_cells)
+        self.country_1_coordinates = self.__guard_extent(self.country_1_coordinates)
+        self.country_2_coordinates = self.__guard_extent(self.country_2_coordinates)
+        self.shared_grid = shared_grid
+        self.grid_bounds = self.engine.pair_grid_bounds(self.country_1_coordinates, self.country_2_coordinates) if shared_grid else None
+        self.density_grids = {}
+        self.writer = BackgroundWriter(0) if writer is None else writer
+        self.output_futures = []
 
         print("Visualization starting...")
         print(' ')   
@@ -87,7 +178,9 @@ class KdeVisualizer():
         Initialize and perform KDE visualization for the country pair.
 
         This method performs the Kernel Density Estimation (KDE) visualization for each country in the country pair. 
-        It calculates KDE plots, saves them as polygons to Geopackage files, clips the plots with country borders, and merges the country polygons.
+        It calculates KDE plots, converts them to polygons, clips the plots with country borders, merges the country polygons 
+        and saves all the polygons of the country pair at once with the result backend. Every stage is measured with the instrumentation,
+        the plots are shown outside of the measured stages so that the time the plot windows are open is not counted.
 
         Args:
             bw (int): Bandwidth for the KDE visualization.
@@ -95,149 +188,368 @@ class KdeVisualizer():
 
         # The first country
         self.kde1, self.contour1 = self.__kde_plot(self.country_1_coordinates, bw)
+        self.__auto_show_plot()
         print("KDE plot done for the first country.")
         print(' ')
-        self.country_1_file_name = self.__kde_to_gpkg(self.contour1, self.country_1_coordinates)
-        print("KDE plot of the first country saved as polygons to .gpkg.")
+        with self.instrumentation.stage('polygons', country = self.country1_id) as counts:
+            self.country_1_polygons = self.__kde_to_polygons(self.contour1, self.country_1_coordinates)
+            counts['polygons'] = len(self.country_1_polygons)
+        print("KDE plot of the first country converted to polygons.")
         print(' ')
         self.selected_regions_1 = self.__select_region(self.country_1_coordinates)
         print("Region selected for the first country.")
         print(' ')
-        self.country_1_plot = self.__read_geo_file(self.country_1_coordinates, self.country_1_file_name, self.selected_regions_1)
-        print("Clipped plot of the first country saved.")
+        with self.instrumentation.stage('clip', country = self.country1_id) as counts:
+            self.country_1_plot = self.__clip_to_region(self.country_1_polygons, self.selected_regions_1)
+            counts['polygons'] = len(self.country_1_plot)
+        print("Plot of the first country clipped.")
         print(' ')
         print('_____________________________________________________________')
 
         # The second country
         self.kde2, self.contour2 = self.__kde_plot(self.country_2_coordinates, bw)
+        self.__auto_show_plot()
         print("KDE plot done for the second country.")
         print(' ')
-        self.country_2_file_name = self.__kde_to_gpkg(self.contour2, self.country_2_coordinates)
-        print("KDE plot of the second country saved as polygons to .gpkg.")
+        with self.instrumentation.stage('polygons', country = self.country2_id) as counts:
+            self.country_2_polygons = self.__kde_to_polygons(self.contour2, self.country_2_coordinates)
+            counts['polygons'] = len(self.country_2_polygons)
+        print("KDE plot of the second country converted to polygons.")
         print(' ')
         self.selected_regions_2 = self.__select_region(self.country_2_coordinates)
         print("Region selected for the second country.")
         print(' ')
-        self.country_2_plot = self.__read_geo_file(self.country_2_coordinates, self.country_2_file_name, self.selected_regions_2)
-        print("Clipped plot of the second country saved.")
+        with self.instrumentation.stage('clip', country = self.country2_id) as counts:
+            self.country_2_plot = self.__clip_to_region(self.country_2_polygons, self.selected_regions_2)
+            counts['polygons'] = len(self.country_2_plot)
+        print("Plot of the second country clipped.")
         print(' ')
 
+        # The surfaces derived from the density grids of both countries
+        if self.shared_grid:
+            with self.instrumentation.stage('pair_surfaces'):
+                self.__pair_surfaces()
+            print("Combined, log-ratio and difference surfaces of the pair saved.")
+            print(' ')
+
         # Merging together country 1 and country 2
-        self.__merge_clipped_layer(self.country_1_plot, self.country_2_plot, self.selected_regions_1, self.selected_regions_2)
+        with self.instrumentation.stage('render'):
+            self.__merge_clipped_layer(self.country_1_plot, self.country_2_plot, self.selected_regions_1, self.selected_regions_2)
+        self.__auto_show_plot()
         print("Merging of the countries done!")
+        print(' ')
+
+        with self.instrumentation.stage('save_results'):
+            self.__save_results()
+        print(f"KDE polygons of the country pair passed to the {self.result_backend_type} result backend.")
         
     
+    def __guard_extent(self, country):
+
+        """
+        Sets the extent of a country's mesh grid with the KDE engine and reports the points outside of it.
+
+        Args:
+            country (CountryPoints): The points of the country.
+
+        Returns:
+            CountryPoints: The points of the country with the extent set, without the outliers if they are dropped.
+        """
+
+        with self.instrumentation.stage('extent', country = country.country_id, points = len(country)) as counts:
+            guarded, report = self.engine.guard_extent(country)
+            counts.update({'outliers': report['outliers'], 'dropped': report['dropped'], 'cells': report['cells']})
+
+        if report['outliers'] > 0 or report['cells'] < report['raw_cells']:
+            handling = 'left out of the KDE' if report['dropped'] else 'kept in the KDE but not in the mesh grid'
+            if self.hexagonal_kde is not None and not report['dropped']:
+                handling = 'kept in the hexagonal KDE'
+            print(f"{country.country_id}: {report['outliers']} of {report['points']} points are outside the extent of the mesh grid and {handling}, "
+                  f"the grid has {report['cells']} cells instead of {report['raw_cells']}.")
+
+        return guarded
+
+
     def __kde_plot(self, country, bw):
 
         """
         Perform the KDE plot for a specific country.
 
         This method performs the Kernel Density Estimation (KDE) plot for a specific country, based on the given bandwidth.
+        The log-density grid is saved to the density grid store so that it can be re-contoured later without recomputing the KDE.
+        In the progressive mode a preview of the KDE from a subsample is saved first, and the grid is refined after it.
+        With the shared grid the mesh grid covers the points of both countries of the pair instead of the country's own points.
+        With the spatio-temporal KDE the density grids of the time slices are computed and saved as well,
+        and with the bootstrap the confidence bands of the contours. The hexagonal KDE has no mesh grid, its plot is made by __hexagonal_plot.
 
         Args:
-            country (gpd.GeoDataFrame): GeoDataFrame for the country.
+            country (CountryPoints): The points of the country.
             bw (int): Bandwidth for the KDE analysis.
 
         Returns:
             tuple: A tuple containing the KDE model and the contour plot.
         """
-        # Create a KDE model with the specified bandwidth, kernel type, and metric type.
-        kde = KernelDensity(bandwidth=bw, kernel=f"{self.kernel_type}", metric = f"{self.metric_type}")
+        country_id = country.country_id
+
+        if self.hexagonal_kde is not None:
+            return self.__hexagonal_plot(country)
+
+        # Fit the KDE model and calculate the log density on the mesh grid with the KDE engine.
+        with self.instrumentation.stage('kde_grid', country = country_id, points = len(country)) as counts:
+            if self.progressive_kde is None:
+                pred_grid, x_mesh, y_mesh, kde = self.engine.density_grid(country, bounds = self.grid_bounds)
+
+            else:
+                publish = lambda *preview: self.__save_preview(country, *preview)
+                pred_grid, x_mesh, y_mesh, kde = self.progressive_kde.density_grid(country, publish, self.grid_bounds)
+                counts['used_points'] = self.progressive_kde.steps[-1]['points']
+            counts['cells'] = pred_grid.size
+        self.density_grids[country_id] = (pred_grid, x_mesh, y_mesh, len(country))
+
+        # Save the log-density grid with its georeferencing to the density grid store.
+        with self.instrumentation.stage('grid_store', country = country_id):
+            self.grid_store.save_grid(self.cntr_od, country_id, pred_grid, (x_mesh[0, 0], y_mesh[0, 0]), self.engine.mesh_step,
+                                      self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type, self.__grid_variant())
+
+        if self.spatiotemporal_kde is not None:
+            with self.instrumentation.stage('temporal_grids', country = country_id, points = len(country)) as counts:
+                self.__temporal_grids(country)
+                counts['slices'] = len(self.spatiotemporal_kde.slice_labels)
+
+        if self.bootstrap_kde is not None:
+            with self.instrumentation.stage('bootstrap', country = country_id, replicates = self.bootstrap_kde.replicates):
+                self.bootstrap_bands[country_id] = self.__bootstrap_bands(country, pred_grid.max())
+
+        with self.instrumentation.stage('contour', country = country_id):
+            # Create a plot of the country's points straight from their coordinates.
+            fig, ax = plt.subplots(figsize=(15, 15))
+            ax.set_aspect('equal')
+            ax.scatter(country.xy[:, 0], country.xy[:, 1], s=.01, color='k', zorder=2)
+
+            # Create a contour plot on the plot of the country, using the calculated mesh grid and density values.
+            contour1, self.levels = self.engine.contour(pred_grid, x_mesh, y_mesh, ax = ax)
+
+            # The plot shows the mesh grid, not the outliers outside of it.
+            ax.set_xlim(x_mesh[0, 0], x_mesh[0, -1])
+            ax.set_ylim(y_mesh[0, 0], y_mesh[-1, 0])
+
+        # Return the KDE model and the contour plot as a tuple.
+        return kde, contour1
+    
+
+    def __hexagonal_plot(self, country):
+
+        """
+        Perform the KDE plot for a specific country with the hexagonal KDE.
 
-        # Fit the KDE model to the coordinates of the given country.
-        kde.fit(country.get_coordinates().values)
+        The points are aggregated to H3 cells and smoothed over the k-rings of the occupied cells, and the polygons of the contour
+        levels are the unions of the cells within each level. They are drawn on the plot of the country's points. There is no
+        mesh grid, so nothing is saved to the density grid store.
 
-        # Determine the bounding box of the country's geometry.
-        bds = country.total_bounds
+        Args:
+            country (CountryPoints): The points of the country.
 
-        # Create a mesh grid of x and y values based on the bounding box with added margins.
-        x_mesh, y_mesh = np.meshgrid(
-        np.arange(bds[0]-50000, bds[2]+50000, 2000),
-        np.arange(bds[1]-50000, bds[3]+50000, 2000),
-        )
+        Returns:
+            tuple: None for the KDE model, as there is no fitted model, and the KDE polygons in place of the contour plot.
+        """
 
-        # Calculate the log density for each point on the mesh grid using the KDE model.
-        pred  = kde.score_samples(np.vstack([x_mesh.flatten(), y_mesh.flatten()]).T)
+        country_id = country.country_id
 
-        # Define levels for contour plotting.
-        levels = np.linspace(-30, pred.max(), 20)
+        with self.instrumentation.stage('hex_kde', country = country_id, points = len(country)) as counts:
+            cells, cell_counts = self.hexagonal_kde.cell_counts(country)
+            cells, log_density = self.hexagonal_kde.density(cells, cell_counts)
+            counts.update({'resolution': self.hexagonal_kde.resolution, 'occupied_cells': len(cell_counts), 'cells': len(cells)})
 
-        # Create a plot of the country's geometry.
-        ax = country.plot(zorder=2, markersize=.01, figsize=(15, 15), color='k')
+        with self.instrumentation.stage('contour', country = country_id):
+            kde_polygons = self.hexagonal_kde.contour_to_polygons(cells, log_density)
+            _, self.levels = contour_levels(log_density.max())
 
-        # Create a contour plot using the calculated mesh grid and density values.
-        contour1 = plt.contourf(x_mesh, y_mesh, pred.reshape(x_mesh.shape), levels=levels)
+            fig, ax = plt.subplots(figsize=(15, 15))
+            ax.set_aspect('equal')
+            ax.scatter(country.xy[:, 0], country.xy[:, 1], s=.01, color='k', zorder=2)
+            kde_polygons.plot(column = 'level', cmap = 'viridis_r', ax = ax)
 
-        self.__auto_show_plot()
+        return None, kde_polygons
 
-        # Return the KDE model and the contour plot as a tuple.
-        return kde, contour1
-    
 
-    def __kde_to_gpkg(self, kde, country):
+    def __save_preview(self, country, pred_grid, x_mesh, y_mesh, points):
 
         """
-        Save KDE plots contours to a GeoPackage file.
+        Saves the preview plot of a country's KDE from a subsample in the progressive mode.
 
-        This method saves the KDE plot contours to a GeoPackage (.gpkg) file for a specific country.
-        This function is made by Håvard Aagesen which I have more or less copied.
+        The preview is drawn on its own off-screen figure, so that it is saved without showing a plot window before the KDE is refined.
 
         Args:
-            kde (KernelDensity): The Kernel Density Estimation model.
-            country (gpd.GeoDataFrame): GeoDataFrame for the country.
+            country (CountryPoints): The points of the country.
+            pred_grid (np.ndarray): The log-density grid of the preview.
+            x_mesh (np.ndarray): The x mesh grid.
+            y_mesh (np.ndarray): The y mesh grid.
+            points (int): The amount of points of the preview's subsample.
+        """
+
+        country_id = country.country_id
+
+        figure = Figure(figsize=(10, 10))
+        ax = figure.add_subplot()
+        self.engine.contour(pred_grid, x_mesh, y_mesh, ax = ax)
+        self.border_service.country(country_id).plot(ax = ax, facecolor = 'none', edgecolor = 'black')
+        ax.set_title(f'{country_id} preview from {points} of {len(country)} points')
+        ax.axis('off')
+
+        preview_path = f'{output_folder_path}{output_all_path}{self.cntr_od}_{country_id}_{parameter_stem(self.parameters)}_preview.png'
+        figure.savefig(preview_path, bbox_inches='tight', dpi = 100)
+        print(f'Preview of {country_id} from {points} of {len(country)} points saved to {preview_path}')
+
+
+    def __pair_surfaces(self):
+
+        """
+        Creates the combined density, log-ratio and difference surfaces of the pair from the density grids of both countries.
+
+        The surfaces are saved to the density grid store with the country pair as their country, and drawn side by side on one
+        off-screen figure. The log-ratio and the difference are drawn with a diverging colormap centered on zero, so that the
+        areas where the mobility of the first country is relatively denser are red and those of the second country blue.
 
         Returns:
-            str: The filename of the saved .gpkg file.
-        """
- 
-        self.levels = [0.05, 0.10, 0.15, 0.20, 0.25, 0.30, 0.35, 0.40, 0.45, 0.50, 0.55, 0.60, 0.65, 0.70, 0.75, 0.80, 0.85, 0.90, 0.95, 1][::-1]      
-
-        level_polygons = []
-        i = 0
-        for col in kde.collections:
-            paths = []
-            # Loop through all polygons that have the same intensity level
-            for contour in col.get_paths(): 
-                # Create a polygon for the countour
-                # First polygon is the main countour, the rest are holes
-                for ncp,cp in enumerate(contour.to_polygons()):
-                    x = cp[:,0]
-                    y = cp[:,1]
-                    new_shape = Polygon([(i[0], i[1]) for i in zip(x,y)])
-                    if ncp == 0:
-                        poly = new_shape
-                    else:
-                        # Remove holes, if any
-                        poly = poly.difference(new_shape)
-
-                # Append polygon to list
-                paths.append(poly)
-            # Create a MultiPolygon for the contour
-            multi = MultiPolygon(paths)
-            # Append MultiPolygon and level as tuple to list
-            level_polygons.append((self.levels[i], multi))
-            i+=1
-
-        # Create DataFrame
-        df_of_polygons = pd.DataFrame(level_polygons, columns =['level', 'geometry'])
-        # Convert to a GeoDataFrame
-        gdf_of_polygons = gpd.GeoDataFrame(df_of_polygons, geometry='geometry', crs = country.crs)
-        # Set CRS for geometric operation
-
-        #gdf_of_polygons = gdf_of_polygons.to_crs(epsg=3035) 
-        gdf_of_polygons = gdf_of_polygons.to_crs(epsg = self.program_epsg)
-        # Calculate area
-        gdf_of_polygons['area'] = gdf_of_polygons['geometry'].area
-
-        # File name 
-        country_id = country.iloc[0]['country_name']
-
-        filename = f'geo_file_for_country_{country_id}_in_country_pair_{self.cntr_od}_{self.analysis_bandwidth}BW_{self.movement_limit}movelimit_{self.kernel_type}_{self.metric_type}.gpkg'
-        #file_path = f'{output_folder_path}{output_all_path}{filename}' 
-        file_path = f'{output_folder_path}{output_all_path}{filename}' 
-        gdf_of_polygons.to_file(file_path, driver='GPKG')
-
-        return filename
+            str: The path of the figure of the surfaces.
+        """
+
+        pred_grid_1, x_mesh, y_mesh, points_1 = self.density_grids[self.country1_id]
+        pred_grid_2, _, _, points_2 = self.density_grids[self.country2_id]
+        surfaces = pair_surfaces(pred_grid_1, pred_grid_2, points_1, points_2)
+
+        for name, surface in surfaces.items():
+            self.grid_store.save_grid(self.cntr_od, self.cntr_od, surface, (x_mesh[0, 0], y_mesh[0, 0]), self.engine.mesh_step,
+                                      self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type, self.__grid_variant(name))
+
+        regions = [self.border_service.country(self.country1_id), self.border_service.country(self.country2_id)]
+        extent = (x_mesh[0, 0], x_mesh[0, -1], y_mesh[0, 0], y_mesh[-1, 0])
+        titles = {'combined': 'Combined log-density',
+                  'log_ratio': f'Log-ratio {self.country1_id} / {self.country2_id}',
+                  'difference': f'Density difference {self.country1_id} - {self.country2_id} per km²'}
+
+        figure = Figure(figsize = (18, 7), layout = 'constrained')
+        for number, name in enumerate(surface_names):
+            ax = figure.add_subplot(1, len(surface_names), number + 1)
+            surface = surfaces[name]
+
+            if name == 'combined':
+                image = ax.imshow(surface, origin = 'lower', extent = extent, cmap = 'inferno', vmin = contour_floor, vmax = surface.max())
+
+            else:
+                # The color scale is cut at the 99th percentile, so that the few extreme ratios at the edges do not hide the rest.
+                limit = np.nanpercentile(np.abs(surface), 99) if np.isfinite(surface).any() else 1
+                image = ax.imshow(surface, origin = 'lower', extent = extent, cmap = 'RdBu_r', vmin = -limit, vmax = limit)
+
+            for region in regions:
+                region.plot(ax = ax, facecolor = 'none', edgecolor = 'black', linewidth = 0.5)
+            figure.colorbar(image, ax = ax, shrink = 0.7)
+            ax.set_xlim(extent[:2])
+            ax.set_ylim(extent[2:])
+            ax.set_title(titles[name])
+            ax.axis('off')
+
+        surfaces_path = f'{output_folder_path}{output_all_path}{self.cntr_od}_{parameter_stem(self.parameters)}_pair_surfaces.png'
+        self.output_futures.append(self.__queue_figure('pair surfaces figure', figure, surfaces_path, 150))
+
+        return surfaces_path
+
+
+    def __temporal_grids(self, country):
+
+        """
+        Computes the density grids of a country's time slices with the spatio-temporal KDE and saves them to the density grid store.
+
+        The time slices are also drawn side by side on one off-screen figure with the same colors for the same log-density,
+        so that the changes of the mobility between the time slices can be seen at a glance.
+
+        Args:
+            country (CountryPoints): The points of the country.
+
+        Returns:
+            str: The path of the figure of the time slices.
+        """
+
+        country_id = country.country_id
+        temporal_kde = self.spatiotemporal_kde
+        pred_grids, x_mesh, y_mesh, slice_counts = temporal_kde.density_grids(country, self.grid_bounds)
+        for label, pred_grid in zip(temporal_kde.slice_labels, pred_grids):
+            self.grid_store.save_grid(self.cntr_od, country_id, pred_grid, (x_mesh[0, 0], y_mesh[0, 0]), temporal_kde.mesh_step,
+                                      self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type, self.__grid_variant(label))
+
+        # Weekdays are drawn in rows with the hours in columns, and the months in rows of four.
+        columns = {12: 4, 7: 7, 168: 24}[len(pred_grids)]
+        rows = math.ceil(len(pred_grids) / columns)
+        border_lines = [np.asarray(line.coords) for line in shapely.get_parts(self.border_service.country_geometry(country_id).boundary)]
+        extent = (x_mesh[0, 0], x_mesh[0, -1], y_mesh[0, 0], y_mesh[-1, 0])
+
+        figure = Figure(figsize = (2 * columns, 2 * rows), layout = 'constrained')
+        for number, (label, pred_grid, slice_count) in enumerate(zip(temporal_kde.slice_labels, pred_grids, slice_counts)):
+            ax = figure.add_subplot(rows, columns, number + 1)
+            ax.imshow(pred_grid, origin = 'lower', extent = extent, cmap = 'inferno', vmin = contour_floor, vmax = pred_grids.max())
+            ax.add_collection(LineCollection(border_lines, colors = 'white', linewidths = 0.3))
+            ax.set_title(f'{label} ({slice_count})', fontsize = 8)
+            ax.axis('off')
+        figure.suptitle(f'{country_id} by {temporal_kde.time_step}, {temporal_kde.temporal_bandwidth:g} time slice temporal bandwidth')
+
+        temporal_path = f'{output_folder_path}{output_all_path}{self.cntr_od}_{country_id}_{parameter_stem(self.parameters)}_time_slices.png'
+        self.output_futures.append(self.__queue_figure(f'{temporal_kde.time_step} figure of {country_id}', figure, temporal_path, 100))
+        print(f'Density grids of {len(pred_grids)} time slices of {country_id} saved, overview queued to {temporal_path}')
+
+        return temporal_path
+
+
+    def __bootstrap_bands(self, country, pred_max):
+
+        """
+        Computes the bootstrap confidence bands of a country's contours.
+
+        The quantile grids are saved to the density grid store and the lower and upper bound polygons of every contour level
+        are clipped with the country's border like the KDE polygons.
+
+        Args:
+            country (CountryPoints): The points of the country.
+            pred_max (float): The highest log-density of the country's KDE.
+
+        Returns:
+            tuple: The clipped lower and upper bound polygons of the contour levels.
+        """
+
+        country_id = country.country_id
+        quantile_grids, x_mesh, y_mesh = self.bootstrap_kde.quantile_grids(country, self.grid_bounds)
+
+        for quantile, quantile_grid in zip(self.bootstrap_kde.quantiles, quantile_grids):
+            self.grid_store.save_grid(self.cntr_od, country_id, quantile_grid, (x_mesh[0, 0], y_mesh[0, 0]), self.engine.mesh_step,
+                                      self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type,
+                                      self.__grid_variant(f'q{round(quantile * 100):02d}'))
+
+        lower, upper = self.bootstrap_kde.band_polygons(quantile_grids, x_mesh, y_mesh, pred_max)
+        region = self.border_service.country(country_id)
+
+        return self.engine.clip_to_region(lower, region), self.engine.clip_to_region(upper, region)
+
+
+    def __kde_to_polygons(self, kde, country):
+
+        """
+        Convert KDE plots contours to polygons.
+
+        This method converts the KDE plot contours of a specific country to polygons. The polygons are snapped 
+        to a precision grid of the mesh and validated by the GeometryOutput class. The polygons of the hexagonal KDE
+        are already made from its cells, so they are returned as they are.
+
+        Args:
+            kde (QuadContourSet or gpd.GeoDataFrame): The contour plot of the KDE, or the polygons of the hexagonal KDE.
+            country (CountryPoints): The points of the country.
+
+        Returns:
+            gpd.GeoDataFrame: The KDE polygons with their levels and areas.
+        """
+
+        if self.hexagonal_kde is not None:
+            return kde
+
+        return self.engine.contour_to_polygons(kde, self.levels)
 
 
     def __select_region(self, country):
@@ -245,51 +557,41 @@ class KdeVisualizer():
         """
         Selects border polygons for the specific country from the imported border data.
 
-        This method selects the border polygons for the specific country from the imported border data 
-        and sets the epsg of the polygon to the same as the whole program.
+        This method selects the border polygons for the specific country from the border service, 
+        where the border data is already indexed by country and in the same epsg as the whole program.
 
         Args:
-            country (gpd.GeoDataFrame): GeoDataFrame for the country.
+            country (CountryPoints): The points of the country.
 
         Returns:
             gpd.GeoDataFrame: GeoDataFrame containing selected border polygons.
         """
 
-        country_abb = country.iloc[0]['country_name']
+        country_abb = country.country_id
 
         # Selects the country borders polygon based on the country abbreviation
-        self.selected_regions = self.border_data.loc[self.border_data['CNTR_OD'].isin([country_abb])]
-        self.selected_regions = self.selected_regions.reset_index(drop=True)
-        self.selected_regions.set_crs(self.program_epsg)
-        self.selected_regions.to_crs(epsg = self.program_epsg)
+        self.selected_regions = self.border_service.country(country_abb)
 
         return self.selected_regions
 
 
-    def __read_geo_file(self, country, filename, region):
+    def __clip_to_region(self, kde_polygons, region):
 
         """
-        Reads a GeoPackage file and performs intersection with the region.
+        Performs intersection of a country's KDE polygons with the region.
 
-        This method reads in the above created GeoPackage of a country's kde polygons and       
-        performs an intersection with the country's border data polygon so that only the kde polygons which         
-        are within the country's border polygon is saved and returned as a clipped layer
+        This method performs an intersection of the above created country's kde polygons with the country's border data polygon 
+        so that only the kde polygons which are within the country's border polygon is saved and returned as a clipped layer
 
         Args:
-            country (gpd.GeoDataFrame): GeoDataFrame for the country.
-            filename (str): Filename of the GeoPackage file.
+            kde_polygons (gpd.GeoDataFrame): The KDE polygons of the country.
             region (gpd.GeoDataFrame): GeoDataFrame representing the selected region.
 
         Returns:
             gpd.GeoDataFrame: Clipped GeoDataFrame after intersection.
         """
 
-        file_path = f'{output_folder_path}{output_all_path}{filename}'
-
-        kde_vector_layer = gpd.read_file(file_path)
-        clipped_layer = gpd.overlay(kde_vector_layer, region, how='intersection')
-
-        return clipped_layer
+        return self.engine.clip_to_region(kde_polygons, region)
     
 
     def __merge_clipped_layer(self, clipped_layer1, clipped_layer2, region1, region2):
@@ -297,7 +599,7 @@ class KdeVisualizer():
         """
         Merges two clipped layers and creates a visualization.
 
-        This method merges the two countries' clipped layers, creates a visualization, and saves the result as a GeoPackage file.
+        This method merges the two countries' clipped layers, creates a visualization and queues it to the writer to be saved as a .png file.
 
         Args:
             clipped_layer1 (gpd.GeoDataFrame): Clipped GeoDataFrame for the first country.
@@ -312,12 +614,17 @@ class KdeVisualizer():
         self.full_country_name1 = self.unique_countries[0]
         self.full_country_name2 = self.unique_countries[1]
 
-        fig, self.ax = plt.subplots(figsize=(10, 10))
+        # Pyplot is not thread-safe, so the map is made without pyplot when it is saved on the writer's thread and not shown.
+        if self.type_of_kde_analysis == 'batch':
+            fig = Figure(figsize=(10, 10))
+            self.ax = fig.add_subplot()
+        else:
+            fig, self.ax = plt.subplots(figsize=(10, 10))
 
         self.xlim, self.ylim = self.__get_boundaries()
 
-        plt.xlim(self.xlim)
-        plt.ylim(self.ylim)
+        self.ax.set_xlim(self.xlim)
+        self.ax.set_ylim(self.ylim)
 
         region1.plot(ax=self.ax, alpha = 0.1, facecolor = 'grey', edgecolor = 'black')
         region2.plot(ax=self.ax, alpha = 0.1, facecolor = 'grey', edgecolor = 'black')
@@ -335,19 +642,82 @@ class KdeVisualizer():
 
         contextily.add_basemap(self.ax, crs = f'EPSG:{self.program_epsg}', source = contextily.providers.CartoDB.DarkMatterNoLabels)
     
-        filename = f'merged_{self.cntr_od}_{self.analysis_bandwidth}BW_{self.movement_limit}movelimit_{self.kernel_type}_{self.metric_type}.gpkg'
-        plt.savefig(f'{output_folder_path}{output_all_path}{self.cntr_od}_{self.analysis_bandwidth}BW_{self.movement_limit}movelimit_{self.kernel_type}_{self.metric_type}_darkmatter_inferno.png', bbox_inches='tight', dpi = 300)
-        file_path = f'{output_folder_path}{output_all_path}{filename}'
-            
-        self.__auto_show_plot()
-    
-        self.merged_layers.to_file(file_path, driver='GPKG')
-    
-    def __get_boundaries(self):
-        """Concatenate the two countries separte gdf to get the total bounds of the points to the plot."""
-        self.get_bounds_gdf = pd.concat([self.country_1_coordinates, self.country_2_coordinates], ignore_index=True)
+        self.plot_path = f'{output_folder_path}{output_all_path}{self.cntr_od}_{parameter_stem(self.parameters)}_darkmatter_inferno.png'
+        self.output_futures.append(self.__queue_figure('merged map', fig, self.plot_path, 300))
+
+
+    def __save_results(self):
+
+        """
+        Saves each country's KDE polygons, the merged clipped polygons of the country pair and the confidence bands of the contours
+        with the result backend in one write, which is queued to the background writer like the figures.
+        """
+
+        results = [('country', self.country1_id, self.country_1_polygons),
+                   ('country', self.country2_id, self.country_2_polygons),
+                   ('merged', None, self.merged_layers)]
 
-        self.bounds = self.get_bounds_gdf.total_bounds
+        for country_id, (lower, upper) in self.bootstrap_bands.items():
+            results += [('lower', country_id, lower), ('upper', country_id, upper)]
+
+        self.output_futures.append(self.writer.submit(self.cntr_od, 'results', self.result_backend.write_pair, self.cntr_od, results, self.parameters))
+
+
+    def __grid_variant(self, variant = None):
+
+        """
+        Returns the variant of a grid in the density grid store, the variant of the run's settings followed by that of the grid,
+        e.g. 200bootstrap_q05, so that the grids of runs with other settings are not overwritten.
+        """
+
+        variants = [part for part in (variant_stem(self.parameters), variant) if part]
+
+        return '_'.join(variants) if variants else None
+
+
+    def __queue_figure(self, description, figure, figure_path, dpi):
+
+        """
+        Queues a figure to the writer.
+
+        A figure made without pyplot is drawn and saved on the writer's thread. A pyplot figure, which is shown in the pair and all
+        modes, is drawn to a PNG on the main thread and only the PNG is written on the writer's thread, because pyplot is not thread-safe.
+
+        Returns:
+            Future: The path of the figure in a list, like the paths of the result backend.
+        """
+
+        if figure.canvas.manager is None:
+            return self.writer.submit(self.cntr_od, description, self.__save_figure, figure, figure_path, dpi)
+
+        png = io.BytesIO()
+        figure.savefig(png, format = 'png', bbox_inches='tight', dpi = dpi)
+
+        return self.writer.submit(self.cntr_od, description, self.__write_png, png.getvalue(), figure_path)
+
+
+    def __save_figure(self, figure, figure_path, dpi):
+
+        """Saves a figure made without pyplot, on the writer's thread, and returns its path in a list like the paths of the result backend."""
+
+        figure.savefig(figure_path, bbox_inches='tight', dpi = dpi)
+
+        return [figure_path]
+
+
+    def __write_png(self, png, figure_path):
+
+        """Writes a figure drawn to a PNG, on the writer's thread, and returns its path in a list like the paths of the result backend."""
+
+        with open(figure_path, 'wb') as file:
+            file.write(png)
+
+        return [figure_path]
+
+
+    def __get_boundaries(self):
+        """Get the bounds of the mesh grids of both countries to the plot, so that the outliers outside of them do not widen the map."""
+        self.bounds = pair_bounds(self.country_1_coordinates, self.country_2_coordinates)
         self.xlim = (self.bounds[0], self.bounds[2])
         self.ylim = (self.bounds[1], self.bounds[3])
 
@@ -385,8 +755,13 @@ class KdeVisualizer():
 
         In case the program iterates through all country pairs, then the plots will be automatically shut down after 3 seconds so that
         it does not have to be manually done. Otherwise, the user will close the windows if the type of the analysis is pair.
+        In a batch run nobody is there to look at the plots, so they are only saved and closed.
         """
 
+        # A shown figure must not be saved on the writer's thread at the same time.
+        if self.type_of_kde_analysis in ('pair', 'all'):
+            self.writer.flush()
+
         if self.type_of_kde_analysis == 'pair':
         
             plt.show()
@@ -398,6 +773,10 @@ class KdeVisualizer():
             plt.show()
             time.sleep(3)
             plt.close()
+
+        if self.type_of_kde_analysis == 'batch':
+
+            plt.close('all')
     
 
 
@@ -1,5 +1,8 @@
 import h3
+import numpy as np
+import pandas as pd
 
+from data_ingestion import cntr_od_column
 from get_dotenv import data_folder_path
 from get_dotenv import file_name_for_output_H3_DataHandling
 
@@ -12,9 +15,10 @@ class H3CoordinateConversion():
 
     Attributes:
         df (pd.DataFrame): The DataFrame containing H3 coordinate data.
+        save_to_csv (bool): Whether to save the converted data to a CSV file, or only keep it in converted_df.
 
     Methods:
-        __init__(self, df): Initializes the H3CoordinateConversion object with a DataFrame.
+        __init__(self, df, save_to_csv=True): Initializes the H3CoordinateConversion object with a DataFrame.
         initialize(self): Performs the H3 coordinate conversion and saves the results to a CSV file.
         create_cntr_od(self, df): Creates a new column 'CNTR_OD' in the DataFrame.
         initializing_h3_to_geo(self, df): Converts H3 coordinates to latitude and longitude coordinates.
@@ -22,16 +26,18 @@ class H3CoordinateConversion():
     """
 
 
-    def __init__(self, df):
+    def __init__(self, df, save_to_csv = True):
 
         """
         Initialize the H3CoordinateConversion object with a DataFrame.
 
         Args:
             df (pd.DataFrame): The DataFrame containing H3 grid coordinate data.
+            save_to_csv (bool): Whether to save the converted data to a CSV file, or only keep it in converted_df.
         """
 
         self.df = df
+        self.save_to_csv = save_to_csv
         self.__initialize_methods()
 
     
@@ -47,7 +53,9 @@ class H3CoordinateConversion():
 
         self.cntr_od_df = self.__create_cntr_od(self.df)
         self.converted_df = self.__converting_h3_to_geo(self.cntr_od_df)
-        self.__save_to_csv()
+
+        if self.save_to_csv:
+            self.__save_to_csv()
 
 
     def __create_cntr_od(self, df):
@@ -62,7 +70,7 @@ class H3CoordinateConversion():
             pd.DataFrame: The DataFrame with the 'CNTR_OD' column added.
         """
 
-        df['CNTR_OD'] = df.apply(lambda row: '_'.join(sorted([row['CNTR_ID_start'], row['CNTR_ID_end']])), axis=1)
+        df['CNTR_OD'] = cntr_od_column(df['CNTR_ID_start'], df['CNTR_ID_end'])
         df = df.reset_index(drop=True)
 
         return df
@@ -75,7 +83,7 @@ class H3CoordinateConversion():
 
         Convert H3 coordinates to latitude and longitude coordinates by creating four new columns into the DataFrame Lat and Lon for starting and ending points
         and then calling the h3_to_latlon function which performs the h3 libraries function h3_to_geo on the H3 coordiantes in the DataFrame which
-        returns the lat and lon which are saved to the new column in the DataFrame. 
+        returns the lat and lon which are saved to the new column in the DataFrame. Every different H3 cell is converted only once.
 
         Args:
             df (pd.DataFrame): The DataFrame containing H3 coordinate data.
@@ -84,15 +92,18 @@ class H3CoordinateConversion():
             pd.DataFrame: The DataFrame with 'start_lat', 'start_lon', 'end_lat', and 'end_lon' columns added.
         """
         
-        # Define a helper function to convert H3 coordinates to latitude and longitude.
-        def h3_to_latlon(h3_coord):
-            lat, lng = h3.h3_to_geo(h3_coord)
-            return lat, lng
+        # Define a helper function to convert the H3 coordinates of a column to latitude and longitude, once for every H3 cell.
+        def h3_to_latlon(h3_coords):
+            codes, cells = pd.factorize(h3_coords)
+            cell_latlon = np.array([h3.h3_to_geo(cell) for cell in cells] + [(np.nan, np.nan)], dtype = np.float64)
+            # The rows without an H3 cell have the code -1, so they get the missing coordinates of the last row.
+            latlon = cell_latlon[codes]
+            return latlon[:, 0], latlon[:, 1]
 
         # Apply the h3_to_latlon function to convert 'h3_grid_res10_start' and 'h3_grid_res10_end' columns.
         # Store the resulting latitude and longitude values in new columns.
-        df['start_lat'], df['start_lon'] = zip(*df['h3_grid_res10_start'].apply(h3_to_latlon))
-        df['end_lat'], df['end_lon'] = zip(*df['h3_grid_res10_end'].apply(h3_to_latlon))
+        df['start_lat'], df['start_lon'] = h3_to_latlon(df['h3_grid_res10_start'])
+        df['end_lat'], df['end_lon'] = h3_to_latlon(df['h3_grid_res10_end'])
     
         print("Converting H3 to lat lon done.")
 
@@ -0,0 +1,170 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from data_ingestion import iter_mobility_csv
+from Preprocess.read_in_data_for_preprocess import h3_parquet_columns
+from get_dotenv import data_folder_path
+from get_dotenv import file_name_for_input_H3_convertion_parquet
+from get_dotenv import file_name_for_input_H3_convertion_csv
+from get_dotenv import file_name_for_output_H3_DataHandling
+from get_dotenv import file_name_for_input_distance_calculator
+
+
+def process_chunk(stage, type_of_distance, df):
+
+    """
+    Runs the H3 conversion or the distance calculation on one chunk of the mobility data, in a worker process.
+
+    Args:
+        stage (str): The preprocessing stage, h3 or distance.
+        type_of_distance (str): The distance calculation method of the distance stage.
+        df (pd.DataFrame): The rows of the chunk.
+
+    Returns:
+        pd.DataFrame: The processed rows of the chunk.
+    """
+
+    if stage == 'h3':
+        from Preprocess.H3_coordinate_convertion_to_LatLon import H3CoordinateConversion
+        return H3CoordinateConversion(df, save_to_csv = False).converted_df
+
+    from Preprocess.distance_calculator import DistanceMeasure
+    from Preprocess.preprocess_parameters import PreprocessParameters
+    return DistanceMeasure(PreprocessParameters(type_of_distance = type_of_distance), df, save_to_csv = False).df
+
+
+class ChunkedPreprocess():
+
+    """
+    Runs the H3 conversion or the distance calculation chunk by chunk on all CPU cores and streams the results to the CSV file.
+
+    The input file is read in chunks, Parquet files batch by batch through their row groups and CSV files by row ranges, and the chunks are processed
+    in parallel in a process pool. The processed chunks are appended to the output CSV file in the order of the input, so only the
+    chunks that are being processed or waiting to be written are in memory at once. The output is written to a temporary file
+    which replaces the output file when every chunk is done.
+
+    Attributes:
+        stage (str): The preprocessing stage, h3 or distance.
+        data_type (str): The file type of the input data of the h3 stage (parquet or csv).
+        type_of_distance (str): The distance calculation method of the distance stage.
+        chunk_rows (int): About how many rows are in a chunk.
+        workers (int): The amount of worker processes.
+        input_path (str): The path of the input file.
+        output_path (str): The path of the output CSV file.
+        rows (int): The amount of processed rows.
+        chunks (int): The amount of processed chunks.
+
+    Methods:
+        __run(self): Processes the chunks in parallel and writes them in order.
+        __read_chunks(self): Reads the input file chunk by chunk.
+        __write_chunk(self, file, chunk): Appends a processed chunk to the output file.
+    """
+
+
+    def __init__(self, stage, parameters, chunk_rows = 500_000, workers = None):
+
+        """
+        Initialize the ChunkedPreprocess class and run the stage.
+
+        Args:
+            stage (str): The preprocessing stage, h3 or distance.
+            parameters (H3Questions, DistQuestions or PreprocessParameters): The data type or the distance calculation method.
+            chunk_rows (int): About how many rows are in a chunk.
+            workers (int, optional): The amount of worker processes, defaults to the amount of CPU cores.
+        """
+
+        if stage not in ['h3', 'distance']:
+            raise ValueError(f'Unknown stage {stage}, the chunked stages are h3 and distance.')
+
+        self.stage = stage
+        self.data_type = getattr(parameters, 'data_type', 'csv')
+        self.type_of_distance = getattr(parameters, 'type_of_distance', None)
+        self.chunk_rows = chunk_rows
+        self.workers = os.cpu_count() if workers is None else workers
+        self.rows = 0
+        self.chunks = 0
+
+        if self.stage == 'h3':
+            input_file = file_name_for_input_H3_convertion_parquet if self.data_type == 'parquet' else file_name_for_input_H3_convertion_csv
+            self.input_path = f'{data_folder_path}{input_file}'
+            self.output_path = f'{data_folder_path}{file_name_for_output_H3_DataHandling}'
+
+        else:
+            self.input_path = f'{data_folder_path}{file_name_for_input_distance_calculator}'
+            self.output_path = f'{data_folder_path}full_mobility_dataset_filtered_and_{self.type_of_distance}_distance.csv'
+
+        self.__run()
+
+
+    def __run(self):
+
+        """
+        Processes the chunks in the process pool and writes them to the output file in the order of the input.
+
+        At most two chunks per worker are read in ahead, so reading the input never gets far ahead of the workers and the writing.
+        """
+
+        start = time.perf_counter()
+        temporary_path = f'{self.output_path}.tmp'
+        max_in_flight = 2 * self.workers
+
+        with ProcessPoolExecutor(max_workers = self.workers) as executor, open(temporary_path, 'w', newline = '') as file:
+            in_flight = deque()
+
+            for chunk in self.__read_chunks():
+                in_flight.append(executor.submit(process_chunk, self.stage, self.type_of_distance, chunk))
+
+                if len(in_flight) >= max_in_flight:
+                    self.__write_chunk(file, in_flight.popleft().result())
+
+            while in_flight:
+                self.__write_chunk(file, in_flight.popleft().result())
+
+        os.replace(temporary_path, self.output_path)
+        print(f'{self.rows} rows processed with {self.workers} processes in {time.perf_counter() - start:.1f} s and saved to {self.output_path}')
+        print('Program has finished!')
+
+
+    def __read_chunks(self):
+
+        """
+        Reads the input file chunk by chunk.
+
+        Yields:
+            pd.DataFrame: The rows of a chunk.
+        """
+
+        if self.input_path.endswith('.parquet'):
+            parquet_file = pq.ParquetFile(self.input_path)
+            columns = h3_parquet_columns if self.stage == 'h3' else None
+            for batch in parquet_file.iter_batches(batch_size = self.chunk_rows, columns = columns):
+                yield batch.to_pandas()
+
+        else:
+            yield from iter_mobility_csv(self.input_path, self.chunk_rows)
+
+
+    def __write_chunk(self, file, chunk):
+
+        """
+        Appends a processed chunk to the output file, with the header only before the first chunk.
+
+        The H3 conversion output has the row numbers as its first column, so the row numbers of a chunk continue from the previous chunk.
+
+        Args:
+            file (file): The open output file.
+            chunk (pd.DataFrame): The processed rows of the chunk.
+        """
+
+        if self.stage == 'h3':
+            chunk.index = pd.RangeIndex(self.rows, self.rows + len(chunk))
+
+        chunk.to_csv(file, header = self.chunks == 0, index = self.stage == 'h3')
+        self.rows += len(chunk)
+        self.chunks += 1
+        print(f'Chunk {self.chunks} done, {self.rows} rows processed')
@@ -0,0 +1,213 @@
+import os
+import h3
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from Borders.border_service import get_border_service
+from data_ingestion import cntr_od_column
+from get_dotenv import data_folder_path
+from get_dotenv import file_name_for_output_country_assignment
+
+class CountryAssignment():
+
+    """
+    A class for assigning or validating the country codes of the starting and ending points with the countries' borders.
+
+    The country of every point is found with one bulk STRtree query against the border GeoPackage. When the data has H3 coordinates,
+    the country is looked up only once for each unique H3 cell and the cell to country lookups are cached on disk, so that
+    the same cells are never looked up again. Otherwise the country is looked up once for each unique lat/lon coordinate.
+
+    In the assign mode only the missing country codes are filled in. In the validate mode also the country codes which do not match
+    the country where the point is are corrected, e.g. points that are snapped into the wrong country near the border.
+
+    Attributes:
+        df (pd.DataFrame): The DataFrame containing the mobility data.
+        mode (str): Whether to only fill in the missing country codes (assign) or also correct the wrong ones (validate).
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        max_distance (float): The maximum distance in meters to the nearest country for points outside every country.
+        save_to_csv (bool): Whether to save the data to a CSV file, or only keep it in df.
+
+    Methods:
+        __init__(self, df, mode, program_epsg=3035, max_distance=2000, save_to_csv=True): Initializes the CountryAssignment object and assigns the country codes.
+        assign_country_ids(self): Assigns or validates the country codes of the starting and ending points.
+        countries_of_points(self, point): Finds the country of every starting or ending point.
+        countries_of_h3_cells(self, cells): Finds the country of every H3 cell, using the cached lookups.
+        countries_of_coordinates(self, lat, lon): Finds the country of every lat/lon coordinate.
+        update_cntr_od(self): Recreates the CNTR_OD column from the corrected country codes.
+        save_to_csv(self): Saves the data with the assigned country codes to a CSV file.
+    """
+
+
+    def __init__(self, df, mode, program_epsg = 3035, max_distance = 2000, save_to_csv = True):
+
+        """
+        Initialize the CountryAssignment object with a DataFrame and assign the country codes.
+
+        Args:
+            df (pd.DataFrame): The DataFrame containing the mobility data with H3 or lat/lon coordinates.
+            mode (str): Whether to only fill in the missing country codes (assign) or also correct the wrong ones (validate).
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            max_distance (float): The maximum distance in meters to the nearest country for points outside every country.
+            save_to_csv (bool): Whether to save the data to a CSV file, or only keep it in df.
+        """
+
+        self.df = df
+        self.save_to_csv = save_to_csv
+        self.mode = mode
+        self.program_epsg = program_epsg
+        self.max_distance = max_distance
+        self.border_service = get_border_service(self.program_epsg)
+
+        self.__initialize_methods()
+
+
+    def __initialize_methods(self):
+
+        """Assigns the country codes, recreates the CNTR_OD column and saves the data to a CSV file if asked to."""
+
+        self.__assign_country_ids()
+        self.__update_cntr_od()
+
+        if self.save_to_csv:
+            self.__save_to_csv()
+
+
+    def __assign_country_ids(self):
+
+        """
+        Assigns or validates the country codes of the starting and ending points.
+
+        A new column CNTR_ID_start_assigned or CNTR_ID_end_assigned tells which rows got a new country code.
+        Points that are in no country keep their original country code.
+        """
+
+        for point in ('start', 'end'):
+
+            column = f'CNTR_ID_{point}'
+            if column not in self.df:
+                self.df[column] = None
+
+            countries = self.__countries_of_points(point)
+            current = self.df[column].astype(object).where(self.df[column].notna(), None).to_numpy()
+            missing = pd.isna(current) | np.isin(current, ['', 'nan', 'None'])
+            found = ~pd.isna(countries)
+
+            if self.mode == 'validate':
+                assign = found & (missing | (current != countries))
+            else:
+                assign = found & missing
+
+            self.df[column] = np.where(assign, countries, current)
+            self.df[f'{column}_assigned'] = assign
+
+            print(f'{point} points: {int((assign & missing).sum())} country codes assigned, '
+                  f'{int((assign & ~missing).sum())} corrected and {int((~found).sum())} points outside every country.')
+
+        within_one_country = (self.df['CNTR_ID_start'] == self.df['CNTR_ID_end']).sum()
+        print(f'{within_one_country} rows have the starting and ending point in the same country.')
+
+
+    def __countries_of_points(self, point):
+
+        """
+        Finds the country of every starting or ending point.
+
+        Args:
+            point (str): start or end.
+
+        Returns:
+            np.ndarray: The country code of every point, None for points outside every country.
+        """
+
+        h3_column = f'h3_grid_res10_{point}'
+
+        if h3_column in self.df:
+            codes, cells = pd.factorize(self.df[h3_column])
+            countries = self.__countries_of_h3_cells(cells)
+
+        else:
+            codes, coordinates = pd.MultiIndex.from_arrays([self.df[f'{point}_lat'], self.df[f'{point}_lon']]).factorize()
+            countries = self.__countries_of_coordinates(coordinates.get_level_values(0).to_numpy(), coordinates.get_level_values(1).to_numpy())
+
+        # Rows without coordinates have the code -1.
+        countries = np.append(countries, None)
+
+        return countries[codes]
+
+
+    def __countries_of_h3_cells(self, cells):
+
+        """
+        Finds the country of every H3 cell, looking up only the cells which are not in the cache.
+
+        The cache is kept per border file, EPSG code and maximum distance to the nearest country, because the lookups depend on all of them,
+        and it is rebuilt when the border file is newer than the cache.
+
+        Args:
+            cells (pd.Index): The unique H3 cells.
+
+        Returns:
+            np.ndarray: The country code of every cell.
+        """
+
+        border_name = os.path.splitext(os.path.basename(self.border_service.source_path))[0]
+        cache_path = f'{data_folder_path}border_cache/h3_cell_countries_{border_name}_epsg{self.program_epsg}_{self.max_distance:g}m.parquet'
+
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(self.border_service.source_path):
+            cache = pd.read_parquet(cache_path)
+        else:
+            cache = pd.DataFrame({'cell': pd.Series(dtype = object), 'country': pd.Series(dtype = object)})
+
+        cached = pd.Series(cache['country'].to_numpy(), index = cache['cell'].to_numpy())
+        new_cells = cells[~cells.isin(cached.index)]
+
+        if len(new_cells) > 0:
+            lat, lon = np.array([h3.h3_to_geo(cell) for cell in new_cells]).T
+            new_countries = self.__countries_of_coordinates(lat, lon)
+
+            cache = pd.concat([cache, pd.DataFrame({'cell': new_cells.to_numpy(), 'country': new_countries})], ignore_index = True)
+            os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+            cache.to_parquet(f'{cache_path}.tmp', index = False)
+            os.replace(f'{cache_path}.tmp', cache_path)
+
+            cached = pd.Series(cache['country'].to_numpy(), index = cache['cell'].to_numpy())
+            print(f'{len(new_cells)} new H3 cells looked up, {len(cells) - len(new_cells)} found in the cache.')
+
+        return cached.reindex(cells).to_numpy()
+
+
+    def __countries_of_coordinates(self, lat, lon):
+
+        """
+        Finds the country of every lat/lon coordinate.
+
+        Args:
+            lat (np.ndarray): The latitudes.
+            lon (np.ndarray): The longitudes.
+
+        Returns:
+            np.ndarray: The country code of every coordinate.
+        """
+
+        points = gpd.GeoSeries(gpd.points_from_xy(lon, lat), crs = 4326).to_crs(epsg = self.program_epsg)
+
+        return self.border_service.countries_of_points(points.to_numpy(), self.max_distance)
+
+
+    def __update_cntr_od(self):
+
+        """Recreates the CNTR_OD column in alphabetical order from the assigned country codes, if the data has one, missing if either code is missing."""
+
+        if 'CNTR_OD' in self.df:
+            self.df['CNTR_OD'] = cntr_od_column(self.df['CNTR_ID_start'], self.df['CNTR_ID_end'])
+
+
+    def __save_to_csv(self):
+
+        """Save the data with the assigned country codes to a CSV file."""
+
+        filepath = f'{data_folder_path}{file_name_for_output_country_assignment}'
+        self.df.to_csv(filepath, index = False)
+
+        print('Program has finished!')
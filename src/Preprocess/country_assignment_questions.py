@@ -0,0 +1,80 @@
+
+class CountryAssignmentQuestions():
+
+    """
+    A class for handling questions related to assigning the country codes of the points.
+
+    This class provides methods for asking the user to specify the data type of their raw data (csv or parquet)
+    and whether the country codes are only assigned where they are missing or also validated.
+
+    Methods:
+        __init__(self): Initializes the CountryAssignmentQuestions object and prompts the user for the data type and the mode.
+        __country_assignment_questions(self): A private method to handle the process of asking the questions.
+        __data_type(self): A private method to prompt the user to choose a data type and validate the input.
+        __mode(self): A private method to prompt the user to choose the mode and validate the input.
+    """
+
+
+    def __init__(self):
+
+        """
+        Initialize the CountryAssignmentQuestions object and prompt the user for the data type and the mode.
+        """
+
+        self.__country_assignment_questions()
+
+
+    def __country_assignment_questions(self):
+
+        """
+        Handle the process of asking for the data type and the mode.
+
+        This method stores the choices in the 'data_type' and 'mode' attributes.
+        """
+
+        self.data_type = self.__data_type()
+        self.mode = self.__mode()
+
+
+    def __data_type(self):
+
+        """
+        Prompt the user to choose a data type (csv or parquet) and validate the input.
+
+        Returns:
+            str: The selected data type (csv or parquet).
+        """
+
+        while True:
+            print(' ')
+            print('Options for data types:')
+            print('csv')
+            print('parquet')
+            print(' ')
+            data_type = input('What is the data type of your raw data: ')
+
+            if data_type in ('csv', 'parquet'):
+                return data_type
+
+            else:
+                print('Invalid input')
+
+
+    def __mode(self):
+
+        """
+        Prompt the user to choose whether to only assign the missing country codes or also validate the existing ones.
+
+        Returns:
+            str: The selected mode (assign or validate).
+        """
+
+        while True:
+            print(' ')
+            mode = input('Do you want to only assign missing country codes or also correct wrong ones (assign/validate): ')
+
+            if mode in ('assign', 'validate'):
+                return mode
+
+            else:
+                print('Invalid input')
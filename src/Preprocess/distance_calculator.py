@@ -1,8 +1,6 @@
-from geopy.distance import geodesic
-from geopy.distance import great_circle
-import pandas as pd
-from math import radians, cos, sin, asin, sqrt
+import numpy as np
 
+from data_ingestion import read_mobility_csv
 from get_dotenv import data_folder_path
 from get_dotenv import file_name_for_input_distance_calculator
 
@@ -19,46 +17,49 @@ class DistanceMeasure:
     Attributes:
         type_of_distance (str): The type of distance calculation method.
         df (DataFrame): The DataFrame containing mobility data.
+        save_to_csv (bool): Whether to save the results to a CSV file, or only keep them in df.
 
     Methods:
         read_csv_for_distance_calculation: Reads the CSV file containing mobility data.
         calculate_distance: Calculates distances and saves the results in a new CSV file.
         geodesic_distance: Calculates the geodesic distance between two points.
         great_circle_distance: Calculates the great circle distance between two points.
-        haversine_distance: Calculates the haversine distance between two points.
+        haversine_distance: Calculates the haversine distances between the starting and ending points of all rows at once.
     """
 
 
-    def __init__(self, type_of_distance):
+    def __init__(self, type_of_distance, df = None, save_to_csv = True):
 
         """
         Initialize a DistanceMeasure object.
 
         Args:
             type_of_distance (str): The type of distance calculation method to use.
+            df (pd.DataFrame, optional): The mobility data, read from the CSV file in the .env file if not given.
+            save_to_csv (bool): Whether to save the results to a CSV file, or only keep them in df.
 
         Returns:
             None
         """
 
         self.type_of_distance = type_of_distance.type_of_distance
-        self.df = self.__read_csv_for_distance_calculation()
+        self.save_to_csv = save_to_csv
+        self.df = self.__read_csv_for_distance_calculation() if df is None else df
         self.__calculate_distance()
 
 
     def __read_csv_for_distance_calculation(self):
 
         """
-        Reads the CSV file containing mobility data.
+        Reads the CSV file containing mobility data with compact types for the coordinates and country codes.
 
         Returns:
             pd.DataFrame: The DataFrame containing mobility data.
         """
 
         filepath = f'{data_folder_path}{file_name_for_input_distance_calculator}'
-        df = pd.read_csv(filepath, sep = ',')
-        print(len(df))
-        print(df.head())
+        df = read_mobility_csv(filepath)
+        print(f'{len(df)} rows read in for the distance calculation.')
 
         return df
     
@@ -82,15 +83,14 @@ class DistanceMeasure:
 
         if self.type_of_distance == 'Haversine':
 
-            for index, row in self.df.iterrows():
-                distance = self.__haversine_distance(row)
-                self.df.at[index, 'distance_km'] = distance
+            self.df['distance_km'] = self.__haversine_distance(self.df)
 
 
-        file_path = f'{data_folder_path}full_mobility_dataset_filtered_and_{self.type_of_distance}_distance.csv'
+        if self.save_to_csv:
+            file_path = f'{data_folder_path}full_mobility_dataset_filtered_and_{self.type_of_distance}_distance.csv'
 
-        self.df.to_csv(file_path, index = False)
-        print("Program has finished!")
+            self.df.to_csv(file_path, index = False)
+            print("Program has finished!")
 
 
     def __geodesic_distance(self, row):
@@ -105,6 +105,9 @@ class DistanceMeasure:
             float: The calculated geodesic distance in kilometers (rounded).
         """
 
+        # geopy is only imported when it is needed, the import is cached after the first row.
+        from geopy.distance import geodesic
+
         start = (row['start_lat'], row['start_lon'])
         end = (row['end_lat'], row['end_lon'])
         distance = geodesic(start, end).kilometers
@@ -123,39 +126,43 @@ class DistanceMeasure:
             float: The calculated great circle distance in kilometers (rounded).
         """
 
+        from geopy.distance import great_circle
+
         start = (row['start_lat'], row['start_lon'])
         end = (row['end_lat'], row['end_lon'])
         distance = great_circle(start, end).kilometers
         return round(distance)
     
 
-    def __haversine_distance(self, row):
+    def __haversine_distance(self, df):
 
         """
-        Calculates the haversine distance between two points.
+        Calculates the haversine distances between the starting and ending points of all rows at once with NumPy.
 
         Args:
-            row (pd.Series): A row from the DataFrame with start and end latitude and longitude.
+            df (pd.DataFrame): The DataFrame with start and end latitude and longitude.
 
         Returns:
-            float: The calculated haversine distance in kilometers (rounded).
+            np.ndarray: The calculated haversine distances in kilometers (rounded), as integers if no coordinates are missing.
         """
 
-        LaA = radians(row['start_lat'])
-        LaB = radians(row['end_lat'])
-        LoA = radians(row['start_lon'])
-        LoB = radians(row['end_lon']) 
+        LaA = np.radians(df['start_lat'].to_numpy(dtype = np.float64))
+        LaB = np.radians(df['end_lat'].to_numpy(dtype = np.float64))
+        LoA = np.radians(df['start_lon'].to_numpy(dtype = np.float64))
+        LoB = np.radians(df['end_lon'].to_numpy(dtype = np.float64))
 
         # The "Haversine formula" is used.
         D_Lo = LoB - LoA        # Calculate the difference in longitudes (in radians).
         D_La = LaB - LaA        # Calculate the difference in latitudes (in radians).
-        P = sin(D_La / 2) ** 2 + cos(LaA) * cos(LaB) * sin(D_Lo / 2) ** 2       # Calculate the intermediate value P.
+        P = np.sin(D_La / 2) ** 2 + np.cos(LaA) * np.cos(LaB) * np.sin(D_Lo / 2) ** 2       # Calculate the intermediate value P.
 
-        Q = 2 * asin(sqrt(P))       # Calculate the central angle between the two points using the arcsine function.
+        Q = 2 * np.arcsin(np.sqrt(P))       # Calculate the central angle between the two points using the arcsine function.
         R_km = 6371         # Approximate radius of the Earth in kilometers.
 
         # Then we'll compute the outcome by multiplying the central angle with the Earth's radius.
-        return round(Q * R_km)          # Calculate and round the haversine distance in kilometers.
+        distance = np.round(Q * R_km)          # Calculate and round the haversine distance in kilometers.
+
+        return distance if np.isnan(distance).any() else distance.astype(np.int64)
 
     
 
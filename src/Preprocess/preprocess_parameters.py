@@ -0,0 +1,39 @@
+
+class PreprocessParameters():
+
+    """
+    The parameters of a preprocessing stage given without the input questions, e.g. from a batch job file.
+
+    The class has the same attributes as the H3Questions, DistQuestions and CountryAssignmentQuestions, so that it can be given
+    to the preprocessing classes instead of the input questions. An invalid parameter raises a ValueError instead of asking again.
+
+    Attributes:
+        data_type (str): The data type of the raw data (csv or parquet).
+        type_of_distance (str): The distance calculation method (Geodesic, Great Circle or Haversine).
+        mode (str): Whether to only assign missing country codes or also correct wrong ones (assign or validate).
+    """
+
+
+    def __init__(self, data_type = 'csv', type_of_distance = 'Haversine', mode = 'assign'):
+
+        """
+        Initialize and validate the preprocessing parameters.
+
+        Args:
+            data_type (str): The data type of the raw data (csv or parquet).
+            type_of_distance (str): The distance calculation method (Geodesic, Great Circle or Haversine).
+            mode (str): Whether to only assign missing country codes or also correct wrong ones (assign or validate).
+        """
+
+        self.data_type = data_type
+        self.type_of_distance = type_of_distance
+        self.mode = mode
+
+        if self.data_type not in ('csv', 'parquet'):
+            raise ValueError(f'Invalid data type {self.data_type}, the options are csv and parquet.')
+
+        if self.type_of_distance not in ('Geodesic', 'Great Circle', 'Haversine'):
+            raise ValueError(f'Invalid distance calculation {self.type_of_distance}, the options are Geodesic, Great Circle and Haversine.')
+
+        if self.mode not in ('assign', 'validate'):
+            raise ValueError(f'Invalid mode {self.mode}, the options are assign and validate.')
@@ -1,8 +1,11 @@
 import pandas as pd
+from data_ingestion import read_mobility_csv
 from get_dotenv import data_folder_path
 from get_dotenv import file_name_for_input_H3_convertion_parquet
 from get_dotenv import file_name_for_input_H3_convertion_csv
 
+# The columns of the Parquet input data of the H3 conversion.
+h3_parquet_columns = ['id', 'created_at_start', 'u_id','h3_grid_res10_start', 'place_type_start', 'h3_grid_res10_end', 'place_type_end', 'CNTR_ID_start', 'CNTR_ID_end', 'time_diff_with_prev', 'same_interreg']
 
 class ReadInDataForPreprocess():
 
@@ -57,17 +60,15 @@ class ReadInDataForPreprocess():
         - pd.DataFrame: DataFrame containing the read data.
         """
 
-        columns_to_load = ['id', 'created_at_start', 'u_id','h3_grid_res10_start', 'place_type_start', 'h3_grid_res10_end', 'place_type_end', 'CNTR_ID_start', 'CNTR_ID_end', 'time_diff_with_prev', 'same_interreg']
-
         filepath = f'{data_folder_path}{file_name_for_input_H3_convertion_parquet}'
 
-        return pd.read_parquet(filepath, columns = columns_to_load)
+        return pd.read_parquet(filepath, columns = h3_parquet_columns)
     
     
     def __read_csv_to_df(self):
 
         """
-        Reads data from a CSV file and returns a DataFrame.
+        Reads data from a CSV file with compact types for the coordinates and country codes and returns a DataFrame.
 
         Returns:
         - pd.DataFrame: DataFrame containing the read data.
@@ -75,5 +76,5 @@ class ReadInDataForPreprocess():
 
         filepath = f'{data_folder_path}{file_name_for_input_H3_convertion_csv}'
 
-        return pd.read_csv(filepath, sep = ',')
+        return read_mobility_csv(filepath)
 
@@ -0,0 +1,327 @@
+import os
+import json
+import hashlib
+import numpy as np
+import geopandas as gpd
+import shapely
+
+# The merged levels of the merged map with 10 levels, each the union of the levels up to it.
+merged_levels = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0][::-1]
+
+class IncrementalMerge():
+
+    """
+    Merges the KDE polygons of all country pairs level by level, recomputing only the parts of the map where the pairs changed.
+
+    The map is divided into square tiles. For every tile and merged level the union of the pairs' polygons inside the tile is kept
+    in a merge state on disk, together with a fingerprint and the bounds of every pair's polygons of every level. The fingerprint is
+    a hash of the polygons, so a pair whose results were computed again but did not change is not merged again. When pairs are
+    added, removed or changed, only the tiles that the old or new bounds of the changed levels overlap are merged again, and only
+    for the merged levels that those levels belong to. The merged level of the whole map is then the union of its tiles, which is
+    computed again only for the merged levels with changed tiles.
+
+    With 10 levels a merged level is the union of all levels up to it, with 20 levels every level is merged on its own, like the
+    dissolve of the merged map. The unions of the tiles are snapped to the precision grid of the KDE polygons, which the edges of the
+    tiles are on, so that the seams between the tiles disappear in the union of the whole merged level.
+
+    Attributes:
+        state_path (str): The path of the merge state without the file extension, the state is kept in a .json and a .parquet file.
+        amount_of_levels (int): The amount of merged levels, 10 or 20.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        tile_size (float): The width and height of the tiles in meters.
+        precision (float): The size of the precision grid of the merged polygons in meters.
+        merged_tiles (int): The amount of tiles and merged levels merged in the last merge, for the printouts and benchmarks.
+
+    Methods:
+        merge(self, kde_gdf, rebuild=False): Merges the KDE polygons of all country pairs.
+        fingerprints(self, kde_gdf): Returns the fingerprint and bounds of every pair's polygons of every level.
+        output_levels(self, levels): Returns the merged levels of the given levels.
+        __changed_tiles(self, previous, current, output_levels): Returns the tiles to merge again for every merged level.
+        __tiles(self, bounds): Returns the tiles that the bounds overlap.
+        __tile_box(self, tile): Returns the polygon of a tile.
+        __lower_level(self, output_level): Returns the merged level below a merged level.
+        __contributes(self, level, output_level): Whether a level belongs to a merged level.
+        __read_state(self): Reads the merge state.
+        __write_state(self, fingerprints, pieces): Writes the merge state.
+    """
+
+
+    def __init__(self, state_path, amount_of_levels, program_epsg, tile_size = 250000, precision = 20):
+
+        """
+        Initialize the IncrementalMerge class.
+
+        Args:
+            state_path (str): The path of the merge state without the file extension.
+            amount_of_levels (int): The amount of merged levels, 10 or 20.
+            program_epsg (int): The EPSG code for the program's coordinate reference system.
+            tile_size (float): The width and height of the tiles in meters.
+            precision (float): The size of the precision grid of the merged polygons in meters, the precision of the KDE polygons.
+        """
+
+        if int(amount_of_levels) not in (10, 20):
+            raise ValueError(f'Invalid amount of levels {amount_of_levels}, the options are 10 and 20.')
+
+        self.state_path = state_path
+        self.amount_of_levels = int(amount_of_levels)
+        self.program_epsg = program_epsg
+        self.tile_size = float(tile_size)
+        self.precision = float(precision)
+        self.merged_tiles = 0
+
+
+    def merge(self, kde_gdf, rebuild = False):
+
+        """
+        Merges the KDE polygons of all country pairs, only the changed tiles and merged levels if there is a merge state.
+
+        Args:
+            kde_gdf (gpd.GeoDataFrame): The merged KDE polygons of all country pairs with pair and level columns.
+            rebuild (bool): Whether the merge state is ignored and every tile is merged again.
+
+        Returns:
+            gpd.GeoDataFrame: The merged polygon of every merged level, from the highest level to the lowest.
+        """
+
+        kde_gdf = kde_gdf[['pair', 'level', 'geometry']].reset_index(drop = True)
+        current = self.fingerprints(kde_gdf)
+        previous, pieces = ({}, {}) if rebuild else self.__read_state()
+
+        previous_levels = [float(level) for levels in previous.values() for level in levels]
+        output_levels = self.output_levels(list(kde_gdf['level'].unique()) + previous_levels)
+        changed_tiles = self.__changed_tiles(previous, current, output_levels)
+
+        geometries = kde_gdf.geometry.to_numpy()
+        tree = shapely.STRtree(geometries)
+        levels = kde_gdf['level'].to_numpy(dtype = float)
+
+        # The changed merged levels of every changed tile.
+        changed_levels = {}
+        for output_level, tiles in changed_tiles.items():
+            for tile in tiles:
+                changed_levels.setdefault(tile, set()).add(output_level)
+
+        self.merged_tiles = 0
+        for tile, tile_levels in changed_levels.items():
+            # The polygons are clipped to the tile once for all of its changed merged levels.
+            tile_box = self.__tile_box(tile)
+            candidates = tree.query(tile_box)
+            clipped = shapely.intersection(geometries[candidates], tile_box)
+            candidate_levels = levels[candidates]
+
+            for output_level in sorted(tile_levels):
+                # With 10 levels the merged level is the union of the merged level below it, which is up to date because the
+                # changed merged levels of a tile are merged from the lowest up, and of the levels between the two.
+                lower_level = self.__lower_level(output_level)
+                parts = [geometry for geometry, level in zip(clipped, candidate_levels)
+                         if self.__contributes(level, output_level) and (lower_level is None or not self.__contributes(level, lower_level))]
+                if lower_level is not None and (tile, lower_level) in pieces:
+                    parts.append(pieces[(tile, lower_level)])
+
+                self.merged_tiles += 1
+                piece = shapely.set_precision(shapely.union_all(parts), self.precision) if parts else None
+                if piece is None or piece.is_empty:
+                    pieces.pop((tile, output_level), None)
+                else:
+                    pieces[(tile, output_level)] = piece
+
+        for output_level in changed_tiles:
+            # The whole merged level is the union of its tiles. The tiles are snapped to the precision grid, which the tile edges are on,
+            # so the vertices on the seams of the tiles are the same on both sides and the seams disappear in the union.
+            tile_pieces = [piece for (tile, level), piece in pieces.items() if level == output_level and tile != 'merged']
+            pieces[('merged', output_level)] = shapely.union_all(tile_pieces) if tile_pieces else shapely.Polygon()
+
+        print(f'Merged {self.merged_tiles} tiles of {len(changed_tiles)} merged levels again, {sum(len(levels) for levels in current.values())} pair levels in total')
+        self.__write_state(current, pieces)
+
+        if self.amount_of_levels == 10:
+            result_levels = merged_levels
+        else:
+            # Like the dissolve, only the levels which have polygons are in the merged map.
+            result_levels = [level for level in output_levels if not pieces.get(('merged', level), shapely.Polygon()).is_empty]
+
+        merged_done_gdf = gpd.GeoDataFrame({'level': result_levels,
+                                            'geometry': [pieces.get(('merged', level), shapely.Polygon()) for level in result_levels]},
+                                           crs = self.program_epsg)
+
+        return merged_done_gdf.sort_values(by = 'level', ascending = False)
+
+
+    def fingerprints(self, kde_gdf):
+
+        """
+        Returns the fingerprint and bounds of every pair's polygons of every level.
+
+        The fingerprint is the SHA-1 hash of the well-known binary of the polygons, so it changes only if the polygons change.
+
+        Args:
+            kde_gdf (gpd.GeoDataFrame): The KDE polygons with pair and level columns.
+
+        Returns:
+            dict: The fingerprint and bounds (minx, miny, maxx, maxy) of every level by pair and level.
+        """
+
+        kde_gdf = kde_gdf.sort_values(['pair', 'level'], kind = 'stable')
+        geometries = kde_gdf.geometry.to_numpy()
+        wkbs = shapely.to_wkb(geometries)
+        bounds = shapely.bounds(geometries)
+
+        # The rows of every pair and level are consecutive after sorting, so they are hashed as slices without grouping the GeoDataFrame.
+        keys = list(zip(kde_gdf['pair'], kde_gdf['level']))
+        starts = [0] + [row for row in range(1, len(keys)) if keys[row] != keys[row - 1]]
+
+        fingerprints = {}
+        for start, end in zip(starts, starts[1:] + [len(keys)]):
+            pair, level = keys[start]
+            level_bounds = bounds[start:end]
+            fingerprint = hashlib.sha1(b''.join(wkbs[start:end])).hexdigest()
+            fingerprints.setdefault(pair, {})[f'{level:g}'] = {'fingerprint': fingerprint,
+                                                               'bounds': [float(level_bounds[:, 0].min()), float(level_bounds[:, 1].min()),
+                                                                          float(level_bounds[:, 2].max()), float(level_bounds[:, 3].max())]}
+
+        return fingerprints
+
+
+    def output_levels(self, levels):
+
+        """
+        Returns the merged levels which the given levels belong to.
+
+        Args:
+            levels (list): The levels of the KDE polygons.
+
+        Returns:
+            list: The merged levels, from the highest to the lowest.
+        """
+
+        if self.amount_of_levels == 10:
+            return merged_levels
+
+        return sorted(set(float(level) for level in levels), reverse = True)
+
+
+    def __changed_tiles(self, previous, current, output_levels):
+
+        """
+        Returns the tiles to merge again for every merged level.
+
+        A level of a pair has changed if it was added, removed or its fingerprint is different. Its old and new bounds give the tiles
+        which are merged again for every merged level the level belongs to.
+
+        Returns:
+            dict: The set of tiles to merge again by merged level, only the merged levels with tiles to merge again.
+        """
+
+        changed_tiles = {}
+        for pair in set(previous) | set(current):
+            previous_levels = previous.get(pair, {})
+            current_levels = current.get(pair, {})
+
+            for level in set(previous_levels) | set(current_levels):
+                previous_level = previous_levels.get(level)
+                current_level = current_levels.get(level)
+                if previous_level is not None and current_level is not None and previous_level['fingerprint'] == current_level['fingerprint']:
+                    continue
+
+                tiles = set()
+                for changed_level in (previous_level, current_level):
+                    if changed_level is not None:
+                        tiles |= self.__tiles(changed_level['bounds'])
+
+                for output_level in output_levels:
+                    if self.__contributes(float(level), output_level):
+                        changed_tiles.setdefault(output_level, set()).update(tiles)
+
+        return changed_tiles
+
+
+    def __tiles(self, bounds):
+
+        """Returns the tiles, as 'column_row' strings, that the bounds overlap."""
+
+        columns = range(int(np.floor(bounds[0] / self.tile_size)), int(np.floor(bounds[2] / self.tile_size)) + 1)
+        rows = range(int(np.floor(bounds[1] / self.tile_size)), int(np.floor(bounds[3] / self.tile_size)) + 1)
+
+        return {f'{column}_{row}' for column in columns for row in rows}
+
+
+    def __tile_box(self, tile):
+
+        """Returns the polygon of a tile."""
+
+        column, row = (int(part) for part in tile.split('_'))
+
+        return shapely.box(column * self.tile_size, row * self.tile_size, (column + 1) * self.tile_size, (row + 1) * self.tile_size)
+
+
+    def __lower_level(self, output_level):
+
+        """Returns the merged level below a merged level with 10 levels, None for the lowest one and with 20 levels."""
+
+        if self.amount_of_levels == 20 or output_level == merged_levels[-1]:
+            return None
+
+        return merged_levels[merged_levels.index(output_level) + 1]
+
+
+    def __contributes(self, level, output_level):
+
+        """Whether a level belongs to a merged level, all levels up to it with 10 levels and the same level with 20 levels."""
+
+        return level <= output_level if self.amount_of_levels == 10 else level == output_level
+
+
+    def __read_state(self):
+
+        """
+        Reads the fingerprints and the merged tiles of the merge state.
+
+        The state is not used if it is missing or was created with another amount of levels, tile size, precision or EPSG code.
+
+        Returns:
+            tuple: The fingerprints by pair and level, and the merged polygons by tile and merged level.
+        """
+
+        settings = self.__settings()
+
+        if not os.path.exists(f'{self.state_path}.json') or not os.path.exists(f'{self.state_path}.parquet'):
+            return {}, {}
+
+        with open(f'{self.state_path}.json') as file:
+            state = json.load(file)
+
+        if state['settings'] != settings:
+            print(f'The merge state {self.state_path} has other settings, every tile is merged again.')
+            return {}, {}
+
+        pieces_gdf = gpd.read_parquet(f'{self.state_path}.parquet')
+        pieces = {(tile, float(level)): geometry for tile, level, geometry in zip(pieces_gdf['tile'], pieces_gdf['level'], pieces_gdf.geometry)}
+
+        return state['pairs'], pieces
+
+
+    def __write_state(self, fingerprints, pieces):
+
+        """
+        Writes the merged tiles and the fingerprints of the merge state, each to a temporary file which then replaces the state file.
+
+        The fingerprints are written last, so after a crash the tiles of the changed pairs are merged again.
+        """
+
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok = True)
+
+        pieces_gdf = gpd.GeoDataFrame({'tile': [tile for tile, level in pieces], 'level': [level for tile, level in pieces]},
+                                      geometry = list(pieces.values()), crs = self.program_epsg)
+        pieces_gdf.to_parquet(f'{self.state_path}.parquet.tmp', index = False)
+        os.replace(f'{self.state_path}.parquet.tmp', f'{self.state_path}.parquet')
+
+        with open(f'{self.state_path}.json.tmp', 'w') as file:
+            json.dump({'settings': self.__settings(), 'pairs': fingerprints}, file, indent = 2)
+        os.replace(f'{self.state_path}.json.tmp', f'{self.state_path}.json')
+
+
+    def __settings(self):
+
+        """Returns the settings which the merge state depends on."""
+
+        return {'amount_of_levels': self.amount_of_levels, 'tile_size': self.tile_size, 'precision': self.precision, 'program_epsg': self.program_epsg}
@@ -2,18 +2,74 @@ import geopandas as gpd
 import pandas as pd
 import matplotlib.pyplot as plt
 import contextily
-from shapely.geometry import MultiPolygon
 from shapely.ops import unary_union
-from matplotlib_scalebar.scalebar import ScaleBar
-import sys
+import glob
+import argparse
 import matplotlib.patches as mpatches
 
+from Borders.border_service import get_border_service
 from CountryCodes.lst_of_cntr_od import lst_of_cntr_od
-from get_dotenv import data_folder_path
+from KDE.kde_geometry_output import GeometryOutput
+from KDE.kde_result_backend import create_result_backend
+from KDE.kde_result_backend import run_parameters
+from KDE.kde_result_backend import parameter_stem
+from KDE.kde_run_manifest import KdeRunManifest
+from StandaloneKDE.incremental_merge import IncrementalMerge
 from get_dotenv import output_folder_path
-from get_dotenv import output_all_path
 from get_dotenv import output_merged_all_path
-from get_dotenv import file_name_for_gpkg
+from get_dotenv import result_backend
+
+
+def merge_and_dissolve_levels(all_kde, amount_of_levels, program_epsg):
+    """
+    Merges and dissolves the KDE polygons of country pairs by level.
+
+    Depending on the amount_of_levels specified, it either merges the data into 10 levels
+    or keeps the original levels (amount_of_levels = 20). The country pairs are concatenated at once.
+
+    Args:
+        all_kde (dict): The KDE polygons of each country pair, GeoDataFrames with a 'level' column.
+        amount_of_levels (int): Number of levels of the merged polygons, 10 or 20.
+        program_epsg (int): EPSG code for the coordinate reference system.
+
+    Returns:
+        GeoDataFrame: The dissolved polygons of the levels, from the highest level to the lowest.
+    """
+    levels = []
+    geometries = []
+
+    merged_kde_gdf = gpd.GeoDataFrame(pd.concat(list(all_kde.values()), ignore_index=True))
+    
+    dissolved_kde_gdf = merged_kde_gdf.dissolve(by='level', aggfunc='sum')
+    
+    if amount_of_levels == 10:
+        # If 10 levels are specified, merge levels into 10 predefined values.
+        merged_levels = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0][::-1]
+        for merged_level in merged_levels:
+            # Select levels up to the current merged level.
+            selected_levels = [level for level in dissolved_kde_gdf.index if level <= merged_level]
+            # Extract geometries corresponding to the selected levels.
+            selected_geometries = dissolved_kde_gdf.loc[selected_levels, 'geometry']
+            # Union the selected geometries to create a dissolved geometry for the merged level.
+            dissolved_geometry = unary_union(selected_geometries)
+            # Append the merged level and dissolved geometry to the lists.
+            levels.append(merged_level)
+            geometries.append(dissolved_geometry)
+
+    if amount_of_levels == 20:
+        # If 20 levels are specified, keep the original levels and dissolve each group.
+        for level, group in dissolved_kde_gdf.groupby('level'):
+            # Union the geometries within each level group to create a dissolved geometry.
+            dissolved_geometry = unary_union(group['geometry'])
+            # Append the original level and dissolved geometry to the lists.
+            levels.append(level)
+            geometries.append(dissolved_geometry)
+    
+    merged_done_gdf = gpd.GeoDataFrame({'level': levels, 'geometry': geometries})
+    merged_done_gdf = merged_done_gdf.sort_values(by='level', ascending=False)
+    merged_done_gdf = merged_done_gdf.set_crs(epsg = program_epsg)
+
+    return merged_done_gdf
 
 
 class MergedMapOfAllKDEs():
@@ -27,13 +83,17 @@ class MergedMapOfAllKDEs():
         metric_type (str): Type of metric for KDE analysis.
         program_epsg (int): EPSG code for the coordinate reference system.
         amount_of_levels (int): Number of levels for KDE visualization.
-        failed_list (list): List of countries that failed in the analysis.
+        failed_list (list): List of countries that failed in the analysis, read from the run manifest if not given.
 
         all_kde (dict): Dictionary to store KDE GeoDataFrames for each country pair.
-        merged_kde_gdf (GeoDataFrame): Merged GeoDataFrame for all country pairs.
+        merged_done_gdf (GeoDataFrame): The merged and dissolved KDE polygons of all country pairs by level.
+        merge_state (IncrementalMerge): The persisted merge state, which merges only the tiles of the changed country pairs again,
+            None for merging all country pairs from scratch without a state.
+        rebuild (bool): Whether the merge state is ignored and built again from all country pairs.
     """
 
-    def __init__(self, analysis_bandwidth, movement_limit, kernel_type, metric_type, program_epsg, amount_of_levels, failed_list):
+    def __init__(self, analysis_bandwidth, movement_limit, kernel_type, metric_type, program_epsg, amount_of_levels, failed_list = None,
+                 incremental = True, rebuild = False, tile_size = 250000):
         """
         Initializes the KdeAllCountryPairs class.
 
@@ -44,7 +104,12 @@ class MergedMapOfAllKDEs():
             metric_type (str): Type of metric for KDE analysis.
             program_epsg (int): EPSG code for the coordinate reference system.
             amount_of_levels (int): Number of levels for KDE visualization.
-            failed_list (list): List of countries that failed in the analysis.
+            failed_list (list, optional): List of countries that failed in the analysis. If not given, only the country pairs
+                which are done in the run manifest of the KDE parameters are merged, or all country pairs if there is no manifest.
+            incremental (bool): Whether the merge state of the KDE parameters is used, so that only the tiles of the country pairs
+                which changed since the last merge are merged again.
+            rebuild (bool): Whether the merge state is ignored and built again from all country pairs.
+            tile_size (float): The width and height of the tiles of the merge state in meters.
         """
         print('Now creating combined KDE map')
         self.analysis_bandwidth = analysis_bandwidth
@@ -57,9 +122,20 @@ class MergedMapOfAllKDEs():
         self.lux_list = ['BE_LU', 'FR_LU', 'DE_LU']
 
         self.all_kde = {}
-        self.merged_kde_gdf = gpd.GeoDataFrame()
+        # The merged levels are cumulative and overlap on purpose, so they are not cut into disjoint bands.
+        self.geometry_output = GeometryOutput(mesh_step = 2000, disjoint_levels = False)
+        self.result_backend = create_result_backend(result_backend, self.geometry_output)
+
+        self.rebuild = rebuild
+        self.merge_state = None
+        if incremental:
+            state_path = f'{output_folder_path}{output_merged_all_path}merge_state/all_countries_merged_kde_{self.__parameter_stem()}_{amount_of_levels}levels'
+            self.merge_state = IncrementalMerge(state_path, amount_of_levels, program_epsg, tile_size = tile_size, precision = self.geometry_output.precision)
 
         self.load_in_data()
+        if not self.all_kde:
+            print(f'No results of {self.__parameter_stem()} with the {result_backend} result backend, so there is nothing to merge.')
+            return
         self.load_in_gpkg()
         self.merge_and_dissolve()
         self.plot_and_save()
@@ -68,27 +144,52 @@ class MergedMapOfAllKDEs():
         """
         Loads KDE data for each country pair.
 
-        For each country in lst_of_cntr_od, checks if it's in the failed list,
-        and if not, reads the corresponding KDE data file and stores it in the all_kde dictionary.
+        For each country in lst_of_cntr_od, checks if it's in the failed list, and if not, 
+        reads the merged KDE polygons of all the remaining country pairs at once from the result backend 
+        and stores them by country pair in the all_kde dictionary, which stays empty if there are no results. The results are projected to the program's EPSG
+        only if they are in another CRS.
+
+        Without a failed list, the country pairs which are not done in the run manifest are skipped, and the country pairs which
+        are done but not in lst_of_cntr_od, e.g. pairs found from the data, are merged too. The manifests of the shards of a run
+        split over several machines are read together with the run manifest.
         """
+        parameters = self.__parameters()
+
+        done_pairs = None
+        if self.failed_list is None:
+            manifest = KdeRunManifest(parameters)
+            for shard_path in sorted(glob.glob(manifest.manifest_path.replace('.json', '_shard*of*.json'))):
+                manifest.pairs.update(KdeRunManifest(parameters, shard_path).pairs)
+            if manifest.pairs:
+                print(f'Reading the status of the country pairs from {manifest.manifest_path}')
+                done_pairs = manifest.done_pairs()
+            self.failed_list = manifest.failed_pairs()
+
         #for self.country_od in self.lux_list:
-        for self.country_od in lst_of_cntr_od:
+        pairs = []
+        found_pairs = [] if done_pairs is None else sorted(country_od for country_od in done_pairs if country_od not in lst_of_cntr_od)
+        for self.country_od in lst_of_cntr_od + found_pairs:
             if self.country_od in self.failed_list:
                 print(f'{self.country_od} is in the failed list')
+
+            elif done_pairs is not None and self.country_od not in done_pairs:
+                print(f'{self.country_od} has not been run')
             
             else:
-                filepath = f'{output_folder_path}{output_all_path}merged_{self.country_od}_{self.analysis_bandwidth}BW_{self.movement_limit}movelimit_{self.kernel_type}_{self.metric_type}.gpkg'
-                self.cntr_od_kde = gpd.read_file(filepath)
-                self.cntr_od_kde = self.cntr_od_kde.to_crs(epsg = self.program_epsg)
-                self.all_kde[self.country_od] = self.cntr_od_kde
+                pairs.append(self.country_od)
+
+        all_kde = self.result_backend.read_results(parameters, pairs, kind = 'merged', program_epsg = self.program_epsg)
+        if all_kde.crs is None or all_kde.crs.to_epsg() != self.program_epsg:
+            all_kde = all_kde.to_crs(epsg = self.program_epsg)
+
+        for country_od, cntr_od_kde in all_kde.groupby('pair', sort = False):
+            self.all_kde[country_od] = cntr_od_kde.drop(columns = 'pair').reset_index(drop = True)
 
     def load_in_gpkg(self):
         """
-        Loads border data from a GeoPackage file.
+        Loads border data of the GeoPackage file from the border service.
         """
-        filepath = f'{data_folder_path}{file_name_for_gpkg}'
-        self.border_data = gpd.read_file(filepath)
-        self.border_data = self.border_data.to_crs(epsg = self.program_epsg)
+        self.border_data = get_border_service(self.program_epsg).border_data
         #self.border_data = self.border_data.loc[self.border_data['CNTR_OD'].isin(['DE', 'BE', 'FR', 'LU'])]
 
     
@@ -96,48 +197,21 @@ class MergedMapOfAllKDEs():
         """
         Merges and dissolves KDE data for all country pairs.
 
-        Depending on the amount_of_levels specified, it either merges the data into 10 levels
-        or keeps the original levels (amount_of_levels = 20).
+        Without a merge state, all country pairs are merged with merge_and_dissolve_levels.
+        With a merge state, only the tiles and levels of the country pairs which changed since the last merge are merged again.
         """
-        levels = []
-        geometries = []
+        if self.merge_state is not None:
+            pairs_kde_gdf = pd.concat([cntr_od_kde.assign(pair = country_od) for country_od, cntr_od_kde in self.all_kde.items()], ignore_index=True)
+            self.merged_done_gdf = self.merge_state.merge(gpd.GeoDataFrame(pairs_kde_gdf, crs = self.program_epsg), rebuild = self.rebuild)
+            return
 
-        for country_od, cntr_od_kde in self.all_kde.items():
-            self.merged_kde_gdf = gpd.GeoDataFrame(pd.concat([self.merged_kde_gdf, cntr_od_kde], ignore_index=True))
-        
-        self.dissolved_kde_gdf = self.merged_kde_gdf.dissolve(by='level', aggfunc='sum')
-        
-        if self.amount_of_levels == 10:
-            # If 10 levels are specified, merge levels into 10 predefined values.
-            merged_levels = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0][::-1]
-            for merged_level in merged_levels:
-                # Select levels up to the current merged level.
-                selected_levels = [level for level in self.dissolved_kde_gdf.index if level <= merged_level]
-                # Extract geometries corresponding to the selected levels.
-                selected_geometries = self.dissolved_kde_gdf.loc[selected_levels, 'geometry']
-                # Union the selected geometries to create a dissolved geometry for the merged level.
-                dissolved_geometry = unary_union(selected_geometries)
-                # Append the merged level and dissolved geometry to the lists.
-                levels.append(merged_level)
-                geometries.append(dissolved_geometry)
+        self.merged_done_gdf = merge_and_dissolve_levels(self.all_kde, self.amount_of_levels, self.program_epsg)
 
-        if self.amount_of_levels == 20:
-            # If 20 levels are specified, keep the original levels and dissolve each group.
-            for level, group in self.dissolved_kde_gdf.groupby('level'):
-                # Union the geometries within each level group to create a dissolved geometry.
-                dissolved_geometry = unary_union(group['geometry'])
-                # Append the original level and dissolved geometry to the lists.
-                levels.append(level)
-                geometries.append(dissolved_geometry)
-        
-        self.merged_done_gdf = gpd.GeoDataFrame({'level': levels, 'geometry': geometries})
-        self.merged_done_gdf = self.merged_done_gdf.sort_values(by='level', ascending=False)
-        self.merged_done_gdf = self.merged_done_gdf.set_crs(epsg = self.program_epsg)
-        
-    
     def plot_and_save(self):
         """
         Plots and saves the combined KDE map.
+
+        The merged polygons are saved to a GeoPackage in several levels of detail.
         """
         self.fig, self.ax = plt.subplots(figsize=(10, 8))
 
@@ -157,12 +231,22 @@ class MergedMapOfAllKDEs():
         
         self.__legend()
 
-        plt.savefig(f'{output_folder_path}{output_merged_all_path}all_countries_merged_kde_{self.analysis_bandwidth}BW_{self.movement_limit}movelimit_{self.kernel_type}_{self.metric_type}_europe.png', bbox_inches='tight', dpi = 300)   
+        plt.savefig(f'{output_folder_path}{output_merged_all_path}all_countries_merged_kde_{self.__parameter_stem()}_europe.png', bbox_inches='tight', dpi = 300)   
         plt.show()
 
-        filename = f'all_countries_merged_kde_{self.analysis_bandwidth}BW_{self.movement_limit}movelimit_{self.kernel_type}_{self.metric_type}.gpkg'
+        filename = f'all_countries_merged_kde_{self.__parameter_stem()}.gpkg'
         file_path = f'{output_folder_path}{output_merged_all_path}{filename}'
-        self.merged_done_gdf.to_file(file_path, driver='GPKG')
+        self.geometry_output.write(self.merged_done_gdf, file_path)
+
+    def __parameters(self):
+        """Returns the parameters of the KDE run, with the settings and the result backend of the .env file, whose results are merged."""
+
+        return {**run_parameters(self.analysis_bandwidth, self.movement_limit, self.kernel_type, self.metric_type), 'result_backend': result_backend}
+
+    def __parameter_stem(self):
+        """Returns the KDE parameters as they are in the names of the output files."""
+
+        return parameter_stem(self.__parameters())
 
     def __get_boundaries(self):
         """Gets the boundaries for the KDE and adds 300km to it so that the map have some marginal"""
@@ -206,4 +290,22 @@ class MergedMapOfAllKDEs():
         legend.get_frame().set_alpha(0.1)
     
 
-kde_of_all_country_pairs = MergedMapOfAllKDEs('25000', '200', 'gaussian', 'euclidean', 3035, 10, ['AD_ES', 'AD_FR', 'AL_IT', 'FR_MC'])
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description = 'Merges the KDE results of all country pairs into one map, only the changed country pairs if they were merged before.')
+    parser.add_argument('--bandwidth', default = '25000', help = 'The bandwidth of the KDE results in meters.')
+    parser.add_argument('--movement-limit', default = '200', help = 'The movement limit of the KDE results in kilometers.')
+    parser.add_argument('--kernel', default = 'gaussian', help = 'The kernel of the KDE results.')
+    parser.add_argument('--metric', default = 'euclidean', help = 'The metric of the KDE results.')
+    parser.add_argument('--epsg', type = int, default = 3035, help = 'The EPSG code of the merged map.')
+    parser.add_argument('--levels', type = int, default = 10, choices = [10, 20], help = 'The amount of levels of the merged map.')
+    parser.add_argument('--tile-size', type = float, default = 250000, help = 'The width and height of the tiles of the merge state in meters.')
+    parser.add_argument('--full', action = 'store_true', help = 'Merges all country pairs again and builds the merge state from scratch.')
+    parser.add_argument('--no-state', action = 'store_true', help = 'Merges all country pairs without reading or writing a merge state.')
+    args = parser.parse_args()
+
+    MergedMapOfAllKDEs(args.bandwidth, args.movement_limit, args.kernel, args.metric, args.epsg, args.levels,
+                       incremental = not args.no_state, rebuild = args.full, tile_size = args.tile_size)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Python API of the program, for using it from other Python code such as notebooks or long-running services.
+
+The functions take and return in-memory data, never ask input questions and never exit the process. The border data and the
+mobility data of the .env file are loaded only the first time they are needed and are kept in memory for the following calls.
+
+    from api import compute_pair_kde
+
+    merged = compute_pair_kde(points_df, 'ES_PT', {'analysis_bandwidth': 20000, 'kernel_type': 'gaussian',
+                                                   'metric_type': 'euclidean', 'movement_limit': 300})
+"""
+
+from Borders.border_service import get_border_service
+from KDE.kde_country_organizer import CountryOrganizer
+from KDE.kde_data import KDEdata
+from KDE.kde_engine import KdeEngine
+from KDE.kde_hexagonal import HexagonalKde
+from KDE.kde_hexagonal import kde_engines
+from KDE.kde_parameters import KdeParameters
+from KDE.kde_result_backend import create_result_backend
+from KDE.kde_result_backend import run_parameters
+from Preprocess.preprocess_parameters import PreprocessParameters
+from Preprocess.H3_coordinate_convertion_to_LatLon import H3CoordinateConversion
+from Preprocess.distance_calculator import DistanceMeasure
+from Preprocess.country_assignment import CountryAssignment
+from data_ingestion import cntr_od_column
+
+# The mobility data of the .env file which is already loaded, by EPSG code.
+loaded_kde_data = {}
+
+
+def load_kde_data(program_epsg = 3035):
+
+    """
+    Returns the mobility data of the .env file for the KDE, loading it only the first time it is asked for.
+
+    Args:
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+
+    Returns:
+        KDEdata: The mobility data (df) and the border data (border_service) of the KDE.
+    """
+
+    if program_epsg not in loaded_kde_data:
+        loaded_kde_data[program_epsg] = KDEdata(program_epsg)
+
+    return loaded_kde_data[program_epsg]
+
+
+def compute_pair_kde(points_df, pair, params, program_epsg = 3035, result_backend_type = None, return_countries = False, kde_engine = 'mesh', h3_resolution = 'auto'):
+
+    """
+    Computes the KDE of a country pair and returns the merged KDE polygons clipped to the countries' borders.
+
+    Args:
+        points_df (pd.DataFrame): The mobility data with the CNTR_ID_start, CNTR_ID_end, start_lat, start_lon, end_lat and end_lon
+            columns, and distance_km when the movement is limited. The mobility data of the .env file is used if None.
+        pair (str or list): The country pair, e.g. 'ES_PT' or ['ES', 'PT'] in any order.
+        params (KdeParameters or dict): The analysis_bandwidth, kernel_type, metric_type and movement_limit of the KDE.
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        result_backend_type (str, optional): Also saves the results with this result backend (files, gpkg or parquet).
+        return_countries (bool): Also returns each country's KDE polygons before clipping.
+        kde_engine (str): The engine of the KDE, mesh for the mesh grid or hexagonal for the H3 cells of the hexagonal KDE.
+        h3_resolution (int or str): The H3 resolution of the hexagonal KDE, or auto.
+
+    Returns:
+        gpd.GeoDataFrame: The merged clipped KDE polygons, or a dictionary of the merged and each country's polygons
+            if return_countries is True.
+    """
+
+    if not isinstance(params, KdeParameters):
+        params = KdeParameters(**params)
+
+    if points_df is None:
+        points_df = load_kde_data(program_epsg).df
+
+    elif 'CNTR_OD' not in points_df:
+        points_df = add_cntr_od(points_df)
+
+    cntr_od = '_'.join(sorted(pair.split('_') if isinstance(pair, str) else pair))
+    country1_id, country2_id = cntr_od.split('_')
+
+    border_service = get_border_service(program_epsg)
+    country_1_coordinates = CountryOrganizer(points_df, cntr_od, country1_id, params.extent_of_kde_analysis, program_epsg, params.movement_limit).country_points
+    country_2_coordinates = CountryOrganizer(points_df, cntr_od, country2_id, params.extent_of_kde_analysis, program_epsg, params.movement_limit).country_points
+
+    engine = KdeEngine(params.analysis_bandwidth, params.kernel_type, params.metric_type, program_epsg, border_service)
+    if kde_engine not in kde_engines:
+        raise ValueError(f'Invalid KDE engine {kde_engine}, the options are {", ".join(kde_engines)}.')
+    pair_engine = HexagonalKde(engine, h3_resolution) if kde_engine == 'hexagonal' else engine
+    country_1_polygons, country_2_polygons, merged_layers = pair_engine.pair_kde(country_1_coordinates, country_2_coordinates)
+
+    if result_backend_type is not None:
+        results = [('country', country1_id, country_1_polygons), ('country', country2_id, country_2_polygons), ('merged', None, merged_layers)]
+        parameters = run_parameters(engine.analysis_bandwidth, params.movement_limit, params.kernel_type, params.metric_type, temporal = 'no',
+                                    bootstrap = 0, shared_grid = False, drop_outliers = engine.drop_outliers, kde_engine = kde_engine, h3_resolution = h3_resolution,
+                                    progressive = False, tree_tuning = 'no', extent = engine.extent_method, max_cells = engine.max_cells)
+        create_result_backend(result_backend_type, engine.geometry_output).write_pair(cntr_od, results, parameters)
+
+    if return_countries:
+        return {'merged': merged_layers, country1_id: country_1_polygons, country2_id: country_2_polygons}
+
+    return merged_layers
+
+
+def add_cntr_od(df):
+
+    """
+    Returns a copy of the mobility data with the CNTR_OD column, the country codes of the pair in alphabetical order.
+
+    Args:
+        df (pd.DataFrame): The mobility data with the CNTR_ID_start and CNTR_ID_end columns.
+
+    Returns:
+        pd.DataFrame: The mobility data with the CNTR_OD column.
+    """
+
+    df = df.copy()
+    df['CNTR_OD'] = cntr_od_column(df['CNTR_ID_start'], df['CNTR_ID_end'])
+
+    return df
+
+
+def convert_h3(df):
+
+    """
+    Converts the H3 coordinates of the mobility data to lat/lon coordinates and adds the CNTR_OD column.
+
+    Args:
+        df (pd.DataFrame): The mobility data with the h3_grid_res10_start and h3_grid_res10_end columns. It is not changed.
+
+    Returns:
+        pd.DataFrame: The mobility data with the start_lat, start_lon, end_lat, end_lon and CNTR_OD columns.
+    """
+
+    return H3CoordinateConversion(df.copy(), save_to_csv = False).converted_df
+
+
+def calculate_distances(df, type_of_distance = 'Haversine'):
+
+    """
+    Calculates the distance between the starting and ending point of every row of the mobility data.
+
+    Args:
+        df (pd.DataFrame): The mobility data with lat/lon coordinates. It is not changed.
+        type_of_distance (str): The distance calculation method (Geodesic, Great Circle or Haversine).
+
+    Returns:
+        pd.DataFrame: The mobility data with the distance_km column.
+    """
+
+    return DistanceMeasure(PreprocessParameters(type_of_distance = type_of_distance), df.copy(), save_to_csv = False).df
+
+
+def assign_countries(df, mode = 'assign', program_epsg = 3035, max_distance = 2000):
+
+    """
+    Assigns or validates the country codes of the starting and ending points with the countries' borders.
+
+    Args:
+        df (pd.DataFrame): The mobility data with H3 or lat/lon coordinates. It is not changed.
+        mode (str): Whether to only fill in the missing country codes (assign) or also correct the wrong ones (validate).
+        program_epsg (int): The EPSG code for the program's coordinate reference system.
+        max_distance (float): The maximum distance in meters to the nearest country for points outside every country.
+
+    Returns:
+        pd.DataFrame: The mobility data with the assigned country codes.
+    """
+
+    return CountryAssignment(df.copy(), PreprocessParameters(mode = mode).mode, program_epsg, max_distance, save_to_csv = False).df
@@ -0,0 +1,250 @@
+import os
+import sys
+import itertools
+import matplotlib
+
+# Nobody looks at the plots in a batch run, so they are drawn without a display.
+matplotlib.use('Agg')
+
+from KDE.kde_handler import KdeHandler
+from KDE.kde_parameters import KdeParameters
+from KDE.kde_data import KDEdata
+from Preprocess.preprocess_parameters import PreprocessParameters
+from Preprocess.chunked_preprocess import ChunkedPreprocess
+from Preprocess.read_in_data_for_preprocess import ReadInDataForPreprocess
+from Preprocess.country_assignment import CountryAssignment
+from get_dotenv import result_backend
+from get_dotenv import profile_pairs
+from get_dotenv import progressive_kde
+from get_dotenv import temporal_kde
+from get_dotenv import temporal_bandwidth
+from get_dotenv import bootstrap_replicates
+from get_dotenv import shared_pair_grid
+from get_dotenv import kde_tree_tuning
+from get_dotenv import write_queue_size
+from get_dotenv import extent_method
+from get_dotenv import max_grid_cells
+from get_dotenv import drop_extent_outliers
+from get_dotenv import kde_engine
+from get_dotenv import h3_resolution
+from get_dotenv import pair_source
+from get_dotenv import min_pair_points
+from get_dotenv import pair_order
+
+class BatchRunner():
+
+    """
+    Runs the stages of the program without the input questions, as described in a TOML or YAML job file.
+
+    The job file has a list of jobs which are run in order. Each job has a stage (h3, country, distance or kde) and the parameters
+    of that stage. A kde job is run for every combination of its bandwidths, kernels, metrics and movement limits, and for each
+    combination every country pair of the job is visualized. The data for the KDE is read in only once and shared by all kde jobs.
+
+    An example job file in TOML:
+
+        result_backend = "parquet"
+
+        [[jobs]]
+        stage = "distance"
+        type_of_distance = "Haversine"
+
+        [[jobs]]
+        stage = "kde"
+        pairs = ["ES_PT", "FI_SE"]      # or "all" for the pairs of pair_source (list, data or borders)
+        bandwidths = [20000, 40000]
+        kernels = ["gaussian"]
+        metrics = ["euclidean"]
+        movement_limits = [300, "no"]
+
+    Attributes:
+        job_file (str): The path of the job file.
+        spec (dict): The contents of the job file.
+        result_backend_type (str): The result backend of the KDE polygons, from the job file or the .env file.
+        kde_data (KDEdata): The data of the KDE, read in by the first kde job.
+        failed_jobs (list): The kde parameter sets and country pairs that failed.
+
+    Methods:
+        __init__(self, job_file): Reads in the job file.
+        run(self): Runs all the jobs of the job file.
+        __read_job_file(self): Reads the TOML or YAML job file.
+        __run_preprocess_job(self, job): Runs a h3, country or distance job.
+        __run_kde_job(self, job): Runs a kde job for every combination of its parameters.
+    """
+
+
+    def __init__(self, job_file):
+
+        """
+        Initialize the BatchRunner class and read in the job file.
+
+        Args:
+            job_file (str): The path of the TOML (.toml) or YAML (.yaml or .yml) job file.
+        """
+
+        self.job_file = job_file
+        self.spec = self.__read_job_file()
+        self.result_backend_type = self.spec.get('result_backend', result_backend)
+        self.kde_data = None
+        self.failed_jobs = []
+
+
+    def run(self):
+
+        """
+        Runs all the jobs of the job file in order.
+
+        Returns:
+            bool: True if every job and country pair succeeded.
+        """
+
+        jobs = self.spec.get('jobs', [])
+
+        for number, job in enumerate(jobs, start = 1):
+            print(' ')
+            print(f"Batch job {number}/{len(jobs)}: {job.get('stage')}")
+            print('_____________________________________________________________')
+
+            if job.get('stage') == 'kde':
+                self.__run_kde_job(job)
+
+            else:
+                self.__run_preprocess_job(job)
+
+        print(' ')
+        print(f'Batch run finished, {len(self.failed_jobs)} failed parameter sets.')
+        for failed_job in self.failed_jobs:
+            print(failed_job)
+
+        return not self.failed_jobs
+
+
+    def __read_job_file(self):
+
+        """
+        Reads the TOML or YAML job file, depending on the file extension.
+
+        Returns:
+            dict: The contents of the job file.
+        """
+
+        extension = os.path.splitext(self.job_file)[1]
+
+        if extension == '.toml':
+            try:
+                import tomllib
+            except ModuleNotFoundError:
+                raise ModuleNotFoundError('Reading TOML job files needs Python 3.11 or newer, use a YAML job file instead.')
+
+            with open(self.job_file, 'rb') as file:
+                return tomllib.load(file)
+
+        if extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ModuleNotFoundError:
+                raise ModuleNotFoundError('Reading YAML job files needs PyYAML, install it or use a TOML job file instead.')
+
+            with open(self.job_file) as file:
+                return yaml.safe_load(file)
+
+        raise ValueError(f'Unknown job file type {extension}, the options are .toml, .yaml and .yml.')
+
+
+    def __run_preprocess_job(self, job):
+
+        """
+        Runs a h3, country or distance job with the same classes as the Preprocess stage of the user interface.
+
+        Args:
+            job (dict): The stage and the parameters of the job.
+        """
+
+        parameters = PreprocessParameters(job.get('data_type', 'csv'), job.get('type_of_distance', 'Haversine'), job.get('mode', 'assign'))
+
+        if job['stage'] == 'h3':
+            ChunkedPreprocess('h3', parameters, job.get('chunk_rows', 500_000), job.get('workers'))
+
+        elif job['stage'] == 'country':
+            df = ReadInDataForPreprocess(parameters).df
+            CountryAssignment(df, parameters.mode)
+
+        elif job['stage'] == 'distance':
+            ChunkedPreprocess('distance', parameters, job.get('chunk_rows', 500_000), job.get('workers'))
+
+        else:
+            raise ValueError(f"Unknown stage {job['stage']}, the options are h3, country, distance and kde.")
+
+
+    def __run_kde_job(self, job):
+
+        """
+        Runs a kde job for every combination of its bandwidths, kernels, metrics and movement limits.
+
+        Args:
+            job (dict): The country pairs and the parameter lists of the job.
+        """
+
+        pairs = job.get('pairs', 'all')
+        # With all pairs the KdeHandler finds the country pairs from the pair source.
+        country_list = None if pairs == 'all' else [self.__cntr_od(pair) for pair in pairs]
+
+        combinations = list(itertools.product(job['bandwidths'], job.get('kernels', ['gaussian']),
+                                              job.get('metrics', ['euclidean']), job.get('movement_limits', ['no'])))
+        # Every combination is validated before the first one is run.
+        parameter_sets = [KdeParameters(bandwidth, kernel, metric, movement_limit) for bandwidth, kernel, metric, movement_limit in combinations]
+
+        if self.kde_data is None:
+            # The starting times and H3 cells are read once for all kde jobs if any of them has the spatio-temporal or hexagonal KDE.
+            kde_jobs = [other_job for other_job in self.spec.get('jobs', []) if other_job.get('stage') == 'kde']
+            temporal = any(other_job.get('temporal', temporal_kde) != 'no' for other_job in kde_jobs)
+            h3_cells = any(other_job.get('engine', kde_engine) == 'hexagonal' for other_job in kde_jobs)
+            self.kde_data = KDEdata(3035, temporal, h3_cells)
+
+        for parameters in parameter_sets:
+            print(f"{parameters.analysis_bandwidth}BW, {parameters.kernel_type}, {parameters.metric_type}, movement limit {parameters.movement_limit}, {'all' if country_list is None else len(country_list)} country pairs")
+            kde_handler = KdeHandler(parameters, kde_data = self.kde_data, country_list = country_list,
+                                     result_backend_type = job.get('result_backend', self.result_backend_type),
+                                     profile = job.get('profile', profile_pairs == 'yes'), resume = job.get('resume', True),
+                                     progressive = job.get('progressive', progressive_kde == 'yes'), temporal = job.get('temporal', temporal_kde),
+                                     temporal_bandwidth = job.get('temporal_bandwidth', temporal_bandwidth), bootstrap = job.get('bootstrap', bootstrap_replicates),
+                                     shared_grid = job.get('shared_grid', shared_pair_grid == 'yes'), tree_tuning = job.get('tree_tuning', kde_tree_tuning),
+                                     write_queue = job.get('write_queue', write_queue_size), extent = job.get('extent', extent_method),
+                                     max_cells = job.get('max_grid_cells', max_grid_cells), drop_outliers = job.get('drop_outliers', drop_extent_outliers == 'yes'),
+                                     kde_engine = job.get('engine', kde_engine), h3_resolution = job.get('h3_resolution', h3_resolution),
+                                     pair_source = job.get('pair_source', pair_source), min_points = job.get('min_pair_points', min_pair_points),
+                                     pair_order = job.get('pair_order', pair_order), shard = job.get('shard'))
+
+            for country_od in kde_handler.failed_countries_list:
+                self.failed_jobs.append(f'{country_od} {parameters.analysis_bandwidth}BW_{parameters.movement_limit}movelimit_{parameters.kernel_type}_{parameters.metric_type}')
+
+
+    def __cntr_od(self, pair):
+
+        """Creates the canonical country pair identifier in alphabetical order, from e.g. PT_ES or ['PT', 'ES']."""
+
+        countries = pair.split('_') if isinstance(pair, str) else list(pair)
+
+        return '_'.join(sorted(countries))
+
+
+def batch():
+
+    """
+    Entry point for the batch runs.
+
+    Runs the job file given as the first command line argument, e.g. python batch.py jobs.toml,
+    and exits with a non-zero exit code if any job failed.
+    """
+
+    if len(sys.argv) != 2:
+        print('Usage: python batch.py <job file (.toml, .yaml or .yml)>')
+        sys.exit(2)
+
+    runner = BatchRunner(sys.argv[1])
+    succeeded = runner.run()
+
+    sys.exit(0 if succeeded else 1)
+
+
+if __name__=="__main__":
+    batch()
@@ -0,0 +1,217 @@
+"""
+Fast, typed reading of the mobility data CSV files.
+
+The CSV files are read with the multithreaded CSV reader of pyarrow, only with the columns that the stage needs and with compact
+types for the known columns: the coordinates as float64 (or float32 where half a meter of rounding is good enough), the country codes as categoricals and the
+distance as an integer when every distance is a whole number. The other columns are read with the types that pyarrow infers.
+
+    from data_ingestion import read_mobility_csv, kde_columns
+
+    df = read_mobility_csv(filepath, kde_columns)
+
+For the preprocessing stages, which write every column back to a new CSV file, iter_mobility_csv streams the file in chunks
+and reads the other columns as text, so that they are written back exactly as they were.
+"""
+
+import csv
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+
+# The coordinate columns of the starting and ending points.
+coordinate_columns = ['start_lat', 'start_lon', 'end_lat', 'end_lon']
+
+# The country code columns, which have only a few hundred different values and are read as categoricals.
+country_columns = ['CNTR_ID_start', 'CNTR_ID_end', 'CNTR_OD']
+
+# The columns that the KDE stage needs.
+kde_columns = ['CNTR_ID_start', 'CNTR_ID_end', 'CNTR_OD', 'start_lat', 'start_lon', 'end_lat', 'end_lon', 'distance_km']
+
+# The H3 cells of the starting and ending points, which the hexagonal KDE reads if the data has them.
+h3_columns = ['h3_grid_res10_start', 'h3_grid_res10_end']
+
+# The size of the blocks that the CSV file is read and parsed in, in parallel.
+block_size = 16 * 1024 ** 2
+
+
+def csv_header(filepath):
+
+    """
+    Returns the column names of a CSV file from its first line.
+
+    Args:
+        filepath (str): The path of the CSV file.
+
+    Returns:
+        list: The column names.
+    """
+
+    with open(filepath, newline = '') as file:
+        return next(csv.reader(file))
+
+
+def read_mobility_csv(filepath, columns = None, coordinate_type = 'float64'):
+
+    """
+    Reads the mobility data from a CSV file with compact types.
+
+    Args:
+        filepath (str): The path of the CSV file.
+        columns (list, optional): The columns to read, the columns that are not in the file are left out. Defaults to all columns.
+        coordinate_type (str): The type of the coordinate columns, float64 or float32.
+
+    Returns:
+        pd.DataFrame: The mobility data.
+    """
+
+    header = csv_header(filepath)
+    include_columns = header if columns is None else [column for column in columns if column in header]
+
+    table = pa_csv.read_csv(filepath,
+                            read_options = pa_csv.ReadOptions(use_threads = True, block_size = block_size),
+                            convert_options = pa_csv.ConvertOptions(include_columns = include_columns,
+                                                                    column_types = mobility_column_types(include_columns, coordinate_type),
+                                                                    strings_can_be_null = True))
+
+    df = table.to_pandas(split_blocks = True, self_destruct = True)
+    del table
+
+    if 'distance_km' in df:
+        df['distance_km'] = compact_distance(df['distance_km'])
+
+    return df
+
+
+def iter_mobility_csv(filepath, chunk_rows = 500_000):
+
+    """
+    Streams the mobility data from a CSV file in chunks of about chunk_rows rows.
+
+    The coordinates and country codes are read with the compact types of read_mobility_csv and the other columns, also the distance,
+    as text, so that every chunk has the same types. Only the chunk that is being read is kept in memory.
+
+    Args:
+        filepath (str): The path of the CSV file.
+        chunk_rows (int): About how many rows are in a chunk, the chunks are cut by the size of the rows in bytes.
+
+    Yields:
+        pd.DataFrame: The rows of a chunk.
+    """
+
+    header = csv_header(filepath)
+    column_types = mobility_column_types(header, 'float64', pa.string())
+    if 'distance_km' in column_types:
+        column_types['distance_km'] = pa.string()
+
+    reader = pa_csv.open_csv(filepath,
+                             read_options = pa_csv.ReadOptions(use_threads = True, block_size = max(1024 ** 2, chunk_rows * average_row_bytes(filepath))),
+                             convert_options = pa_csv.ConvertOptions(column_types = column_types, strings_can_be_null = True))
+
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def mobility_column_types(columns, coordinate_type = 'float64', other_type = None):
+
+    """
+    Returns the pyarrow types of the columns of the mobility data.
+
+    Args:
+        columns (list): The column names.
+        coordinate_type (str): The type of the coordinate columns, float64 or float32.
+        other_type (pa.DataType, optional): The type of the other columns, inferred by pyarrow if not given.
+
+    Returns:
+        dict: The pyarrow type of every column with a known or given type.
+    """
+
+    column_types = {}
+    for column in columns:
+        if column in coordinate_columns:
+            column_types[column] = pa.float32() if coordinate_type == 'float32' else pa.float64()
+
+        elif column in country_columns:
+            column_types[column] = pa.dictionary(pa.int32(), pa.string())
+
+        elif column == 'distance_km':
+            column_types[column] = pa.float64()
+
+        elif other_type is not None:
+            column_types[column] = other_type
+
+    return column_types
+
+
+def average_row_bytes(filepath, sample_rows = 1000):
+
+    """
+    Returns the average size of a row of a CSV file in bytes, from the first rows after the header.
+
+    Args:
+        filepath (str): The path of the CSV file.
+        sample_rows (int): How many rows are measured.
+
+    Returns:
+        int: The average size of a row in bytes.
+    """
+
+    with open(filepath, 'rb') as file:
+        file.readline()
+        sizes = [len(line) for line, _ in zip(file, range(sample_rows))]
+
+    return max(1, sum(sizes) // max(1, len(sizes)))
+
+
+def compact_distance(distance):
+
+    """
+    Returns the distances as 32-bit integers if every distance is a whole number, otherwise as 32-bit floats.
+
+    Args:
+        distance (pd.Series): The distances in kilometers.
+
+    Returns:
+        pd.Series: The distances with the compact type.
+    """
+
+    values = distance.to_numpy()
+
+    if not np.isnan(values).any() and np.array_equal(values, np.round(values)):
+        return distance.astype(np.int32)
+
+    return distance.astype(np.float32)
+
+
+def cntr_od_column(start, end):
+
+    """
+    Creates the CNTR_OD column, the country codes of the starting and ending point in alphabetical order joined with an underscore.
+
+    The country pair is worked out once for every different combination of the country codes, not for every row.
+    Rows where either country code is missing get a missing country pair.
+
+    Args:
+        start (pd.Series): The country codes of the starting points.
+        end (pd.Series): The country codes of the ending points.
+
+    Returns:
+        pd.Categorical: The country pairs.
+    """
+
+    start_codes, start_values = pd.factorize(start, use_na_sentinel = False)
+    end_codes, end_values = pd.factorize(end, use_na_sentinel = False)
+
+    combination_codes, combinations = pd.factorize(start_codes.astype(np.int64) * len(end_values) + end_codes)
+    start_combinations = start_values[combinations // len(end_values)]
+    end_combinations = end_values[combinations % len(end_values)]
+    missing = pd.isna(start_combinations) | pd.isna(end_combinations)
+
+    names = ['_'.join(sorted([str(start_value), str(end_value)])) for start_value, end_value in zip(start_combinations, end_combinations)]
+
+    # Both orders of the same countries are the same country pair, the missing combinations get the missing code -1.
+    categories, name_codes = np.unique(np.array(names, dtype = object)[~missing], return_inverse = True)
+    pair_codes = np.full(len(combinations), -1, dtype = np.int64)
+    pair_codes[~missing] = name_codes
+
+    return pd.Categorical.from_codes(pair_codes[combination_codes], categories = categories)
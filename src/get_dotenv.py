@@ -13,6 +13,60 @@ output_all_path = os.environ.get('OUTPUT_ALL')
 
 output_merged_all_path = os.environ.get('OUTPUT_MERGED_ALL')
 
+# Where the KDE polygons are saved: files (a GeoPackage per result), gpkg (one GeoPackage) or parquet (one GeoParquet dataset)
+result_backend = os.environ.get('RESULT_BACKEND', 'files')
+
+# Whether every country pair of a KDE run is profiled with cProfile (yes/no)
+profile_pairs = os.environ.get('PROFILE_PAIRS', 'no')
+
+# Whether the KDE is first previewed from a subsample and then refined until its contours stop changing (yes/no)
+progressive_kde = os.environ.get('PROGRESSIVE_KDE', 'no')
+
+# Whether density grids are also computed for every time slice of the mobility with the spatio-temporal KDE (no, month, weekday or hour_of_week)
+temporal_kde = os.environ.get('TEMPORAL_KDE', 'no')
+
+# The bandwidth of the spatio-temporal KDE's temporal kernel in time slices, e.g. 1 month with the month time step
+temporal_bandwidth = os.environ.get('TEMPORAL_BANDWIDTH', '1')
+
+# The amount of bootstrap replicates of the confidence bands of the KDE contours, 0 for no confidence bands
+bootstrap_replicates = os.environ.get('BOOTSTRAP_REPLICATES', '0')
+
+# Whether both countries of a pair are evaluated on one mesh grid and the pair's combined, log-ratio and difference surfaces are created (yes/no)
+shared_pair_grid = os.environ.get('SHARED_PAIR_GRID', 'no')
+
+# Whether the tree settings of the KDE are tuned, no or the maximum relative error of the density with the tuned settings (e.g. 0.01)
+kde_tree_tuning = os.environ.get('KDE_TREE_TUNING', 'no')
+
+# The amount of result and figure writes that are queued to the background writer at a time, 0 for writing them right away
+write_queue_size = os.environ.get('WRITE_QUEUE_SIZE', '4')
+
+# How the extent of a country's mesh grid is chosen: the bounds of all points, the quantiles of the points or the country's border (bounds, quantile or border)
+extent_method = os.environ.get('EXTENT_METHOD', 'border')
+
+# The share of the points that can be left outside the extent on every side with the quantile extent method
+extent_quantile = os.environ.get('EXTENT_QUANTILE', '0.001')
+
+# The maximum amount of cells of a mesh grid, the extent is shrunk towards the median of the points if the grid would be bigger, 0 for no maximum
+max_grid_cells = os.environ.get('MAX_GRID_CELLS', '4000000')
+
+# Whether the points outside the extent of the mesh grid are left out of the KDE (yes/no)
+drop_extent_outliers = os.environ.get('DROP_EXTENT_OUTLIERS', 'no')
+
+# The engine of the KDE, the mesh grid of scikit-learn's KDE or the H3 cells of the hexagonal KDE (mesh or hexagonal)
+kde_engine = os.environ.get('KDE_ENGINE', 'mesh')
+
+# The H3 resolution of the hexagonal KDE, auto for the coarsest resolution with at least three cells per bandwidth
+h3_resolution = os.environ.get('H3_RESOLUTION', 'auto')
+
+# Where the country pairs of a run of all pairs come from: lst_of_cntr_od, every pair in the data or the neighbouring countries with data (list, data or borders)
+pair_source = os.environ.get('PAIR_SOURCE', 'list')
+
+# The minimum amount of points of each country of a pair found in the data
+min_pair_points = os.environ.get('MIN_PAIR_POINTS', '10')
+
+# The order of the country pairs of a run of all pairs, from the most expensive to the cheapest or in the order of the list (cost or list)
+pair_order = os.environ.get('PAIR_ORDER', 'cost')
+
 
 
 
@@ -29,3 +83,5 @@ file_name_for_output_H3_DataHandling = os.environ.get('FILE_NAME_FOR_OUTPUT_H3_D
 
 file_name_for_input_distance_calculator = os.environ.get('FILE_NAME_FOR_INPUT_DISTANCE_CALCULATOR')
 
+file_name_for_output_country_assignment = os.environ.get('FILE_NAME_FOR_OUTPUT_COUNTRY_ASSIGNMENT', 'mobility_data_with_assigned_country_codes.csv')
+
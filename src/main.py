@@ -1,10 +1,10 @@
-from KDE.kde_handler import KdeHandler
 from KDE.kde_questions import KdeQuestions
 from Preprocess.distance_questions import DistQuestions
 from Preprocess.H3_questions import H3Questions
-from Preprocess.distance_calculator import DistanceMeasure
-from Preprocess.H3_coordinate_convertion_to_LatLon import H3CoordinateConversion
-from Preprocess.read_in_data_for_preprocess import ReadInDataForPreprocess
+from Preprocess.country_assignment_questions import CountryAssignmentQuestions
+
+# The stages which need pandas, geopandas, scikit-learn, matplotlib, h3 or geopy are imported only when the stage is run,
+# so that the menu is shown without waiting for those libraries to be imported.
 
 class Main():
 
@@ -12,6 +12,7 @@ class Main():
     The main class for controlling program flow and initialization.
 
     This class handles user interaction and initializes various components of the program based on the user's input.
+    The classes of a stage are imported when the stage is initialized, only the input questions are imported at startup.
 
     Attributes:
         ui: An instance of the user interface class.
@@ -22,6 +23,7 @@ class Main():
         __initialize_kde(self): Initializes KDE (Kernel Density Estimation) module.
         __initialize_distances(self): Initializes distance calculation module.
         __initialize_H3(self): Initializes H3 conversion module.
+        __initialize_country_assignment(self): Initializes the country code assignment module.
     """
 
 
@@ -63,6 +65,9 @@ class Main():
             if state == "H3 to geo":
                 self.__initialize_H3()
 
+            if state == "COUNTRY":
+                self.__initialize_country_assignment()
+
 
     def __initialize_kde(self):
 
@@ -70,11 +75,14 @@ class Main():
         Initialize the KDE (Kernel Density Estimation) module.
 
         This method initializes the KDE module by creating first an instances of the KdeQuestions class 
-        and then an instance of the KdeHandler class with those input questions as parameter.
+        and then an instance of the KdeHandler class with those input questions as parameter. The program exits when the KDE is done.
         """
 
         kde_questions = KdeQuestions()
-        kde_handler = KdeHandler(kde_questions)         
+
+        from KDE.kde_handler import KdeHandler
+        kde_handler = KdeHandler(kde_questions)
+        exit()
             
     
     def __initialize_distances(self):
@@ -84,7 +92,7 @@ class Main():
 
         This method initializes the distance calculation module by first creating a instance of the 
         DistQuestions class and then asks the user whether to start the program or not, and the if the program is to be run, 
-        an instance is created of the DistanceMeasure class with those input questions as parameters.
+        the distance calculation is run chunk by chunk on all CPU cores with the ChunkedPreprocess class with those input questions as parameters.
         """
 
         type_of_distance = DistQuestions()
@@ -92,7 +100,8 @@ class Main():
         dist = self.ui.start_program_question()
 
         if dist == 'yes':
-            distance = DistanceMeasure(type_of_distance)
+            from Preprocess.chunked_preprocess import ChunkedPreprocess
+            distance = ChunkedPreprocess('distance', type_of_distance)
 
     
     def __initialize_H3(self):
@@ -102,9 +111,8 @@ class Main():
 
         This method initializes the H3 conversion module, by creating an instance of the H3Questions class 
         which asks the user of the data type. It then asks the user whether to start the program or not, 
-        and if the program is to be run, an instance is first created of the ReadInDataForPreprocess 
-        with the data_type as parameter, then the loaded in data is saved as an DataFrame 
-        and then an instance of the H3CoordinateConversion class is created with the DataFrame as parameter.
+        and if the program is to be run, the data is converted chunk by chunk on all CPU cores with the ChunkedPreprocess class, 
+        which reads the data in chunks and runs the H3CoordinateConversion class on every chunk.
         """
 
         data_type = H3Questions()
@@ -112,9 +120,31 @@ class Main():
         start = self.ui.start_program_question()
 
         if start == 'yes':
+            from Preprocess.chunked_preprocess import ChunkedPreprocess
+            conversion = ChunkedPreprocess('h3', data_type)
+
+
+    def __initialize_country_assignment(self):
+
+        """
+        Initialize the country code assignment module.
+
+        This method initializes the country code assignment module, by creating an instance of the CountryAssignmentQuestions class 
+        which asks the user of the data type and whether to only assign missing country codes or also validate them. It then asks the user 
+        whether to start the program or not, and if the program is to be run, the data is read in with the ReadInDataForPreprocess class 
+        and an instance of the CountryAssignment class is created with the DataFrame and the mode as parameters.
+        """
+
+        assignment_questions = CountryAssignmentQuestions()
+
+        start = self.ui.start_program_question()
+
+        if start == 'yes':
+            from Preprocess.read_in_data_for_preprocess import ReadInDataForPreprocess
+            from Preprocess.country_assignment import CountryAssignment
 
-            data = ReadInDataForPreprocess(data_type)
+            data = ReadInDataForPreprocess(assignment_questions)
             df = data.df
-            conversion = H3CoordinateConversion(df)
+            assignment = CountryAssignment(df, assignment_questions.mode)
     
             
\ No newline at end of file
@@ -73,13 +73,15 @@ state2 = UiState(2, 'There are various different parameters that you can use', '
 state3 = UiState(3, 'Which of the data preprocessing tools do you want to use', 'Preprocess data for KDE', 'Preprocess', 'What would you like to do? ')
 state4 = UiState(4, '1. Convert H3 coordinates to lat/lon and filter data', 'Convert H3 coordinates to lat/lon and filter data', 'H3 to geo')
 state5 = UiState(5, '3. Calculate the distances between points in various ways', 'Calculate the distances between points', 'DIST')
+state6 = UiState(6, '2. Assign or validate the country codes of the points with the country borders', 'Assign or validate country codes of the points', 'COUNTRY')
 
 state1.add_children([state2, state3])
 state2.add_parent(state1)
-state3.add_children([state4, state5])
+state3.add_children([state4, state6, state5])
 state3.add_parent(state1)
 state4.add_parent(state3)
 state5.add_parent(state3)
+state6.add_parent(state3)
 
 # Create an instance of the Ui class
 ui = Ui(state1)